@@ -1,13 +1,44 @@
-from flask import Flask
+from flask import Flask, request, abort, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 import os
-import threading
+import logging
 
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
+
+# Режим получения обновлений: polling (отдельный процесс worker) или webhook (этот веб-процесс)
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+
+webhook_bot = None
+# __mp_main__ — повторный импорт этого модуля процессами-обработчиками при запуске через python app.py
+if BOT_MODE == "webhook" and __name__ != "__mp_main__":
+    from webhook import WebhookBot, WEBHOOK_PATH
+    from sharding import ShardedBot, BOT_WORKERS
+
+    if BOT_WORKERS > 1:
+        # Обновления распределяются по BOT_WORKERS процессам по пользователю
+        webhook_bot = ShardedBot(os.environ["TELEGRAM_BOT_TOKEN"])
+    else:
+        from bot import build_application
+        webhook_bot = WebhookBot(build_application(os.environ["TELEGRAM_BOT_TOKEN"]))
+    webhook_bot.start()
+
+    @app.route(WEBHOOK_PATH, methods=['POST'])
+    def telegram_webhook():
+        if not webhook_bot.verify(request.headers.get('X-Telegram-Bot-Api-Secret-Token')):
+            abort(403)
+        webhook_bot.submit(request.get_json(force=True))
+        return "", 200
 
 @app.route('/')
 def home():
     return "Бот работает!", 200
 
+# Метрики Prometheus (в режиме webhook с одним обработчиком включают метрики бота)
+@app.route('/metrics')
+def metrics():
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,102 @@
+# Память на одну локацию: прогноз и сохраненная локация в виде вложенных словарей
+# (прежний формат) и в виде компактных записей records.
+# Запуск: python benchmarks/bench_records.py [количество_локаций]
+import os
+import sys
+import time
+import random
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from records import Location, Current, HourlySeries, Forecast
+from forecast_aggregate import to_columns, aggregate_daily
+from weather_stub import current_payload, forecast_payload
+
+
+# Прогноз в прежнем формате: словари для текущей погоды, дней и каждого 3-часового интервала
+def legacy_forecast(current_data, forecast_data):
+    return {
+        "current": {
+            "temp": current_data["main"]["temp"],
+            "feels_like": current_data["main"]["feels_like"],
+            "pressure": current_data["main"]["pressure"],
+            "humidity": current_data["main"]["humidity"],
+            "wind_speed": current_data["wind"]["speed"],
+            "wind_deg": current_data["wind"]["deg"],
+            "clouds": current_data["clouds"]["all"]
+        },
+        "daily": [day.to_json() for day in aggregate_daily(to_columns(forecast_data), max_days=3)[0]],
+        "hourly": [
+            {
+                "dt": item["dt"],
+                "temp": item["main"]["temp"],
+                "pressure": item["main"]["pressure"],
+                "humidity": item["main"]["humidity"],
+                "wind_speed": item["wind"]["speed"],
+                "wind_deg": item["wind"]["deg"],
+                "clouds": item["clouds"]["all"],
+                "rain": item.get("rain", {}).get("3h", 0)
+            }
+            for item in forecast_data["list"]
+        ],
+        "timezone": forecast_data["city"]["timezone"],
+        "fetched_at": time.time()
+    }
+
+
+def record_forecast(current_data, forecast_data):
+    return Forecast(
+        Current.from_api(current_data),
+        tuple(aggregate_daily(to_columns(forecast_data), max_days=3)[0]),
+        HourlySeries.from_api(forecast_data),
+        forecast_data["city"]["timezone"],
+        time.time()
+    )
+
+
+def legacy_location(index):
+    return {"name": f"Город{index}", "country": "RU", "lat": 55.75, "lon": 37.62,
+            "added_at": "2024-05-01 10:00:00"}
+
+
+def record_location(index):
+    return Location(f"Город{index}", "RU", 55.75, 37.62, 1714546800)
+
+
+# Память, занятая объектами, созданными build(i) для каждого из payloads
+def measure(build, payloads):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [build(*payload) for payload in payloads]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del objects
+    return used
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    now = time.time()
+    payloads = []
+    for _ in range(count):
+        lat, lon = round(random.uniform(40, 70), 2), round(random.uniform(20, 140), 2)
+        payloads.append((current_payload("Город", lat, lon, now), forecast_payload(lat, lon, now)))
+
+    legacy = measure(legacy_forecast, payloads)
+    records = measure(record_forecast, payloads)
+    legacy_locations = measure(legacy_location, [(i,) for i in range(count)])
+    record_locations = measure(record_location, [(i,) for i in range(count)])
+
+    print(f"Локаций: {count}")
+    print(f"Прогноз:  словари {legacy / count:8.0f} Б, записи {records / count:8.0f} Б "
+          f"на локацию ({legacy / records:.1f}x)")
+    print(f"Локация:  словари {legacy_locations / count:8.0f} Б, записи {record_locations / count:8.0f} Б "
+          f"на локацию ({legacy_locations / record_locations:.1f}x)")
+    print(f"Итого для {count} локаций: {legacy / 2 ** 20:.1f} МБ -> {records / 2 ** 20:.1f} МБ")
+
+
+if __name__ == "__main__":
+    main()
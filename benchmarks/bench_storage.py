@@ -0,0 +1,75 @@
+# Сравнение хранилищ пользователей: старый JSON-файл, SQLite и кэш с журналом поверх SQLite.
+# Запуск: python benchmarks/bench_storage.py [количество_пользователей] [количество_обращений]
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import JsonUserStore, SqliteUserStore, JournaledUserStore
+
+
+# Тестовые данные: у каждого пользователя по две локации
+def make_users(count):
+    return {
+        str(user_id): {
+            "locations": [
+                {"name": "Москва", "country": "RU", "lat": 55.75, "lon": 37.62,
+                 "added_at": "2024-05-01 10:00:00"},
+                {"name": "Сочи", "country": "RU", "lat": 43.6, "lon": 39.73,
+                 "added_at": "2024-05-02 10:00:00"}
+            ]
+        }
+        for user_id in range(count)
+    }
+
+
+# Одно обращение пользователя: чтение, изменение и сохранение
+def run_interactions(store, user_ids, interactions):
+    started = time.perf_counter()
+    for _ in range(interactions):
+        user_id = random.choice(user_ids)
+        user = store.get_user(user_id)
+        user["locations"].append({"name": "Тверь", "country": "RU", "lat": 56.86, "lon": 35.9,
+                                  "added_at": "2024-05-03 10:00:00"})
+        user["locations"].pop()
+        store.save_user(user_id, user)
+    return time.perf_counter() - started
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    interactions = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    data = make_users(users)
+    user_ids = list(data)
+
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, "user_data.json")
+        with open(json_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False, indent=4)
+
+        json_time = run_interactions(JsonUserStore(json_path), user_ids, interactions)
+
+        started = time.perf_counter()
+        sqlite_store = SqliteUserStore(os.path.join(directory, "user_data.db"), json_path)
+        migration_time = time.perf_counter() - started
+        sqlite_time = run_interactions(sqlite_store, user_ids, interactions)
+
+        journal_store = JournaledUserStore(sqlite_store, os.path.join(directory, "user_data.journal"))
+        journal_time = run_interactions(journal_store, user_ids, interactions)
+        journal_store.flush()
+        journal_store.close()
+
+    print(f"Пользователей: {users}, обращений: {interactions}")
+    print(f"JSON:   {json_time / interactions * 1000:.3f} мс на обращение")
+    print(f"SQLite: {sqlite_time / interactions * 1000:.3f} мс на обращение "
+          f"(миграция {migration_time:.2f} с)")
+    print(f"Журнал: {journal_time / interactions * 1000:.3f} мс на обращение")
+    print(f"Ускорение SQLite: {json_time / sqlite_time:.1f}x, журнала: {json_time / journal_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
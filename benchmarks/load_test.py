@@ -0,0 +1,298 @@
+# Нагрузочный тест бота без сети: синтетические обновления Telegram проходят через настоящий
+# ConversationHandler из build_application, Bot API подменяется локальным транспортом,
+# OpenWeatherMap — заглушкой weather_stub с настраиваемой задержкой и долей ошибок.
+#
+# Запуск:
+#   python benchmarks/load_test.py --users 200 --concurrency 50 --latency-ms 80 --error-rate 0.02
+#   python benchmarks/load_test.py --save-baseline benchmarks/load_baseline.json
+#   python benchmarks/load_test.py --baseline benchmarks/load_baseline.json
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import itertools
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+from metrics import callback_kind
+from weather_stub import WeatherStub
+
+# Сценарий одного пользователя: (вид обновления, текст или callback_data)
+SCENARIO = (
+    ("command", "/start"),
+    ("callback", "add_location"),
+    ("text", None),
+    ("callback", "show_forecast"),
+    ("callback", "forecast_0"),
+    ("callback", "show_locations"),
+    ("callback", "location_0"),
+    ("callback", "delete_location"),
+    ("callback", "remove_0"),
+)
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Nibble", "username": "nibble_load_bot"}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+# Транспорт Bot API, который ничего не отправляет в сеть и отвечает как Telegram.
+# Считает вызовы методов и ответы с сообщением о недоступности погоды.
+class FakeTelegramRequest(BaseRequest):
+    def __init__(self):
+        self.calls = {}
+        self.degraded = 0
+        self._message_ids = itertools.count(1000)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        parameters = request_data.parameters if request_data else {}
+        if api_method == "getMe":
+            result = BOT_USER
+        elif api_method in ("sendMessage", "editMessageText"):
+            text = parameters.get("text", "")
+            if text.startswith("❌"):
+                self.degraded += 1
+            result = {
+                "message_id": parameters.get("message_id") or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": parameters.get("chat_id", 0), "type": "private"},
+                "from": BOT_USER,
+                "text": text
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+# Фабрика синтетических обновлений в формате Bot API
+class UpdateFactory:
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"Load{user_id}"}
+
+    def _chat(self, user_id):
+        return {"id": user_id, "type": "private"}
+
+    def message(self, user_id, text):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": self._chat(user_id),
+            "from": self._user(user_id),
+            "text": text
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def callback(self, user_id, data):
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._message_ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": self._chat(user_id),
+                    "from": BOT_USER,
+                    "text": "menu"
+                }
+            }
+        }
+
+
+class LoadTest:
+    def __init__(self, application, users, rounds, concurrency, cities):
+        self.application = application
+        self.users = users
+        self.rounds = rounds
+        self.concurrency = concurrency
+        self.cities = cities
+        self.factory = UpdateFactory()
+        # вид шага -> список задержек в секундах
+        self.latencies = {}
+        self.failures = 0
+
+    async def _process(self, step, data):
+        update = Update.de_json(data, self.application.bot)
+        started = time.perf_counter()
+        try:
+            await self.application.process_update(update)
+        except Exception:
+            self.failures += 1
+        self.latencies.setdefault(step, []).append(time.perf_counter() - started)
+
+    async def _run_user(self, semaphore, user_id):
+        async with semaphore:
+            for _ in range(self.rounds):
+                for kind, value in SCENARIO:
+                    if kind == "callback":
+                        await self._process(callback_kind(value), self.factory.callback(user_id, value))
+                    elif kind == "text":
+                        city = f"Город{user_id % self.cities}"
+                        await self._process("location_text", self.factory.message(user_id, city))
+                    else:
+                        await self._process(value[1:], self.factory.message(user_id, value))
+
+    async def run(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            self._run_user(semaphore, 100000 + user_id) for user_id in range(self.users)
+        ))
+        return time.perf_counter() - started
+
+
+def summarize(latencies, duration):
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "updates": len(all_latencies),
+        "duration": round(duration, 3),
+        "throughput": round(len(all_latencies) / duration, 1) if duration else 0.0,
+        "p50_ms": round(percentile(all_latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(all_latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(all_latencies, 0.99) * 1000, 2),
+        "steps": {
+            step: {
+                "count": len(values),
+                "mean_ms": round(statistics.fmean(values) * 1000, 2),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 2)
+            }
+            for step, values in sorted(latencies.items())
+        }
+    }
+
+
+# Сравнение с сохраненным прогоном: возвращает False, если задержка или пропускная способность
+# ухудшились сильнее допустимого
+def compare(result, baseline, tolerance):
+    ok = True
+    print(f"\nСравнение с базовым прогоном (допуск {tolerance:.0%}):")
+    for key, higher_is_better in (("throughput", True), ("p50_ms", False), ("p95_ms", False),
+                                  ("p99_ms", False), ("max_rss_mb", False)):
+        old, new = baseline.get(key), result.get(key)
+        if not old:
+            continue
+        change = (new - old) / old
+        regressed = -change > tolerance if higher_is_better else change > tolerance
+        ok = ok and not regressed
+        print(f"  {key:<11} {old:>10} -> {new:<10} {change:+.1%}{'  РЕГРЕССИЯ' if regressed else ''}")
+    return ok
+
+
+async def run(args):
+    stub = WeatherStub(latency=args.latency_ms / 1000, error_rate=args.error_rate, seed=args.seed)
+    os.environ["WEATHER_API_BASE_URL"] = await stub.start()
+    os.environ.setdefault("OPENWEATHER_API_KEY", "load-test")
+    # Квота реального тарифа ограничила бы не бота, а заглушку
+    os.environ.setdefault("OWM_CALLS_PER_MINUTE", "1000000")
+    os.environ.setdefault("OWM_CALLS_PER_DAY", "100000000")
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Хранилища пользователей и геокодирования создаются в текущем каталоге
+        os.chdir(directory)
+        import bot
+        import logging
+        logging.getLogger().setLevel(logging.WARNING)
+
+        fake_request = FakeTelegramRequest()
+        application = bot.build_application("123456:LOAD-TEST", request=fake_request)
+        await application.initialize()
+        try:
+            test = LoadTest(application, args.users, args.rounds, args.concurrency, args.cities)
+            duration = await test.run()
+        finally:
+            await application.shutdown()
+            await bot.shutdown(application)
+            await stub.stop()
+
+    result = summarize(test.latencies, duration)
+    result.update({
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "latency_ms": args.latency_ms,
+        "error_rate": args.error_rate,
+        "upstream_requests": stub.requests,
+        "upstream_errors": stub.errors,
+        "degraded_replies": fake_request.degraded,
+        "failed_updates": test.failures,
+        "telegram_calls": fake_request.calls,
+        # Пиковая память процесса (ru_maxrss в Linux — в килобайтах)
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с заглушками Telegram и OpenWeatherMap")
+    parser.add_argument("--users", type=int, default=200, help="виртуальных пользователей")
+    parser.add_argument("--rounds", type=int, default=1, help="повторов сценария на пользователя")
+    parser.add_argument("--concurrency", type=int, default=50, help="пользователей одновременно")
+    parser.add_argument("--cities", type=int, default=20, help="различных населенных пунктов")
+    parser.add_argument("--latency-ms", type=float, default=80, help="средняя задержка заглушки погоды")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503 от заглушки")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save-baseline", metavar="PATH", help="сохранить результат как базовый")
+    parser.add_argument("--baseline", metavar="PATH", help="сравнить с базовым результатом")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение")
+    args = parser.parse_args()
+    for option in ("save_baseline", "baseline"):
+        if getattr(args, option):
+            setattr(args, option, os.path.abspath(getattr(args, option)))
+
+    result = asyncio.run(run(args))
+
+    print(f"Обновлений: {result['updates']} за {result['duration']} с "
+          f"({result['throughput']} обновлений/с)")
+    print(f"Задержка: p50 {result['p50_ms']} мс, p95 {result['p95_ms']} мс, p99 {result['p99_ms']} мс")
+    print(f"Запросов к погоде: {result['upstream_requests']} (ошибок {result['upstream_errors']}), "
+          f"ответов о недоступности: {result['degraded_replies']}, сбоев обработки: {result['failed_updates']}")
+    print(f"Пиковая память: {result['max_rss_mb']} МБ")
+    for step, values in result["steps"].items():
+        print(f"  {step:<16} {values['count']:>6}  среднее {values['mean_ms']:>8} мс  p95 {values['p95_ms']:>8} мс")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as file:
+            json.dump(result, file, ensure_ascii=False, indent=4)
+        print(f"Базовый результат сохранен в {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+        if not compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# Локальная заглушка OpenWeatherMap для нагрузочных тестов: отвечает на /weather и /forecast
+# правдоподобными данными с настраиваемой задержкой и долей ошибок 5xx.
+# Запуск отдельно: python benchmarks/weather_stub.py [порт] [задержка_мс] [доля_ошибок]
+import sys
+import json
+import time
+import random
+import asyncio
+from urllib.parse import urlsplit, parse_qs
+
+
+# Координаты вымышленных населенных пунктов выводятся из названия, чтобы геокодирование было стабильным
+def location_for(name):
+    seed = sum(ord(char) for char in name)
+    return {"lat": round(42 + seed % 2000 / 100, 2), "lon": round(30 + seed % 3000 / 100, 2)}
+
+
+def current_payload(name, lat, lon, now):
+    rng = random.Random(f"{lat}:{lon}:{int(now) // 600}")
+    return {
+        "id": int(abs(lat * 1000 + lon)),
+        "name": name,
+        "coord": {"lat": lat, "lon": lon},
+        "sys": {"country": "RU"},
+        "dt": int(now),
+        "timezone": 10800,
+        "main": {
+            "temp": rng.uniform(-5, 25),
+            "feels_like": rng.uniform(-8, 25),
+            "pressure": rng.uniform(995, 1030),
+            "humidity": rng.uniform(40, 95)
+        },
+        "wind": {"speed": rng.uniform(0, 12), "deg": rng.uniform(0, 360)},
+        "clouds": {"all": rng.randint(0, 100)}
+    }
+
+
+def forecast_payload(lat, lon, now):
+    rng = random.Random(f"{lat}:{lon}:{int(now) // 10800}")
+    start = int(now) // 10800 * 10800 + 10800
+    items = []
+    for step in range(40):
+        dt = start + step * 10800
+        item = {
+            "dt": dt,
+            "dt_txt": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(dt)),
+            "main": {
+                "temp": rng.uniform(-5, 25),
+                "pressure": rng.uniform(995, 1030),
+                "humidity": rng.uniform(40, 95)
+            },
+            "wind": {"speed": rng.uniform(0, 12), "deg": rng.uniform(0, 360)},
+            "clouds": {"all": rng.randint(0, 100)}
+        }
+        if rng.random() < 0.3:
+            item["rain"] = {"3h": rng.uniform(0, 4)}
+        items.append(item)
+    return {"list": items, "city": {"timezone": 10800}}
+
+
+# HTTP/1.1 сервер с keep-alive поверх asyncio, без сторонних зависимостей
+class WeatherStub:
+    def __init__(self, latency=0.05, jitter=0.5, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        # Населенные пункты из ответов /weather: id -> (название, lat, lon), для /group
+        self.cities = {}
+        self._server = None
+
+    # Ответ на один запрос: (статус, тело)
+    def respond(self, path, query):
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            return 503, {"cod": 503, "message": "stub error"}
+        now = time.time()
+        if path.endswith("/weather"):
+            if "q" in query:
+                name = query["q"][0]
+                coords = location_for(name)
+                lat, lon = coords["lat"], coords["lon"]
+            else:
+                name, lat, lon = "Stub", float(query["lat"][0]), float(query["lon"][0])
+            payload = current_payload(name, lat, lon, now)
+            self.cities[payload["id"]] = (name, lat, lon)
+            return 200, payload
+        if path.endswith("/group"):
+            cities = [self.cities.get(int(city_id)) for city_id in query["id"][0].split(",")]
+            items = [current_payload(*city, now) for city in cities if city is not None]
+            return 200, {"cnt": len(items), "list": items}
+        if path.endswith("/forecast"):
+            return 200, forecast_payload(float(query["lat"][0]), float(query["lon"][0]), now)
+        return 404, {"cod": "404", "message": "not found"}
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                self.requests += 1
+                target = urlsplit(request_line.split()[1].decode())
+                delay = self.latency * (1 + self.jitter * (self.random.random() * 2 - 1))
+                await asyncio.sleep(max(0.0, delay))
+                status, payload = self.respond(target.path, parse_qs(target.query))
+                body = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    # Запуск на свободном порту (port=0); возвращает базовый URL для WeatherClient
+    async def start(self, host="127.0.0.1", port=0):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        port = self._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}/data/2.5"
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+
+async def serve(port, latency, error_rate):
+    stub = WeatherStub(latency=latency, error_rate=error_rate)
+    print(f"Заглушка погоды: {await stub.start(port=port)}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 8099,
+        float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.05,
+        float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+    ))
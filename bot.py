@@ -1,19 +1,49 @@
 import os
+import io
 import logging
-import json
-from datetime import datetime, timedelta
-import requests
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ConversationHandler, filters, ContextTypes
+import time
+import asyncio
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ConversationHandler, InlineQueryHandler, filters, ContextTypes
+from weather_client import WeatherClient, WeatherAPIError
+from forecast_cache import ForecastCache, CURRENT, DAILY, STALE_MAX_AGE, normalize_coords
+from circuit_breaker import RESET_TIMEOUT
+from singleflight import SingleFlight
+from storage import open_user_store
+from geocode_cache import GeocodeCache, NOT_FOUND
+from forecast_aggregate import to_columns, aggregate_daily
+from records import Location, Current, DailyForecast, HourlySeries, Forecast
+from moon import get_moon_phase
+from prefetch import ForecastPrefetcher, PREFETCH_INTERVAL
+from digest import DigestBuilder, collect_subscribers, digest_time, DIGEST_TIME
+from fanout import FanoutSender
+from render import (
+    ForecastRenderer, MAIN_MENU, BACK_TO_MENU, CANCEL_MENU, BACK_TO_MENU_ROW, DELETE_LOCATION_ROW,
+    DIGEST_ON_ROW, DIGEST_OFF_ROW, CANCEL_DELETE_ROW, GREETING_TEXT, ADD_LOCATION_TEXT, NO_LOCATIONS_TEXT,
+    HELP_TEXT, HELP_MENU_TEXT, MENU_PROMPT, get_wind_direction, stale_notice, city_keyboard
+)
+from metrics import (
+    observe_handler, observe_storage, ObservedRequest, register_state_gauges, start_metrics_server,
+    TELEGRAM_POOL_SIZE
+)
+from quota import QuotaGovernor, request_priority, GEOCODING, BACKGROUND
+from sharding import shard_user_store, current_shard
+from forecast_snapshot import ForecastSnapshot, FORECAST_SNAPSHOT_INTERVAL
+from city_index import CityIndex
+from compare import LocationComparison
+from profiling import (
+    SamplingProfiler, install_trace_logging, ADMIN_USER_IDS, PROFILE_DEFAULT_SECONDS, PROFILE_MAX_SECONDS
+)
 # # Добавьте эти строки для загрузки переменных из .env файла.При деплое закомментировать
 # from dotenv import load_dotenv
 # # Загружаем переменные окружения из .env файла. При деплое закомментировать
 # load_dotenv()
 
 
-# Настройка логирования
+# Настройка логирования: в каждой записи id трассы обновления (номер обновления Telegram)
+install_trace_logging()
 logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    format='%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s',
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
@@ -21,168 +51,132 @@ logger = logging.getLogger(__name__)
 # Константы для ConversationHandler
 CHOOSING_ACTION, ADDING_LOCATION, SELECTING_LOCATION = range(3)
 
-# Файл для хранения данных пользователей
-USER_DATA_FILE = "user_data.json"
+# Сообщение, когда сервис погоды недоступен и сохраненного прогноза нет
+WEATHER_UNAVAILABLE_TEXT = (
+    "❌ Сервис погоды сейчас недоступен. Пожалуйста, попробуй запросить прогноз через несколько минут.\n\n"
+    "Выберите действие из меню ниже:"
+)
+
+# Сколько обновлений Telegram обрабатывается одновременно
+BOT_CONCURRENCY = int(os.environ.get("BOT_CONCURRENCY", "8"))
 
 # API ключ для OpenWeatherMap
 WEATHER_API_KEY = os.environ.get("OPENWEATHER_API_KEY")
 
-# Загрузка данных пользователей из файла
-def load_user_data():
-    if os.path.exists(USER_DATA_FILE):
-        with open(USER_DATA_FILE, 'r', encoding='utf-8') as file:
-            return json.load(file)
-    return {}
+# Учет квоты OpenWeatherMap, общий для всех запросов погоды
+weather_quota = QuotaGovernor()
+
+# Общий асинхронный клиент погоды с пулом соединений
+weather_client = WeatherClient(WEATHER_API_KEY, quota=weather_quota)
+
+# Общий для всех пользователей кэш прогнозов по координатам
+forecast_cache = ForecastCache()
+
+# Снимок кэша прогнозов на диске: после перезапуска прогнозы берутся из него
+# по мере обращения, без волны запросов к API
+forecast_snapshot = ForecastSnapshot()
+forecast_cache.snapshot = forecast_snapshot
+
+# Объединение одновременных запросов погоды для одной и той же локации
+weather_requests = SingleFlight()
+
+# Локации, для которых отдавался устаревший прогноз: normalized coords -> (lat, lon)
+stale_locations = {}
+
+# id населенных пунктов из ответов /weather по координатам: normalized coords -> city_id
+city_ids = {}
+
+# Постоянный кэш поиска населенных пунктов по названию
+geocode_cache = GeocodeCache()
 
-# Сохранение данных пользователей в файл
-def save_user_data(data):
-    with open(USER_DATA_FILE, 'w', encoding='utf-8') as file:
-        json.dump(data, file, ensure_ascii=False, indent=4)
+# Хранилище данных пользователей (в многопроцессном режиме фоновые задачи
+# обрабатывают только пользователей своего процесса)
+user_store = shard_user_store(open_user_store())
+
+# Фоновое обновление прогнозов для сохраненных локаций
+prefetcher = ForecastPrefetcher(
+    lambda lat, lon, forecast: refresh_weather_forecast(lat, lon, forecast),
+    forecast_cache, user_store,
+    refresh_current=lambda locations: refresh_current_weather(locations)
+)
+
+# Готовые тексты прогноза клёва, общие для всех пользователей
+forecast_renderer = ForecastRenderer(get_moon_phase)
+
+# Сравнение всех локаций пользователя
+location_comparison = LocationComparison(
+    lambda lat, lon: get_weather_forecast(lat, lon), get_moon_phase
+)
+
+# Локальный индекс населенных пунктов для inline-поиска
+city_index = CityIndex()
+
+# Сколько секунд Telegram может кэшировать ответы на inline-запросы
+INLINE_CACHE_TIME = int(os.environ.get("INLINE_CACHE_TIME", "3600"))
 
 # Получение данных пользователя
-def get_user_data(user_id, user_data):
-    user_id_str = str(user_id)
-    if user_id_str not in user_data:
-        user_data[user_id_str] = {
-            "locations": []
-        }
-    return user_data[user_id_str]
+@observe_storage("get_user")
+def get_user_data(user_id):
+    return user_store.get_user(user_id)
+
+# Сохранение данных пользователя
+@observe_storage("save_user")
+def save_user_data(user_id, user):
+    user_store.save_user(user_id, user)
 
 # Обработчик команды /start
+@observe_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = load_user_data()
-    user = get_user_data(update.effective_user.id, user_data)
-    save_user_data(user_data)
-    
-    buttons = [
-        [
-            InlineKeyboardButton("🎣 Прогноз клёва", callback_data="show_forecast"),
-            InlineKeyboardButton("📍 Мои локации", callback_data="show_locations")
-        ],
-        [
-            InlineKeyboardButton("➕ Добавить локацию", callback_data="add_location"),
-            InlineKeyboardButton("❓ Помощь", callback_data="help")
-        ],
-        [InlineKeyboardButton("🔄 Перезапуск", callback_data="restart")]
-    ]
-    reply_markup = InlineKeyboardMarkup(buttons)
+    user = get_user_data(update.effective_user.id)
+    save_user_data(update.effective_user.id, user)
     
     await update.message.reply_text(
-        f"Привет, {update.effective_user.first_name}! 👋\n\n"
-        "Я бот-предсказатель клёва рыбы. Я анализирую погодные условия и подскажу, когда лучше всего отправиться на рыбалку.\n\n"
-        "Выберите действие из меню ниже:",
-        reply_markup=reply_markup
+        GREETING_TEXT.format(update.effective_user.first_name),
+        reply_markup=MAIN_MENU
     )
     return CHOOSING_ACTION
 
 # Обработчик команды /help
+@observe_handler
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    buttons = [
-        [
-            InlineKeyboardButton("🎣 Прогноз клёва", callback_data="show_forecast"),
-            InlineKeyboardButton("📍 Мои локации", callback_data="show_locations")
-        ],
-        [
-            InlineKeyboardButton("➕ Добавить локацию", callback_data="add_location"),
-            InlineKeyboardButton("❓ Помощь", callback_data="help")
-        ],
-        [InlineKeyboardButton("🔄 Перезапуск", callback_data="restart")]
-    ]
-    reply_markup = InlineKeyboardMarkup(buttons)
-
-    help_text = (
-        "🤖 *Команды бота:*\n\n"
-        "🎣 */forecast* - получить прогноз клёва\n"
-        "📍 */locations* - список моих локаций\n"
-        "➕ */add_location* - добавить новую локацию\n"
-        "❓ */help* - получить помощь\n"
-        "🔄 Перезапуск - перезапустить бота\n\n"
-        "*Как это работает?*\n"
-        "1. Добавь свои любимые места для рыбалки\n"
-        "2. Запроси прогноз клёва\n"
-        "3. Бот проанализирует погодные условия и оценит вероятность хорошего клёва\n\n"
-        "*Факторы, влияющие на клёв:*\n"
-        "• Атмосферное давление и его изменения\n"
-        "• Температура воздуха и воды\n"
-        "• Ветер (направление и сила)\n"
-        "• Облачность\n"
-        "• Осадки\n"
-        "• Фазы луны"
-    )
     await update.message.reply_text(
-        help_text, 
+        HELP_TEXT, 
         parse_mode='Markdown',
-        reply_markup=reply_markup
+        reply_markup=MAIN_MENU
     )
     return CHOOSING_ACTION
 
 # Обработчик добавления локации
+@observe_handler
 async def add_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['expecting_location'] = True
-    buttons = [[InlineKeyboardButton("🔄 Отмена", callback_data="restart")]]
-    await update.message.reply_text(
-        "📍 Пожалуйста, отправь название города или населенного пункта, рядом с которым ты рыбачишь.\n\n"
-        "Например: Москва, Санкт-Петербург, Сочи",
-        reply_markup=InlineKeyboardMarkup(buttons)
-    )
+    await update.message.reply_text(ADD_LOCATION_TEXT, reply_markup=CANCEL_MENU)
     return ADDING_LOCATION
 
 # Обработчик получения названия локации
+@observe_handler
 async def location_received(update: Update, context: ContextTypes.DEFAULT_TYPE):
     location_name = update.message.text.strip()
     
-    # Создаем кнопки для главного меню
-    buttons = [
-        [
-            InlineKeyboardButton("🎣 Прогноз клёва", callback_data="show_forecast"),
-            InlineKeyboardButton("📍 Мои локации", callback_data="show_locations")
-        ],
-        [
-            InlineKeyboardButton("➕ Добавить локацию", callback_data="add_location"),
-            InlineKeyboardButton("❓ Помощь", callback_data="help")
-        ],
-        [InlineKeyboardButton("🔄 Перезапуск", callback_data="restart")]
-    ]
-    reply_markup = InlineKeyboardMarkup(buttons)
-    
     # Проверяем существование локации через API погоды
     try:
-        weather_data = get_weather_data(location_name)
-        location_info = {
-            "name": weather_data["name"],
-            "country": weather_data["sys"]["country"],
-            "lat": weather_data["coord"]["lat"],
-            "lon": weather_data["coord"]["lon"],
-            "added_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
+        location_info = (await geocode_location(location_name)).added()
         
-        # Сохраняем локацию пользователя
-        user_data = load_user_data()
-        user = get_user_data(update.effective_user.id, user_data)
-        
-        # Проверяем, нет ли уже такой локации
-        location_exists = False
-        for loc in user["locations"]:
-            if loc["name"] == location_info["name"] and loc["country"] == location_info["country"]:
-                location_exists = True
-                break
-        
-        if location_exists:
+        # Сохраняем локацию пользователя, если ее еще нет в списке
+        if not add_user_location(update.effective_user.id, location_info):
             await update.message.reply_text(
-                f"Локация {location_info['name']} уже добавлена в твой список!\n\n"
+                f"Локация {location_info.name} уже добавлена в твой список!\n\n"
                 "Выберите действие из меню ниже:",
-                reply_markup=reply_markup
+                reply_markup=MAIN_MENU
             )
         else:
-            user["locations"].append(location_info)
-            save_user_data(user_data)
             await update.message.reply_text(
                 f"✅ Локация успешно добавлена!\n\n"
-                f"📍 *{location_info['name']}, {location_info['country']}*\n"
-                f"Координаты: {location_info['lat']}, {location_info['lon']}\n\n"
+                f"📍 *{location_info.name}, {location_info.country}*\n"
+                f"Координаты: {location_info.lat}, {location_info.lon}\n\n"
                 "Выберите действие из меню ниже:",
                 parse_mode='Markdown',
-                reply_markup=reply_markup
+                reply_markup=MAIN_MENU
             )
         
     except Exception as e:
@@ -190,12 +184,70 @@ async def location_received(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
             "❌ Не удалось найти такой населенный пункт. Пожалуйста, проверь название и попробуй снова.\n\n"
             "Выберите действие из меню ниже:",
-            reply_markup=reply_markup
+            reply_markup=MAIN_MENU
         )
     
     return CHOOSING_ACTION
 
+# Добавление локации пользователю; False, если такая локация уже есть
+def add_user_location(user_id, location):
+    user = get_user_data(user_id)
+    for loc in user["locations"]:
+        if loc.name == location.name and loc.country == location.country:
+            return False
+    user["locations"].append(location)
+    save_user_data(user_id, user)
+    return True
+
+# Inline-поиск населенных пунктов (@бот Моск...) по локальному индексу
+@observe_handler
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.inline_query
+    results = []
+    for location in city_index.search(query.query):
+        results.append(InlineQueryResultArticle(
+            id=str(location.city_id),
+            title=f"{location.name}, {location.country}",
+            description=f"Координаты: {location.lat}, {location.lon}",
+            input_message_content=InputTextMessageContent(f"📍 {location.name}, {location.country}"),
+            reply_markup=city_keyboard(location.city_id)
+        ))
+    await query.answer(results, cache_time=INLINE_CACHE_TIME)
+
+# Кнопки под результатом inline-поиска: прогноз клёва или добавление в мои локации
+@observe_handler
+async def city_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    _, action, city_id = query.data.split("_")
+    location = city_index.get(int(city_id))
+    if location is None:
+        await query.answer("Населенный пункт не найден", show_alert=True)
+        return
+    
+    if action == "add":
+        if add_user_location(query.from_user.id, location.added()):
+            await query.answer(f"✅ {location.name} добавлен в твои локации")
+        else:
+            await query.answer(f"Локация {location.name} уже добавлена в твой список!")
+        return
+    
+    try:
+        weather_forecast = await get_weather_forecast(location.lat, location.lon)
+    except Exception:
+        await query.answer("❌ Сервис погоды сейчас недоступен, попробуй через несколько минут", show_alert=True)
+        return
+    await query.answer()
+    
+    # Меню бота под сообщением из inline-режима нет, поэтому подсказка про меню убирается
+    forecast_text = forecast_renderer.render(location, weather_forecast).removesuffix(MENU_PROMPT).rstrip()
+    await query.edit_message_text(
+        forecast_text,
+        parse_mode='Markdown',
+        reply_markup=city_keyboard(city_id)
+    )
+
 # Обработчик команды мои локации
+@observe_handler
 async def show_locations(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Определяем, откуда пришел запрос - из команды или callback
     if update.callback_query:
@@ -206,29 +258,28 @@ async def show_locations(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         message = update.message
 
-    user_data = load_user_data()
-    user = get_user_data(user_id, user_data)
+    user = get_user_data(user_id)
     
     if not user["locations"]:
-        text = "У тебя пока нет добавленных локаций. Нажми на '➕ Добавить локацию', чтобы добавить места для рыбалки."
         if update.callback_query:
-            await query.edit_message_text(text)
+            await query.edit_message_text(NO_LOCATIONS_TEXT)
         else:
-            await message.reply_text(text)
+            await message.reply_text(NO_LOCATIONS_TEXT)
         return CHOOSING_ACTION
     
     locations_text = "📍 *Мои локации для рыбалки:*\n\n"
     buttons = []
     
     for i, loc in enumerate(user["locations"]):
-        locations_text += f"{i+1}. {loc['name']}, {loc['country']}\n"
+        locations_text += f"{i+1}. {loc.name}, {loc.country}\n"
         buttons.append([InlineKeyboardButton(
-            f"{loc['name']}, {loc['country']}", 
+            f"{loc.name}, {loc.country}", 
             callback_data=f"location_{i}"
         )])
     
-    buttons.append([InlineKeyboardButton("❌ Удалить локацию", callback_data="delete_location")])
-    buttons.append([InlineKeyboardButton("🔄 Вернуться в главное меню", callback_data="restart")])
+    buttons.append(DELETE_LOCATION_ROW)
+    buttons.append(DIGEST_OFF_ROW if user.get("digest") else DIGEST_ON_ROW)
+    buttons.append(BACK_TO_MENU_ROW)
     
     if update.callback_query:
         await query.edit_message_text(
@@ -246,6 +297,7 @@ async def show_locations(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return SELECTING_LOCATION
 
 # Обработчик команды прогноз клёва
+@observe_handler
 async def forecast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Определяем, откуда пришел запрос - из команды или callback
     if update.callback_query:
@@ -256,25 +308,23 @@ async def forecast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         message = update.message
 
-    user_data = load_user_data()
-    user = get_user_data(user_id, user_data)
+    user = get_user_data(user_id)
     
     if not user["locations"]:
-        text = "У тебя пока нет добавленных локаций. Нажми на '➕ Добавить локацию', чтобы добавить места для рыбалки."
         if update.callback_query:
-            await query.edit_message_text(text)
+            await query.edit_message_text(NO_LOCATIONS_TEXT)
         else:
-            await message.reply_text(text)
+            await message.reply_text(NO_LOCATIONS_TEXT)
         return CHOOSING_ACTION
     
     buttons = []
     for i, loc in enumerate(user["locations"]):
         buttons.append([InlineKeyboardButton(
-            f"{loc['name']}, {loc['country']}", 
+            f"{loc.name}, {loc.country}", 
             callback_data=f"forecast_{i}"
         )])
     
-    buttons.append([InlineKeyboardButton("🔄 Вернуться в главное меню", callback_data="restart")])
+    buttons.append(BACK_TO_MENU_ROW)
     
     text = "🎣 Выбери локацию для прогноза клёва:"
     if update.callback_query:
@@ -284,40 +334,118 @@ async def forecast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     return SELECTING_LOCATION
 
+# Обработчик команды сравнения всех локаций
+@observe_handler
+async def compare_locations(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Определяем, откуда пришел запрос - из команды или callback
+    if update.callback_query:
+        query = update.callback_query
+        user_id = query.from_user.id
+        message = query.message
+    else:
+        user_id = update.effective_user.id
+        message = update.message
+
+    user = get_user_data(user_id)
+    
+    if not user["locations"]:
+        if update.callback_query:
+            await query.edit_message_text(NO_LOCATIONS_TEXT)
+        else:
+            await message.reply_text(NO_LOCATIONS_TEXT)
+        return CHOOSING_ACTION
+    
+    if update.callback_query:
+        await query.edit_message_text("🔍 Сравниваю прогнозы для всех локаций...", reply_markup=None)
+    
+    text = await location_comparison.build(user["locations"])
+    text = (text + "\n\n" + MENU_PROMPT) if text else WEATHER_UNAVAILABLE_TEXT
+    if update.callback_query:
+        await query.edit_message_text(text, parse_mode='Markdown', reply_markup=MAIN_MENU)
+    else:
+        await message.reply_text(text, parse_mode='Markdown', reply_markup=MAIN_MENU)
+    
+    return CHOOSING_ACTION
+
+# Включение и выключение утренней рассылки, возвращает текст для пользователя
+def toggle_digest(user_id):
+    user = get_user_data(user_id)
+    user["digest"] = not user.get("digest", False)
+    save_user_data(user_id, user)
+    if user["digest"]:
+        return (f"🔔 Ты подписан на утренний прогноз клёва. Каждое утро в {DIGEST_TIME} (МСК) "
+                "я пришлю прогноз для всех твоих локаций.")
+    return "🔕 Утренняя рассылка отключена."
+
+# Обработчик команды /digest
+@observe_handler
+async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(toggle_digest(update.effective_user.id))
+    return CHOOSING_ACTION
+
+# Команда /profile [секунды] для администраторов (ADMIN_USER_IDS): сэмплирующий профиль
+# процесса в формате collapsed stacks для flamegraph. В многопроцессном режиме профилируется
+# процесс-обработчик администратора.
+@observe_handler
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return
+    
+    try:
+        seconds = int(context.args[0]) if context.args else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        seconds = PROFILE_DEFAULT_SECONDS
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    
+    if SamplingProfiler.running:
+        await update.message.reply_text("Профилирование уже запущено.")
+        return
+    
+    await update.message.reply_text(f"⏱ Профилирую процесс {seconds} с...")
+    profiler = SamplingProfiler()
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        collapsed = profiler.stop()
+    
+    await update.message.reply_document(
+        document=io.BytesIO(collapsed.encode()),
+        filename=f"profile-{time.strftime('%Y%m%d-%H%M%S')}.collapsed",
+        caption=f"{profiler.samples} сэмплов за {seconds} с. Flamegraph: flamegraph.pl profile.collapsed > profile.svg"
+    )
+
+# Утренняя рассылка прогноза подписчикам
+async def send_daily_digest(context: ContextTypes.DEFAULT_TYPE):
+    subscribers = collect_subscribers(user_store)
+    messages = await DigestBuilder(load_weather_forecast, get_moon_phase).build(subscribers)
+    
+    async def send(chat_id, text):
+        await context.bot.send_message(chat_id, text, parse_mode='Markdown')
+    
+    sender = FanoutSender(send)
+    logger.info(
+        f"Sending {len(messages)} digests, estimated {sender.estimated_duration(len(messages)):.0f}s"
+    )
+    stats = await sender.deliver(messages)
+    logger.info(f"Digest delivery finished: {stats}")
+
 # Обработчик нажатий на кнопки
+@observe_handler
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
     data = query.data
-    user_data = load_user_data()
-    user = get_user_data(query.from_user.id, user_data)
+    user = get_user_data(query.from_user.id)
 
     # Функция для возврата к главному меню
     async def show_main_menu(message_text):
-        buttons = [
-            [
-                InlineKeyboardButton("🎣 Прогноз клёва", callback_data="show_forecast"),
-                InlineKeyboardButton("📍 Мои локации", callback_data="show_locations")
-            ],
-            [
-                InlineKeyboardButton("➕ Добавить локацию", callback_data="add_location"),
-                InlineKeyboardButton("❓ Помощь", callback_data="help")
-            ],
-            [InlineKeyboardButton("🔄 Перезапуск", callback_data="restart")]
-        ]
-        await query.edit_message_text(
-            text=message_text,
-            reply_markup=InlineKeyboardMarkup(buttons)
-        )
+        await query.edit_message_text(text=message_text, reply_markup=MAIN_MENU)
         return CHOOSING_ACTION
 
     if data == "restart":
-        return await show_main_menu(
-            f"Привет, {query.from_user.first_name}! 👋\n\n"
-            "Я бот-предсказатель клёва рыбы. Я анализирую погодные условия и подскажу, когда лучше всего отправиться на рыбалку.\n\n"
-            "Выберите действие из меню ниже:"
-        )
+        return await show_main_menu(GREETING_TEXT.format(query.from_user.first_name))
     
     elif data == "show_forecast":
         return await forecast_command(update, context)
@@ -325,38 +453,17 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data == "show_locations":
         return await show_locations(update, context)
     
+    elif data == "compare_locations":
+        return await compare_locations(update, context)
+    
     elif data == "add_location":
-        await query.edit_message_text(
-            "📍 Пожалуйста, отправь название города или населенного пункта, рядом с которым ты рыбачишь.\n\n"
-            "Например: Москва, Санкт-Петербург, Сочи"
-        )
+        await query.edit_message_text(ADD_LOCATION_TEXT)
         return ADDING_LOCATION
     
     elif data == "help":
-        help_text = (
-            "🤖 *Команды бота:*\n\n"
-            "🎣 Прогноз клёва - получить прогноз клёва\n"
-            "📍 Мои локации - список моих локаций\n"
-            "➕ Добавить локацию - добавить новую локацию\n"
-            "❓ Помощь - получить помощь\n"
-            "🔄 Перезапуск - перезапустить бота\n\n"
-            "*Как это работает?*\n"
-            "1. Добавь свои любимые места для рыбалки\n"
-            "2. Запроси прогноз клёва\n"
-            "3. Бот проанализирует погодные условия и оценит вероятность хорошего клёва\n\n"
-            "*Факторы, влияющие на клёв:*\n"
-            "• Атмосферное давление и его изменения\n"
-            "• Температура воздуха и воды\n"
-            "• Ветер (направление и сила)\n"
-            "• Облачность\n"
-            "• Осадки\n"
-            "• Фазы луны"
-        )
-        
-        buttons = [[InlineKeyboardButton("🔄 Вернуться в главное меню", callback_data="restart")]]
         await query.edit_message_text(
-            help_text,
-            reply_markup=InlineKeyboardMarkup(buttons),
+            HELP_MENU_TEXT,
+            reply_markup=BACK_TO_MENU,
             parse_mode='Markdown'
         )
         return CHOOSING_ACTION
@@ -366,18 +473,23 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         location_index = int(data.split("_")[1])
         location = user["locations"][location_index]
         
-        # Получаем прогноз погоды для этой локации
-        weather_forecast = get_weather_forecast(location["lat"], location["lon"])
+        # Для этого экрана нужна только текущая погода, 5-дневный прогноз не загружается
+        try:
+            current, stale_age = await get_current_weather(location)
+        except Exception:
+            return await show_main_menu(WEATHER_UNAVAILABLE_TEXT)
+        backfill_city_id(query.from_user.id, location)
         
         location_text = (
-            f"📍 *{location['name']}, {location['country']}*\n\n"
+            f"📍 *{location.name}, {location.country}*\n\n"
+            f"{stale_notice(stale_age)}"
             f"🌤 *Текущая погода:*\n"
-            f"Температура: {weather_forecast['current']['temp']}°C\n"
-            f"Ощущается как: {weather_forecast['current']['feels_like']}°C\n"
-            f"Давление: {weather_forecast['current']['pressure']} гПа\n"
-            f"Влажность: {weather_forecast['current']['humidity']}%\n"
-            f"Ветер: {weather_forecast['current']['wind_speed']} м/с, {get_wind_direction(weather_forecast['current']['wind_deg'])}\n"
-            f"Облачность: {weather_forecast['current']['clouds']}%\n\n"
+            f"Температура: {current.temp}°C\n"
+            f"Ощущается как: {current.feels_like}°C\n"
+            f"Давление: {current.pressure} гПа\n"
+            f"Влажность: {current.humidity}%\n"
+            f"Ветер: {current.wind_speed} м/с, {get_wind_direction(current.wind_deg)}\n"
+            f"Облачность: {current.clouds}%\n\n"
             "Выберите действие из меню ниже:"
         )
         
@@ -390,66 +502,19 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Вместо отправки нового сообщения изменим текущее
         await query.edit_message_text(
-            f"🔍 Анализирую погодные условия для {location['name']}...",
+            f"🔍 Анализирую погодные условия для {location.name}...",
             reply_markup=None
         )
         
         # Получаем прогноз погоды
-        weather_forecast = get_weather_forecast(location["lat"], location["lon"])
-        
-        # Анализируем прогноз клёва на 3 дня
-        forecast_text = f"🎣 *Прогноз клёва для {location['name']}*\n\n"
-        
-        # Текущая фаза луны
-        moon_phase = get_moon_phase()
-        forecast_text += f"🌙 Фаза луны: {moon_phase['name']}\n\n"
-        
-        # Прогноз на сегодня и следующие 2 дня
-        for i in range(3):
-            date = (datetime.now() + timedelta(days=i)).strftime("%d.%m.%Y")
-            daily_forecast = weather_forecast['daily'][i]
-            
-            # Рассчитываем вероятность клёва
-            bite_probability, factors = calculate_bite_probability(daily_forecast, moon_phase)
-            bite_rating = get_bite_rating(bite_probability)
-            
-            forecast_text += f"📅 *{date}*\n"
-            forecast_text += f"🌡 Температура: {daily_forecast['temp']['day']}°C\n"
-            forecast_text += f"💨 Ветер: {daily_forecast['wind_speed']} м/с, {get_wind_direction(daily_forecast['wind_deg'])}\n"
-            forecast_text += f"☁️ Облачность: {daily_forecast['clouds']}%\n"
-            forecast_text += f"💧 Влажность: {daily_forecast['humidity']}%\n"
-            forecast_text += f"📊 Давление: {daily_forecast['pressure']} гПа\n"
-            forecast_text += f"🌧 Осадки: {daily_forecast.get('rain', 0)} мм\n"
-            forecast_text += f"🎣 Клёв: {bite_rating}\n"
-            
-            # Добавляем ключевые факторы
-            forecast_text += "👍 Благоприятные факторы:\n"
-            for factor in factors['positive']:
-                forecast_text += f"  • {factor}\n"
-            
-            forecast_text += "👎 Неблагоприятные факторы:\n"
-            for factor in factors['negative']:
-                forecast_text += f"  • {factor}\n"
-            
-            forecast_text += "\n"
-        
-        # Добавляем рекомендации
-        forecast_text += "*Рекомендации по рыбалке:*\n"
+        try:
+            weather_forecast = await get_weather_forecast(location.lat, location.lon)
+        except Exception:
+            return await show_main_menu(WEATHER_UNAVAILABLE_TEXT)
+        backfill_city_id(query.from_user.id, location)
         
-        if bite_probability > 75:
-            forecast_text += "• Отличное время для рыбалки! Не упустите возможность.\n"
-            forecast_text += "• Хищная рыба будет активна, стоит использовать активные приманки.\n"
-        elif bite_probability > 50:
-            forecast_text += "• Хороший день для рыбалки, особенно в утренние и вечерние часы.\n"
-            forecast_text += "• Стоит комбинировать разные техники ловли.\n"
-        elif bite_probability > 25:
-            forecast_text += "• Умеренный клёв, лучше рыбачить в самое тихое время дня.\n"
-            forecast_text += "• Рекомендуется использовать пассивные приманки и насадки.\n"
-        else:
-            forecast_text += "• Неблагоприятные условия для клёва, рыба малоактивна.\n"
-            forecast_text += "• Если всё же решите рыбачить, стоит сосредоточиться на глубоких местах.\n"
-        
-        forecast_text += "\n\nВыберите действие из меню ниже:"
+        # Текст прогноза общий для всех, кто смотрит эту локацию, и берется из кэша
+        forecast_text = forecast_renderer.render(location, weather_forecast)
         
         # Обновляем то же сообщение с прогнозом
         return await show_main_menu(forecast_text)
@@ -463,11 +528,11 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         buttons = []
         for i, loc in enumerate(user["locations"]):
             buttons.append([InlineKeyboardButton(
-                f"Удалить: {loc['name']}", 
+                f"Удалить: {loc.name}", 
                 callback_data=f"remove_{i}"
             )])
         
-        buttons.append([InlineKeyboardButton("Отмена", callback_data="cancel_delete")])
+        buttons.append(CANCEL_DELETE_ROW)
         
         await query.edit_message_text(
             "Выбери локацию для удаления:",
@@ -478,324 +543,243 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         location_index = int(data.split("_")[1])
         if 0 <= location_index < len(user["locations"]):
             removed_location = user["locations"].pop(location_index)
-            save_user_data(user_data)
-            return await show_main_menu(f"Локация {removed_location['name']} удалена.\n\nВыберите действие:")
+            save_user_data(query.from_user.id, user)
+            return await show_main_menu(f"Локация {removed_location.name} удалена.\n\nВыберите действие:")
         else:
             return await show_main_menu("Ошибка: локация не найдена.\n\nВыберите действие:")
     
     elif data == "cancel_delete":
         return await show_main_menu("Удаление отменено.\n\nВыберите действие:")
     
+    elif data == "toggle_digest":
+        return await show_main_menu(toggle_digest(query.from_user.id) + "\n\nВыберите действие:")
+    
     return CHOOSING_ACTION
 
 # Получение данных погоды для локации
-def get_weather_data(location_name):
-    url = f"http://api.openweathermap.org/data/2.5/weather?q={location_name}&appid={WEATHER_API_KEY}&units=metric&lang=ru"
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise Exception(f"Failed to get weather data: {response.status_code}")
-    return response.json()
+async def get_weather_data(location_name):
+    return await weather_client.get_weather_by_name(location_name)
+
+# Поиск населенного пункта по названию с использованием кэша
+async def geocode_location(location_name):
+    location = geocode_cache.get(location_name)
+    if location is NOT_FOUND:
+        raise LookupError(f"Location not found (cached): {location_name}")
+    if location is not None:
+        return location
+    
+    # Поиск локации получает квоту после запросов прогноза
+    priority_token = request_priority.set(GEOCODING)
+    try:
+        weather_data = await get_weather_data(location_name)
+    except WeatherAPIError as e:
+        # Запоминаем только «не найдено», сетевые ошибки и сбои API не кэшируем
+        if e.status_code == 404:
+            geocode_cache.set_not_found(location_name)
+        raise
+    finally:
+        request_priority.reset(priority_token)
+    
+    location = Location(
+        weather_data["name"],
+        weather_data["sys"]["country"],
+        weather_data["coord"]["lat"],
+        weather_data["coord"]["lon"],
+        city_id=weather_data.get("id")
+    )
+    geocode_cache.set(location_name, location)
+    return location
 
 # Получение прогноза погоды для координат
 
-def get_weather_forecast(lat, lon):
+async def get_weather_forecast(lat, lon):
     """
     Получает прогноз погоды с использованием бесплатного API
     вместо OneCall API (который требует подписки)
     """
+    prefetcher.touch(lat, lon)
+    return await load_weather_forecast(lat, lon)
+
+# Прогноз из кэша или OpenWeatherMap без отметки о запросе пользователем
+# (для рассылки, которая обходит все локации подписчиков)
+async def load_weather_forecast(lat, lon):
+    current = forecast_cache.get(lat, lon, CURRENT)
+    forecast = forecast_cache.get(lat, lon, DAILY)
+    if current is not None and forecast is not None:
+        return forecast.with_current(current)
+    
     try:
-        # Текущая погода
-        current_weather_url = f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={WEATHER_API_KEY}&units=metric&lang=ru"
-        current_response = requests.get(current_weather_url)
-        
-        if current_response.status_code != 200:
-            raise Exception(f"Failed to get current weather: {current_response.status_code}")
-        
-        current_data = current_response.json()
-        
-        # 5-дневный прогноз
-        forecast_url = f"https://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lon}&appid={WEATHER_API_KEY}&units=metric&lang=ru"
-        forecast_response = requests.get(forecast_url)
-        
-        if forecast_response.status_code != 200:
-            raise Exception(f"Failed to get forecast: {forecast_response.status_code}")
-        
-        forecast_data = forecast_response.json()
-        
-        # Преобразуем в формат, совместимый с текущим кодом
-        result = {
-            "current": {
-                "temp": current_data["main"]["temp"],
-                "feels_like": current_data["main"]["feels_like"],
-                "pressure": current_data["main"]["pressure"],
-                "humidity": current_data["main"]["humidity"],
-                "wind_speed": current_data["wind"]["speed"],
-                "wind_deg": current_data["wind"]["deg"],
-                "clouds": current_data["clouds"]["all"]
-            },
-            "daily": []
-        }
-        
-        # Группируем прогноз по дням и берем среднее
-        days_data = {}
-        for item in forecast_data["list"]:
-            date = item["dt_txt"].split(" ")[0]
-            if date not in days_data:
-                days_data[date] = []
-            days_data[date].append(item)
-        
-        # Преобразуем данные для каждого дня
-        for date, items in days_data.items():
-            if len(result["daily"]) >= 3:  # Нам нужно только 3 дня
-                break
-                
-            temp_sum = sum(item["main"]["temp"] for item in items)
-            temp_avg = temp_sum / len(items)
-            
-            temp_day = max(item["main"]["temp"] for item in items)
-            temp_night = min(item["main"]["temp"] for item in items)
-            
-            pressure_sum = sum(item["main"]["pressure"] for item in items)
-            pressure_avg = pressure_sum / len(items)
-            
-            humidity_sum = sum(item["main"]["humidity"] for item in items)
-            humidity_avg = humidity_sum / len(items)
-            
-            wind_speed_sum = sum(item["wind"]["speed"] for item in items)
-            wind_speed_avg = wind_speed_sum / len(items)
-            
-            wind_deg_sum = sum(item["wind"]["deg"] for item in items)
-            wind_deg_avg = wind_deg_sum / len(items)
-            
-            clouds_sum = sum(item["clouds"]["all"] for item in items)
-            clouds_avg = clouds_sum / len(items)
-            
-            # Проверка на наличие дождя
-            rain = 0
-            for item in items:
-                if "rain" in item and "3h" in item["rain"]:
-                    rain += item["rain"]["3h"]
-            
-            day_data = {
-                "temp": {
-                    "day": temp_day,
-                    "night": temp_night
-                },
-                "pressure": pressure_avg,
-                "humidity": humidity_avg,
-                "wind_speed": wind_speed_avg,
-                "wind_deg": wind_deg_avg,
-                "clouds": clouds_avg
-            }
-            
-            if rain > 0:
-                day_data["rain"] = rain
-            
-            result["daily"].append(day_data)
-        
-        # Если прогноз менее чем на 3 дня, дублируем последний день
-        while len(result["daily"]) < 3:
-            if result["daily"]:
-                result["daily"].append(result["daily"][-1])
-            else:
-                # Если нет данных, создаем дефолтный прогноз
-                result["daily"].append({
-                    "temp": {"day": current_data["main"]["temp"], "night": current_data["main"]["temp"] - 5},
-                    "pressure": current_data["main"]["pressure"],
-                    "humidity": current_data["main"]["humidity"],
-                    "wind_speed": current_data["wind"]["speed"],
-                    "wind_deg": current_data["wind"]["deg"],
-                    "clouds": current_data["clouds"]["all"]
-                })
-        
-        return result
+        return await refresh_weather_forecast(lat, lon, forecast)
         
     except Exception as e:
-        # Для отладки возвращаем тестовые данные
         logger.error(f"Error getting weather data: {e}")
-        return {
-            "current": {
-                "temp": 15.5,
-                "feels_like": 14.8,
-                "pressure": 1013,
-                "humidity": 76,
-                "wind_speed": 3.6,
-                "wind_deg": 220,
-                "clouds": 75
-            },
-            "daily": [
-                {
-                    "temp": {"day": 15.5, "night": 10.2},
-                    "pressure": 1013,
-                    "humidity": 76,
-                    "wind_speed": 3.6,
-                    "wind_deg": 220,
-                    "clouds": 75
-                },
-                {
-                    "temp": {"day": 16.8, "night": 11.5},
-                    "pressure": 1012,
-                    "humidity": 70,
-                    "wind_speed": 4.1,
-                    "wind_deg": 200,
-                    "clouds": 60
-                },
-                {
-                    "temp": {"day": 17.2, "night": 12.0},
-                    "pressure": 1010,
-                    "humidity": 65,
-                    "wind_speed": 3.8,
-                    "wind_deg": 210,
-                    "clouds": 45
-                }
-            ]
-        }
-
-# Получение направления ветра
-def get_wind_direction(degrees):
-    directions = ["С", "СВ", "В", "ЮВ", "Ю", "ЮЗ", "З", "СЗ"]
-    index = round(degrees / 45) % 8
-    return directions[index]
-
-# Определение фазы луны
-def get_moon_phase():
-    # Простое определение фазы луны на основе текущей даты
-    # В реальности нужно использовать астрономические расчеты
-    current_day = datetime.now().day
-    month_days = 30  # приблизительно
-    
-    moon_phase_day = current_day % 30
-    
-    if moon_phase_day < 2:
-        return {"phase": 0, "name": "Новолуние 🌑", "fishing_factor": 0.7}
-    elif moon_phase_day < 7:
-        return {"phase": 1, "name": "Растущий серп 🌒", "fishing_factor": 0.8}
-    elif moon_phase_day < 9:
-        return {"phase": 2, "name": "Первая четверть 🌓", "fishing_factor": 0.9}
-    elif moon_phase_day < 14:
-        return {"phase": 3, "name": "Растущая луна 🌔", "fishing_factor": 0.85}
-    elif moon_phase_day < 16:
-        return {"phase": 4, "name": "Полнолуние 🌕", "fishing_factor": 1.0}
-    elif moon_phase_day < 21:
-        return {"phase": 5, "name": "Убывающая луна 🌖", "fishing_factor": 0.85}
-    elif moon_phase_day < 23:
-        return {"phase": 6, "name": "Последняя четверть 🌗", "fishing_factor": 0.75}
-    elif moon_phase_day < 28:
-        return {"phase": 7, "name": "Убывающий серп 🌘", "fishing_factor": 0.7}
-    else:
-        return {"phase": 0, "name": "Новолуние 🌑", "fishing_factor": 0.7}
-
-# Расчет вероятности клёва на основе погодных условий
-def calculate_bite_probability(weather_data, moon_phase):
-    probability = 50  # Базовая вероятность
-    positive_factors = []
-    negative_factors = []
-    
-    # 1. Фактор времени суток (новый)
-    hour = datetime.now().hour
-    if 4 <= hour <= 8:  # Утренняя зорька
-        probability += 15
-        positive_factors.append("Утренняя зорька - лучшее время для клёва")
-    elif 17 <= hour <= 21:  # Вечерняя зорька
-        probability += 10
-        positive_factors.append("Вечерняя зорька - хорошее время для клёва")
-    elif 23 <= hour or hour <= 3:  # Ночь
-        probability -= 10
-        negative_factors.append("Ночное время - пониженная активность рыбы")
-    
-    # 2. Фактор изменения давления (новый)
-    if 'pressure_trend' in weather_data:
-        pressure_change = weather_data['pressure_trend']
-        if abs(pressure_change) < 2:  # Стабильное
-            probability += 10
-            positive_factors.append("Стабильное атмосферное давление")
-        elif pressure_change > 5:  # Резкий рост
-            probability -= 15
-            negative_factors.append("Резкий рост атмосферного давления")
-        elif pressure_change < -5:  # Резкое падение
-            probability -= 15
-            negative_factors.append("Резкое падение атмосферного давления")
-    
-    # 3. Улучшенный фактор температуры с учетом сезона
-    temp = weather_data['temp']['day']
-    season = get_current_season()  # Новая функция определения сезона
-    
-    if season == "summer":
-        if 20 <= temp <= 25:
-            probability += 15
-            positive_factors.append(f"Оптимальная летняя температура ({temp}°C)")
-    elif season == "winter":
-        if 0 <= temp <= 5:
-            probability += 15
-            positive_factors.append(f"Оптимальная зимняя температура ({temp}°C)")
-    elif season in ["spring", "autumn"]:
-        if 10 <= temp <= 20:
-            probability += 15
-            positive_factors.append(f"Оптимальная весенне-осенняя температура ({temp}°C)")
-    
-    # 4. Улучшенный фактор ветра с учетом направления
-    wind_speed = weather_data['wind_speed']
-    wind_dir = weather_data['wind_deg']
-    
-    # Проверка на резкую смену направления ветра
-    if 'prev_wind_dir' in weather_data and abs(wind_dir - weather_data['prev_wind_dir']) > 90:
-        probability -= 10
-        negative_factors.append("Резкая смена направления ветра")
-    
-    # 5. Комбинированные факторы (новые)
-    if 'rain' in weather_data and weather_data['rain'] > 0 and wind_speed > 5:
-        probability -= 20  # Дополнительный штраф за дождь с сильным ветром
-        negative_factors.append("Дождь с сильным ветром")
-    
-    if weather_data['humidity'] > 80 and temp > 20:
-        probability += 5  # Бонус за душную погоду
-        positive_factors.append("Душная погода способствует клёву")
-    
-    # 6. Улучшенный фактор фазы луны с учетом времени суток
-    moon_factor = moon_phase['fishing_factor']
-    if moon_phase['phase'] in [0, 4]:  # Новолуние или полнолуние
-        if 19 <= hour <= 23:  # Вечерний клёв в эти фазы особенно хорош
-            probability *= 1.2
-            positive_factors.append("Благоприятное время для ночной рыбалки")
-    
-    probability *= moon_factor
-    
-    # 7. Штормовое предупреждение (новый)
-    if wind_speed > 10 or ('rain' in weather_data and weather_data['rain'] > 10):
-        probability = min(probability, 30)  # Ограничение максимальной вероятности
-        negative_factors.append("⚠️ Штормовое предупреждение - рыбалка не рекомендуется")
-    
-    # Убеждаемся, что вероятность в пределах от 0 до 100
-    probability = max(0, min(100, probability))
-    
-    return probability, {"positive": positive_factors, "negative": negative_factors}
-
-# Новая вспомогательная функция определения сезона
-def get_current_season():
-    month = datetime.now().month
-    if month in [12, 1, 2]:
-        return "winter"
-    elif month in [3, 4, 5]:
-        return "spring"
-    elif month in [6, 7, 8]:
-        return "summer"
-    else:
-        return "autumn"
-
-# Получение текстового рейтинга клёва на основе вероятности
-def get_bite_rating(probability):
-    if probability >= 80:
-        return "🔥🔥🔥🔥🔥 Отличный клёв"
-    elif probability >= 60:
-        return "🔥🔥🔥🔥 Хороший клёв"
-    elif probability >= 40:
-        return "🔥🔥🔥 Средний клёв"
-    elif probability >= 20:
-        return "🔥🔥 Слабый клёв"
+        # Сервис погоды недоступен: отдаем последний полученный прогноз с указанием его возраста
+        # и обновляем его в фоне, когда сервис восстановится
+        stale = get_stale_forecast(lat, lon)
+        if stale is None:
+            raise
+        stale_locations[normalize_coords(lat, lon)] = (lat, lon)
+        return stale
+
+# Последний полученный прогноз, даже устаревший; None, если его нет или он старше STALE_MAX_AGE
+def get_stale_forecast(lat, lon):
+    current, current_age = forecast_cache.peek(lat, lon, CURRENT)
+    forecast, forecast_age = forecast_cache.peek(lat, lon, DAILY)
+    if current is None or forecast is None:
+        return None
+    age = max(current_age, forecast_age)
+    if age > STALE_MAX_AGE:
+        return None
+    return forecast.with_current(current, stale_age=age)
+
+# Фоновое обновление прогнозов, которые отдавались устаревшими
+async def revalidate_stale_forecasts(context: ContextTypes.DEFAULT_TYPE):
+    if not stale_locations or weather_client.breaker.is_open:
+        return
+    request_priority.set(BACKGROUND)
+    for key, (lat, lon) in list(stale_locations.items()):
+        try:
+            await refresh_weather_forecast(lat, lon)
+            stale_locations.pop(key, None)
+        except Exception as e:
+            logger.warning(f"Revalidation failed for {lat}, {lon}: {e}")
+            return
+
+# Запись снимка кэша прогнозов на диск. В многопроцессном режиме кэш у обработчиков
+# общий, поэтому снимок пишет только первый.
+async def save_forecast_snapshot(context=None):
+    if current_shard() not in (None, 0):
+        return
+    try:
+        count = await asyncio.to_thread(forecast_snapshot.save, forecast_cache.entries())
+    except OSError as e:
+        logger.warning(f"Failed to save forecast snapshot: {e}")
+        return
+    forecast_snapshot.open()
+    logger.info(f"Saved forecast snapshot with {count} entries")
+
+# Обновление прогноза: одновременные запросы для тех же координат ждут один общий запрос к API
+async def refresh_weather_forecast(lat, lon, forecast=None):
+    key = normalize_coords(lat, lon) + (forecast is None,)
+    return await weather_requests.do(key, fetch_weather_forecast, lat, lon, forecast)
+
+# Запрос прогноза у OpenWeatherMap и сохранение его в кэш.
+# В кэше DAILY хранится прогноз без текущей погоды: дни, 3-часовые интервалы и часовой пояс.
+async def fetch_weather_forecast(lat, lon, forecast=None):
+    if forecast is None:
+        # Текущая погода и 5-дневный прогноз запрашиваются одновременно
+        current_data, forecast_data = await weather_client.get_current_and_forecast(lat, lon)
+        remember_city_id(lat, lon, current_data)
+        result = build_forecast(current_data, forecast_data)
+        forecast_cache.set(lat, lon, DAILY, result.with_current(None))
     else:
-        return "🔥 Очень слабый клёв"
+        # Прогноз по дням еще свежий, обновляем только текущую погоду
+        current_data = await weather_client.get_current(lat, lon)
+        remember_city_id(lat, lon, current_data)
+        result = forecast.with_current(Current.from_api(current_data))
+    forecast_cache.set(lat, lon, CURRENT, result.current)
+    return result
+
+# Текущая погода для локации без 5-дневного прогноза: (Current, возраст данных в секундах,
+# если сервис погоды недоступен и показаны сохраненные данные, иначе None)
+async def get_current_weather(location):
+    lat, lon = location.lat, location.lon
+    prefetcher.touch(lat, lon)
+    current = forecast_cache.get(lat, lon, CURRENT)
+    if current is not None:
+        return current, None
+    
+    try:
+        key = normalize_coords(lat, lon) + (CURRENT,)
+        return await weather_requests.do(key, fetch_current_weather, lat, lon), None
+    except Exception as e:
+        logger.error(f"Error getting current weather: {e}")
+        current, age = forecast_cache.peek(lat, lon, CURRENT)
+        if current is None or age > STALE_MAX_AGE:
+            raise
+        return current, age
+
+# Запрос текущей погоды у OpenWeatherMap и сохранение ее в кэш
+async def fetch_current_weather(lat, lon):
+    current_data = await weather_client.get_current(lat, lon)
+    remember_city_id(lat, lon, current_data)
+    current = Current.from_api(current_data)
+    forecast_cache.set(lat, lon, CURRENT, current)
+    return current
+
+# Запоминаем id населенного пункта из ответа /weather по координатам
+def remember_city_id(lat, lon, current_data):
+    if "id" in current_data:
+        city_ids[normalize_coords(lat, lon)] = current_data["id"]
+
+# Локации, сохраненные без city_id, получают его из ответа /weather по координатам,
+# чтобы их текущая погода обновлялась групповыми запросами. Пользователь читается заново:
+# пока шел запрос погоды, он мог добавить или удалить локации.
+def backfill_city_id(user_id, location):
+    key = normalize_coords(location.lat, location.lon)
+    city_id = city_ids.get(key)
+    if location.city_id is not None or city_id is None:
+        return
+    user = get_user_data(user_id)
+    changed = False
+    for index, saved in enumerate(user["locations"]):
+        if saved.city_id is None and normalize_coords(saved.lat, saved.lon) == key:
+            user["locations"][index] = Location(
+                saved.name, saved.country, saved.lat, saved.lon, saved.added_at, city_id
+            )
+            changed = True
+    if changed:
+        save_user_data(user_id, user)
+
+# Текущая погода сразу для многих локаций с city_id групповыми запросами OpenWeatherMap
+# (до 20 населенных пунктов в запросе, группы запрашиваются одновременно).
+# Возвращает число обновленных локаций.
+async def refresh_current_weather(locations):
+    by_id = {}
+    for location in locations:
+        by_id.setdefault(location.city_id, []).append(location)
+    results = await weather_client.get_current_many(by_id)
+    refreshed = 0
+    for city_id, current_data in results.items():
+        current = Current.from_api(current_data)
+        for location in by_id.get(city_id, ()):
+            forecast_cache.set(location.lat, location.lon, CURRENT, current)
+            refreshed += 1
+    return refreshed
+
+# Преобразование ответов /weather и /forecast в запись прогноза
+def build_forecast(current_data, forecast_data):
+    # Дневные итоги (средние, максимум и минимум температуры, осадки) за один проход
+    daily = aggregate_daily(to_columns(forecast_data), max_days=3)[0]
+    
+    # Если прогноз менее чем на 3 дня, дублируем последний день
+    while len(daily) < 3:
+        if daily:
+            daily.append(daily[-1])
+        else:
+            # Если нет данных, создаем дефолтный прогноз
+            daily.append(DailyForecast(
+                temp_day=current_data["main"]["temp"],
+                temp_night=current_data["main"]["temp"] - 5,
+                pressure=current_data["main"]["pressure"],
+                humidity=current_data["main"]["humidity"],
+                wind_speed=current_data["wind"]["speed"],
+                wind_deg=current_data["wind"]["deg"],
+                clouds=current_data["clouds"]["all"]
+            ))
+    
+    return Forecast(
+        Current.from_api(current_data),
+        tuple(daily),
+        HourlySeries.from_api(forecast_data),
+        # Смещение часового пояса локации относительно UTC в секундах
+        timezone=forecast_data.get("city", {}).get("timezone", 0),
+        # Время получения служит версией прогноза для кэша готовых текстов
+        fetched_at=time.time()
+    )
 
 # Обработчик текстовых сообщений
+@observe_handler
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not update.message.text:
         return CHOOSING_ACTION
@@ -808,37 +792,37 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await location_received(update, context)
     
     # Для всех остальных текстовых сообщений показываем главное меню
-    buttons = [
-        [
-            InlineKeyboardButton("🎣 Прогноз клёва", callback_data="show_forecast"),
-            InlineKeyboardButton("📍 Мои локации", callback_data="show_locations")
-        ],
-        [
-            InlineKeyboardButton("➕ Добавить локацию", callback_data="add_location"),
-            InlineKeyboardButton("❓ Помощь", callback_data="help")
-        ],
-        [InlineKeyboardButton("🔄 Перезапуск", callback_data="restart")]
-    ]
-    reply_markup = InlineKeyboardMarkup(buttons)
-    
     await update.message.reply_text(
         "Пожалуйста, используйте кнопки меню для навигации:",
-        reply_markup=reply_markup,
+        reply_markup=MAIN_MENU,
         parse_mode='Markdown'
     )
             
     return CHOOSING_ACTION
 
+# Освобождение ресурсов при остановке бота
+async def shutdown(application: Application):
+    await save_forecast_snapshot()
+    forecast_snapshot.close()
+    await weather_client.aclose()
+    user_store.close()
+    geocode_cache.close()
+
 # Основная функция
-def main():
-    # Получаем токен бота из переменной окружения
-    token = os.environ.get("TELEGRAM_BOT_TOKEN")
-    if not token:
-        logger.error("Пожалуйста, установите переменную окружения TELEGRAM_BOT_TOKEN")
-        return
-    
-    # Создаем приложение
-    application = Application.builder().token(token).build()
+# Создание и настройка приложения: обработчики и фоновые задачи.
+# request — транспорт Bot API (по умолчанию HTTPX с замером времени запросов).
+def build_application(token, request=None):
+    # Соединений с Bot API не меньше, чем одновременно обрабатываемых обновлений
+    request = request or ObservedRequest(connection_pool_size=max(TELEGRAM_POOL_SIZE, BOT_CONCURRENCY))
+    # concurrent_updates: сколько обновлений обрабатывается одновременно
+    application = (
+        Application.builder()
+        .token(token)
+        .request(request)
+        .concurrent_updates(BOT_CONCURRENCY)
+        .post_shutdown(shutdown)
+        .build()
+    )
     
     # Добавляем обработчик разговора
     conv_handler = ConversationHandler(
@@ -847,14 +831,18 @@ def main():
             CommandHandler("help", help_command),
             CommandHandler("forecast", forecast_command),
             CommandHandler("locations", show_locations),
+            CommandHandler("compare", compare_locations),
             CommandHandler("add_location", add_location),
+            CommandHandler("digest", digest_command),
         ],
         states={
             CHOOSING_ACTION: [
                 CommandHandler("help", help_command),
                 CommandHandler("forecast", forecast_command),
                 CommandHandler("locations", show_locations),
+                CommandHandler("compare", compare_locations),
                 CommandHandler("add_location", add_location),
+                CommandHandler("digest", digest_command),
                 CallbackQueryHandler(button_callback),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message),
             ],
@@ -875,10 +863,54 @@ def main():
         ],
     )
     
+    # Профилирование по команде администратора, в любом состоянии разговора
+    application.add_handler(CommandHandler("profile", profile_command))
+    
+    # Inline-поиск и кнопки под его результатами. Кнопки сообщений из inline-режима
+    # не относятся к чату, поэтому обрабатываются вне разговора
+    application.add_handler(InlineQueryHandler(inline_query))
+    application.add_handler(CallbackQueryHandler(city_callback, pattern=r"^city_(forecast|add)_\d+$"))
     application.add_handler(conv_handler)
     
-    # Запускаем бота
+    # Метрики состояния кэша, квоты и выключателя для /metrics
+    register_state_gauges(forecast_cache, weather_quota, weather_client.breaker)
+    
+    # Периодически прогреваем кэш прогнозов для сохраненных локаций
+    application.job_queue.run_repeating(prefetcher.run, interval=PREFETCH_INTERVAL, first=30)
+    
+    # Обновление прогнозов, отданных устаревшими во время сбоя сервиса погоды
+    application.job_queue.run_repeating(revalidate_stale_forecasts, interval=RESET_TIMEOUT, first=RESET_TIMEOUT)
+    
+    # Периодически сохраняем снимок кэша прогнозов для быстрого перезапуска
+    application.job_queue.run_repeating(save_forecast_snapshot, interval=FORECAST_SNAPSHOT_INTERVAL, first=FORECAST_SNAPSHOT_INTERVAL)
+    
+    # Утренняя рассылка прогноза подписчикам
+    application.job_queue.run_daily(send_daily_digest, time=digest_time())
+    
+    return application
+
+# Основная функция: получение обновлений через long polling.
+# В режиме webhook (BOT_MODE=webhook) бот запускается из веб-процесса app.py.
+def main():
+    # Получаем токен бота из переменной окружения
+    token = os.environ.get("TELEGRAM_BOT_TOKEN")
+    if not token:
+        logger.error("Пожалуйста, установите переменную окружения TELEGRAM_BOT_TOKEN")
+        return
+    
+    # В режиме webhook обновления принимает app.py; run_polling снял бы его webhook,
+    # поэтому оставшийся запущенным процесс worker ничего не делает
+    if os.environ.get("BOT_MODE", "polling") == "webhook":
+        logger.error("BOT_MODE=webhook: бот запускается веб-процессом app.py, остановите процесс worker")
+        return
+    
+    application = build_application(token)
+    
+    # В режиме polling метрики отдаются отдельным HTTP-сервером на METRICS_PORT
+    start_metrics_server()
+    
+    # Запускаем бота; если раньше был включен webhook, run_polling его снимет
     application.run_polling()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
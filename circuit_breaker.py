@@ -0,0 +1,83 @@
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# После стольких ошибок подряд цепь размыкается
+FAILURE_THRESHOLD = int(os.environ.get("WEATHER_BREAKER_FAILURES", "5"))
+
+# Сколько секунд цепь остается разомкнутой до пробного запроса
+RESET_TIMEOUT = float(os.environ.get("WEATHER_BREAKER_RESET_TIMEOUT", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+# Цепь разомкнута, запрос не выполнялся
+class CircuitOpenError(Exception):
+    pass
+
+
+# Автоматический выключатель: после серии ошибок запросы сразу отклоняются,
+# через reset_timeout пропускается один пробный запрос, и при успехе цепь замыкается.
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT,
+                 clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._trial_in_flight = False
+
+    @property
+    def is_open(self):
+        return self.state == OPEN and self.clock() - self.opened_at < self.reset_timeout
+
+    # Проверка перед запросом: CircuitOpenError, если цепь разомкнута.
+    # Возвращает True, если запрос пропущен как пробный.
+    def before_call(self):
+        if self.state == CLOSED:
+            return False
+        if self.state == OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._trial_in_flight = False
+        if self.state == HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        self.rejected += 1
+        raise CircuitOpenError(f"{self.name} circuit is open")
+
+    # Пробный запрос завершился, не получив ответа (нет квоты, задача отменена):
+    # следующий запрос снова может стать пробным
+    def release_trial(self):
+        if self.state == HALF_OPEN:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        if self.state != CLOSED:
+            logger.info(f"{self.name} circuit closed")
+        self.state = CLOSED
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.warning(f"{self.name} circuit opened after {self.failures} failures")
+            self.state = OPEN
+            self.opened_at = self.clock()
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "rejected": self.rejected
+        }
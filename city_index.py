@@ -0,0 +1,179 @@
+import os
+import sys
+import gzip
+import json
+import mmap
+import bisect
+import struct
+import logging
+import unicodedata
+
+from geocode_cache import normalize_name
+from records import Location
+
+logger = logging.getLogger(__name__)
+
+# Файл индекса населенных пунктов (собирается из city.list.json.gz OpenWeatherMap:
+# python city_index.py city.list.json.gz cities.idx)
+CITY_INDEX_FILE = os.environ.get("CITY_INDEX_FILE", "cities.idx")
+
+# Сколько вариантов показывается в inline-поиске
+INLINE_RESULTS = int(os.environ.get("INLINE_RESULTS", "10"))
+
+# Страны, населенные пункты которых показываются первыми
+PREFERRED_COUNTRIES = tuple(os.environ.get("CITY_PREFERRED_COUNTRIES", "RU").split(","))
+
+# Сколько совпадений по префиксу просматривается для ранжирования: для коротких
+# префиксов совпадений десятки тысяч, ранжируются первые по алфавиту
+SCAN_LIMIT = 300
+
+# Формат файла: заголовок, записи фиксированной длины, отсортированные по ключу поиска,
+# пары (id, номер записи), отсортированные по id, и строки в UTF-8. Поиск — двоичный
+# поиск по записям прямо в отображенном в память файле, при запуске ничего не читается.
+MAGIC = b"NBCI"
+VERSION = 1
+HEADER = struct.Struct("<4sHI")         # magic, версия, число записей
+RECORD = struct.Struct("<IHIH2sffI")    # ключ (смещение, длина), название (смещение, длина), страна, lat, lon, id
+ID_ENTRY = struct.Struct("<II")         # id, номер записи
+
+# Транслитерация: названия в списке OpenWeatherMap латиницей, а пользователи пишут кириллицей
+TRANSLIT = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ж": "zh", "з": "z", "и": "i",
+    "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r", "с": "s",
+    "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "shch",
+    "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya", "і": "i", "ї": "yi", "є": "ye",
+})
+
+
+# Ключ поиска: нормализованное название латиницей без диакритики и апострофов
+def search_key(name):
+    name = normalize_name(name).translate(TRANSLIT)
+    name = unicodedata.normalize("NFKD", name)
+    return "".join(char for char in name if char.isalnum() or char in " -")
+
+
+# Сборка файла индекса из списка городов OpenWeatherMap (JSON или JSON.gz)
+def build_city_index(source, path=CITY_INDEX_FILE):
+    opener = gzip.open if source.endswith(".gz") else open
+    with opener(source, "rt", encoding="utf-8") as file:
+        cities = json.load(file)
+
+    entries = []
+    for city in cities:
+        key = search_key(city["name"])
+        if key:
+            entries.append((key.encode(), city["name"].encode(), city.get("country") or "",
+                            city["coord"]["lat"], city["coord"]["lon"], city["id"]))
+    entries.sort()
+
+    blob_offset = HEADER.size + (RECORD.size + ID_ENTRY.size) * len(entries)
+    records = []
+    blob = []
+    position = blob_offset
+    for key, name, country, lat, lon, city_id in entries:
+        records.append(RECORD.pack(position, len(key), position + len(key), len(name),
+                                   country.encode("ascii", "replace")[:2].ljust(2), lat, lon, city_id))
+        blob.append(key + name)
+        position += len(key) + len(name)
+    ids = sorted((city_id, number) for number, (*_, city_id) in enumerate(entries))
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(entries)))
+        file.writelines(records)
+        file.writelines(ID_ENTRY.pack(city_id, number) for city_id, number in ids)
+        file.writelines(blob)
+    os.replace(temp_path, path)
+    return len(entries)
+
+
+# Поиск населенных пунктов по началу названия в файле индекса, отображенном в память
+class CityIndex:
+    def __init__(self, path=CITY_INDEX_FILE, preferred_countries=PREFERRED_COUNTRIES):
+        self._preferred = {country.encode("ascii").ljust(2) for country in preferred_countries}
+        self._mmap = None
+        self._count = 0
+        if not os.path.exists(path):
+            logger.warning(f"City index {path} not found, inline search is disabled")
+            return
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            logger.warning(f"Ignoring city index {path} with unknown format")
+            self._mmap.close()
+            self._mmap = None
+            return
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def _record(self, number):
+        return RECORD.unpack_from(self._mmap, HEADER.size + RECORD.size * number)
+
+    def _key(self, number):
+        offset, length = struct.unpack_from("<IH", self._mmap, HEADER.size + RECORD.size * number)
+        return self._mmap[offset:offset + length]
+
+    def _city(self, number):
+        _, _, name_offset, name_length, country, lat, lon, city_id = self._record(number)
+        name = self._mmap[name_offset:name_offset + name_length].decode()
+        # Координаты хранятся как float32, в списке OpenWeatherMap у них 4 знака
+        return Location(name, country.decode("ascii").strip(), round(lat, 4), round(lon, 4), city_id=city_id)
+
+    # Лучшие совпадения по началу названия (Location с city_id). Выше точные совпадения,
+    # затем населенные пункты предпочтительных стран и более короткие названия.
+    def search(self, text, limit=INLINE_RESULTS):
+        prefix = search_key(text).encode()
+        if self._mmap is None or not prefix:
+            return []
+        number = bisect.bisect_left(range(self._count), prefix, key=self._key)
+        candidates = []
+        end = min(self._count, number + SCAN_LIMIT)
+        preferred = self._preferred
+        while number < end:
+            key_offset, key_length, _, _, country, _, _, _ = self._record(number)
+            key = self._mmap[key_offset:key_offset + key_length]
+            if not key.startswith(prefix):
+                break
+            candidates.append((key_length != len(prefix), country not in preferred, key_length, number))
+            number += 1
+
+        results = []
+        seen = set()
+        for *_, number in sorted(candidates):
+            location = self._city(number)
+            # В списке OpenWeatherMap встречаются дубли одного и того же населенного пункта
+            place = (location.name, location.country, round(location.lat, 1), round(location.lon, 1))
+            if place in seen:
+                continue
+            seen.add(place)
+            results.append(location)
+            if len(results) == limit:
+                break
+        return results
+
+    # Населенный пункт по id OpenWeatherMap или None
+    def get(self, city_id):
+        if self._mmap is None:
+            return None
+        ids_offset = HEADER.size + RECORD.size * self._count
+        position = bisect.bisect_left(
+            range(self._count), city_id,
+            key=lambda i: ID_ENTRY.unpack_from(self._mmap, ids_offset + ID_ENTRY.size * i)[0]
+        )
+        if position == self._count:
+            return None
+        found_id, number = ID_ENTRY.unpack_from(self._mmap, ids_offset + ID_ENTRY.size * position)
+        if found_id != city_id:
+            return None
+        return self._city(number)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python city_index.py city.list.json.gz [cities.idx]")
+        sys.exit(1)
+    count = build_city_index(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else CITY_INDEX_FILE)
+    print(f"Indexed {count} cities")
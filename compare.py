@@ -0,0 +1,90 @@
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from forecast_cache import normalize_coords
+from scoring import ScoreRows, score_batch
+
+logger = logging.getLogger(__name__)
+
+# Сколько дней прогноза сравнивается
+COMPARE_DAYS = 3
+
+MEDALS = ("🥇", "🥈", "🥉")
+
+
+# Сравнение всех локаций пользователя: прогнозы загружаются одновременно, поэтому
+# ответ ждет самый долгий запрос, а не их сумму; все (локация, день) оцениваются одним пакетом.
+# Все запросы пользовательские: нагрузку на API уже ограничивают кэш, объединение одинаковых
+# запросов и QuotaGovernor, а очередь или фоновый приоритет задержали бы ответ на нажатие.
+class LocationComparison:
+    def __init__(self, load_forecast, moon_phase_at, days=COMPARE_DAYS):
+        self.load_forecast = load_forecast
+        self.moon_phase_at = moon_phase_at
+        self.days = days
+
+    async def _load_all(self, locations):
+        async def load(location):
+            try:
+                return await self.load_forecast(location.lat, location.lon)
+            except Exception as e:
+                logger.warning(f"Comparison forecast failed for {location.lat}, {location.lon}: {e}")
+                return None
+
+        return await asyncio.gather(*(load(location) for location in locations))
+
+    # Вероятности клёва: {индекс локации: [вероятность по дням]}, без локаций, для которых нет прогноза
+    async def score(self, locations, now=None):
+        now = now or datetime.now()
+        # Одинаковые координаты загружаются один раз
+        unique = {}
+        for location in locations:
+            unique.setdefault(normalize_coords(location.lat, location.lon), location)
+        forecasts = dict(zip(unique, await self._load_all(unique.values())))
+
+        moon_phases = [self.moon_phase_at((now + timedelta(days=day)).timestamp()) for day in range(self.days)]
+        rows = ScoreRows()
+        scored = []
+        for index, location in enumerate(locations):
+            forecast = forecasts[normalize_coords(location.lat, location.lon)]
+            if forecast is None or len(forecast.daily) < self.days:
+                continue
+            for day in range(self.days):
+                rows.append(forecast.daily[day], moon_phases[day])
+            scored.append(index)
+        probabilities, _ = score_batch(rows, now)
+
+        return {
+            index: probabilities[position * self.days:(position + 1) * self.days]
+            for position, index in enumerate(scored)
+        }
+
+    # Текст сравнения: по каждому дню локации от лучшей к худшей
+    async def build(self, locations, now=None):
+        now = now or datetime.now()
+        started = time.perf_counter()
+        scores = await self.score(locations, now)
+        if not scores:
+            return None
+
+        parts = ["📊 *Сравнение локаций*\n\n"]
+        best = []
+        for day in range(self.days):
+            ranked = sorted(scores, key=lambda index: -scores[index][day])
+            parts.append(f"📅 *{(now + timedelta(days=day)).strftime('%d.%m.%Y')}*\n")
+            for place, index in enumerate(ranked):
+                location = locations[index]
+                medal = MEDALS[place] if place < len(MEDALS) else f"{place + 1}."
+                parts.append(f"{medal} {location.name} — {scores[index][day]:.0f}%\n")
+            parts.append("\n")
+            best.append(locations[ranked[0]].name)
+
+        parts.append("🏆 *Лучшие места:* " + ", ".join(
+            f"{day_name} — {name}" for day_name, name in zip(("сегодня", "завтра", "послезавтра"), best)
+        ))
+        missing = len(locations) - len(scores)
+        if missing:
+            parts.append(f"\n\n⚠️ Нет прогноза для локаций: {missing}")
+        logger.info(f"Compared {len(scores)} locations in {time.perf_counter() - started:.2f}s")
+        return "".join(parts)
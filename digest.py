@@ -0,0 +1,125 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone, time as day_time
+
+from forecast_cache import normalize_coords
+from scoring import ScoreRows, score_batch, best_windows, get_bite_rating
+from quota import request_priority, BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+# Время утренней рассылки и смещение часового пояса рассылки от UTC (по умолчанию — Москва)
+DIGEST_TIME = os.environ.get("DIGEST_TIME", "05:00")
+DIGEST_UTC_OFFSET = int(os.environ.get("DIGEST_UTC_OFFSET", "3"))
+
+# На какой час по времени рассылки оценивается день: рассылка уходит рано утром
+# (в 05:00 МСК на сервере в UTC еще ночь), а оценка не должна зависеть от часа отправки
+DIGEST_SCORE_HOUR = 12
+
+# Сколько прогнозов для рассылки загружается одновременно
+DIGEST_CONCURRENCY = int(os.environ.get("DIGEST_CONCURRENCY", "10"))
+
+
+# Подписчики рассылки: [(chat_id, locations), ...]
+def collect_subscribers(user_store):
+    return [
+        (int(user_id), user["locations"])
+        for user_id, user in user_store.all_users()
+        if user.get("digest") and user["locations"]
+    ]
+
+
+# Время, на которое оцениваются локации в рассылке: DIGEST_SCORE_HOUR того же дня
+# в часовом поясе рассылки
+def digest_reference_time(now):
+    local = now.astimezone(timezone(timedelta(hours=DIGEST_UTC_OFFSET)))
+    return local.replace(hour=DIGEST_SCORE_HOUR, minute=0, second=0, microsecond=0)
+
+
+# Утренний прогноз для подписчиков. Прогноз и оценка считаются один раз на каждую
+# различную локацию, а сообщения пользователей собираются из готовых строк.
+# load_forecast не должен отмечать локации как запрошенные пользователем
+# (рассылка обходит все локации подписчиков и сбила бы порядок фонового обновления).
+class DigestBuilder:
+    def __init__(self, load_forecast, moon_phase_at, concurrency=DIGEST_CONCURRENCY):
+        self.load_forecast = load_forecast
+        self.moon_phase_at = moon_phase_at
+        self.concurrency = concurrency
+
+    async def _load_all(self, locations):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def load(lat, lon):
+            # Рассылка получает квоту после пользовательских запросов
+            request_priority.set(BACKGROUND)
+            async with semaphore:
+                try:
+                    return await self.load_forecast(lat, lon)
+                except Exception as e:
+                    logger.warning(f"Digest forecast failed for {lat}, {lon}: {e}")
+                    return None
+
+        forecasts = await asyncio.gather(*(load(lat, lon) for lat, lon in locations.values()))
+        return dict(zip(locations, forecasts))
+
+    # Строка прогноза для каждой локации: {normalized coords: text}
+    async def build_lines(self, locations, now=None):
+        now = now or datetime.now()
+        now_ts = now.timestamp()
+        forecasts = await self._load_all(locations)
+        keys = [key for key, forecast in forecasts.items() if forecast is not None]
+
+        # Оценка на сегодня для всех локаций одним пакетом
+        rows = ScoreRows()
+        moon_phase = self.moon_phase_at(now_ts)
+        for key in keys:
+            rows.append(forecasts[key].daily[0], moon_phase)
+        probabilities, _ = score_batch(rows, digest_reference_time(now))
+
+        lines = {}
+        for key, probability in zip(keys, probabilities):
+            forecast = forecasts[key]
+            daily = forecast.daily[0]
+            line = (f"{get_bite_rating(probability)}, "
+                    f"{daily.temp_day:.0f}°C, ветер {daily.wind_speed:.0f} м/с")
+            # Лучшее окно в ближайшие сутки
+            slots = forecast.hourly.before(now_ts + 86400)
+            windows = best_windows(slots, self.moon_phase_at, forecast.timezone, now_ts, top_n=1)
+            if windows:
+                line += (f"\n   ⏰ лучшее время: {windows[0]['start'].strftime('%H:%M')}–"
+                         f"{windows[0]['end'].strftime('%H:%M')}")
+            lines[key] = line
+        return lines
+
+    # Сообщения для подписчиков: [(chat_id, text), ...]
+    async def build(self, subscribers, now=None):
+        started = time.perf_counter()
+        locations = {}
+        for _, user_locations in subscribers:
+            for location in user_locations:
+                locations.setdefault(normalize_coords(location.lat, location.lon),
+                                     (location.lat, location.lon))
+        lines = await self.build_lines(locations, now)
+
+        messages = []
+        for chat_id, user_locations in subscribers:
+            parts = []
+            for location in user_locations:
+                line = lines.get(normalize_coords(location.lat, location.lon))
+                if line is not None:
+                    parts.append(f"📍 *{location.name}, {location.country}*: {line}")
+            if parts:
+                messages.append((chat_id, "☀️ *Утренний прогноз клёва*\n\n" + "\n\n".join(parts)))
+        logger.info(
+            f"Built {len(messages)} digests from {len(lines)} locations "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+        return messages
+
+
+# Время рассылки для JobQueue.run_daily
+def digest_time():
+    hour, minute = (int(part) for part in DIGEST_TIME.split(":"))
+    return day_time(hour, minute, tzinfo=timezone(timedelta(hours=DIGEST_UTC_OFFSET)))
@@ -0,0 +1,128 @@
+import os
+import time
+import asyncio
+import logging
+from telegram.error import RetryAfter, Forbidden
+
+logger = logging.getLogger(__name__)
+
+# Общий лимит Telegram — около 30 сообщений в секунду, оставляем запас
+FANOUT_RATE = float(os.environ.get("FANOUT_RATE", "25"))
+
+# Минимальный интервал между сообщениями в один чат (секунды)
+FANOUT_PER_CHAT_INTERVAL = float(os.environ.get("FANOUT_PER_CHAT_INTERVAL", "1"))
+
+# Количество одновременных отправок
+FANOUT_WORKERS = int(os.environ.get("FANOUT_WORKERS", "8"))
+
+# Сколько раз повторять отправку после ошибки или flood wait
+FANOUT_MAX_RETRIES = int(os.environ.get("FANOUT_MAX_RETRIES", "3"))
+
+
+# Массовая рассылка с соблюдением общего лимита и лимита на чат.
+# send(chat_id, text) отправляет одно сообщение. При RetryAfter (flood wait) отправка
+# приостанавливается для всех на указанное время, а сообщение возвращается в очередь.
+class FanoutSender:
+    def __init__(self, send, rate=FANOUT_RATE, per_chat_interval=FANOUT_PER_CHAT_INTERVAL,
+                 workers=FANOUT_WORKERS, max_retries=FANOUT_MAX_RETRIES, clock=time.monotonic):
+        self.send = send
+        self.rate = rate
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self.max_retries = max_retries
+        self.clock = clock
+        self._rate_lock = asyncio.Lock()
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._chat_next = {}
+        self._queue = None
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.retried = 0
+        self.flood_waits = 0
+        self.started_at = None
+        self.finished_at = None
+
+    # Ожидание свободного слота в общем лимите
+    async def _acquire(self):
+        async with self._rate_lock:
+            now = self.clock()
+            start = max(now, self._next_slot, self._paused_until)
+            if start > now:
+                await asyncio.sleep(start - now)
+            self._next_slot = start + 1 / self.rate
+
+    # Ожидание, пока в чат снова можно писать
+    async def _wait_chat(self, chat_id):
+        ready_at = self._chat_next.get(chat_id, 0.0)
+        now = self.clock()
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+        self._chat_next[chat_id] = max(now, ready_at) + self.per_chat_interval
+
+    async def _worker(self):
+        while True:
+            chat_id, text, attempt = await self._queue.get()
+            try:
+                await self._wait_chat(chat_id)
+                await self._acquire()
+                await self.send(chat_id, text)
+                self.sent += 1
+            except RetryAfter as e:
+                self.flood_waits += 1
+                self._paused_until = max(self._paused_until, self.clock() + e.retry_after)
+                logger.warning(f"Flood wait {e.retry_after}s while sending to {chat_id}")
+                self._retry(chat_id, text, attempt)
+            except Forbidden:
+                # Пользователь заблокировал бота
+                self.blocked += 1
+            except Exception as e:
+                logger.warning(f"Failed to send to {chat_id}: {e}")
+                self._retry(chat_id, text, attempt)
+            finally:
+                self._queue.task_done()
+
+    def _retry(self, chat_id, text, attempt):
+        if attempt < self.max_retries:
+            self.retried += 1
+            self._queue.put_nowait((chat_id, text, attempt + 1))
+        else:
+            self.failed += 1
+
+    # Отправка всех сообщений [(chat_id, text), ...], завершается, когда очередь пуста
+    async def deliver(self, messages):
+        self._queue = asyncio.Queue()
+        self._chat_next = {}
+        for chat_id, text in messages:
+            self._queue.put_nowait((chat_id, text, 0))
+        self.started_at = self.clock()
+        self.finished_at = None
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        try:
+            await self._queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.finished_at = self.clock()
+        return self.stats()
+
+    # Оценка времени рассылки для заданного числа получателей при текущем лимите
+    def estimated_duration(self, count):
+        return count / self.rate
+
+    def stats(self):
+        if self.started_at is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self.finished_at or self.clock()) - self.started_at
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "blocked": self.blocked,
+            "retried": self.retried,
+            "flood_waits": self.flood_waits,
+            "backlog": self._queue.qsize() if self._queue else 0,
+            "elapsed": elapsed,
+            "throughput": self.sent / elapsed if elapsed else 0.0
+        }
@@ -0,0 +1,112 @@
+import math
+from array import array
+
+from records import DailyForecast
+
+# Числовые колонки, в которые раскладывается 3-часовой прогноз /forecast
+COLUMNS = ("dt", "temp", "pressure", "humidity", "wind_speed", "wind_sin", "wind_cos", "clouds", "rain")
+
+
+# Прогноз в колоночном виде: по массиву на каждую величину и общий список дат
+class ForecastColumns:
+    __slots__ = COLUMNS + ("day", "location")
+
+    def __init__(self):
+        for name in COLUMNS:
+            setattr(self, name, array('d'))
+        # Дата (YYYY-MM-DD) и номер локации для каждого 3-часового интервала
+        self.day = []
+        self.location = array('l')
+
+    def __len__(self):
+        return len(self.dt)
+
+    # Добавление списка интервалов из ответа /forecast
+    def extend(self, forecast_data, location=0):
+        for item in forecast_data["list"]:
+            wind_rad = math.radians(item["wind"]["deg"])
+            self.dt.append(item["dt"])
+            self.temp.append(item["main"]["temp"])
+            self.pressure.append(item["main"]["pressure"])
+            self.humidity.append(item["main"]["humidity"])
+            self.wind_speed.append(item["wind"]["speed"])
+            self.wind_sin.append(math.sin(wind_rad))
+            self.wind_cos.append(math.cos(wind_rad))
+            self.clouds.append(item["clouds"]["all"])
+            self.rain.append(item.get("rain", {}).get("3h", 0))
+            self.day.append(item["dt_txt"].split(" ")[0])
+            self.location.append(location)
+        return self
+
+
+# Преобразование ответа /forecast в колонки
+def to_columns(forecast_data):
+    return ForecastColumns().extend(forecast_data)
+
+
+# Среднее направление ветра по сумме единичных векторов (350° и 10° дают 0°, а не 180°)
+def circular_mean_deg(sin_sum, cos_sum):
+    return math.degrees(math.atan2(sin_sum, cos_sum)) % 360
+
+
+# Формирование итогов дня из накопленных сумм
+def _finish_day(acc):
+    count = acc[0]
+    return DailyForecast(
+        temp_day=acc[1],
+        temp_night=acc[2],
+        pressure=acc[3] / count,
+        humidity=acc[4] / count,
+        wind_speed=acc[5] / count,
+        wind_deg=circular_mean_deg(acc[6], acc[7]),
+        clouds=acc[8] / count,
+        rain=acc[9] if acc[9] > 0 else 0
+    )
+
+
+# Дневные итоги за один проход по колонкам.
+# Возвращает список дней для каждой локации (в порядке номеров локаций),
+# не более max_days дней на локацию.
+def aggregate_daily(columns, max_days=3, locations=1):
+    result = [[] for _ in range(locations)]
+    acc = None
+    current = None
+    dt_day = columns.day
+    location_col = columns.location
+    temp, pressure, humidity = columns.temp, columns.pressure, columns.humidity
+    wind_speed, wind_sin, wind_cos = columns.wind_speed, columns.wind_sin, columns.wind_cos
+    clouds, rain = columns.clouds, columns.rain
+
+    for i in range(len(columns)):
+        key = (location_col[i], dt_day[i])
+        if key != current:
+            if acc is not None and len(result[current[0]]) < max_days:
+                result[current[0]].append(_finish_day(acc))
+            current = key
+            # count, max, min, и суммы: давление, влажность, ветер, sin, cos, облачность, осадки
+            acc = [0, temp[i], temp[i], 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+        t = temp[i]
+        acc[0] += 1
+        if t > acc[1]:
+            acc[1] = t
+        if t < acc[2]:
+            acc[2] = t
+        acc[3] += pressure[i]
+        acc[4] += humidity[i]
+        acc[5] += wind_speed[i]
+        acc[6] += wind_sin[i]
+        acc[7] += wind_cos[i]
+        acc[8] += clouds[i]
+        acc[9] += rain[i]
+
+    if acc is not None and len(result[current[0]]) < max_days:
+        result[current[0]].append(_finish_day(acc))
+    return result
+
+
+# Дневные итоги для многих локаций сразу (например, при фоновом обновлении кэша)
+def aggregate_many(forecasts, max_days=3):
+    columns = ForecastColumns()
+    for location, forecast_data in enumerate(forecasts):
+        columns.extend(forecast_data, location)
+    return aggregate_daily(columns, max_days, len(forecasts))
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+from collections import OrderedDict
+
+from records import to_json
+
+# Время жизни записей (в секундах) для текущей погоды и прогноза по дням
+CURRENT_TTL = int(os.environ.get("FORECAST_CACHE_CURRENT_TTL", "600"))
+DAILY_TTL = int(os.environ.get("FORECAST_CACHE_DAILY_TTL", "10800"))
+
+# Насколько старый прогноз можно показать, когда сервис погоды недоступен
+STALE_MAX_AGE = int(os.environ.get("FORECAST_STALE_MAX_AGE", str(12 * 3600)))
+
+# Ограничение памяти кэша в байтах (оценка по размеру сериализованных данных)
+MAX_BYTES = int(os.environ.get("FORECAST_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Точность округления координат: 2 знака — около 1 км, этого достаточно для погоды
+COORD_PRECISION = 2
+
+CURRENT = "current"
+DAILY = "daily"
+
+
+# Нормализация координат в ключ кэша
+def normalize_coords(lat, lon, precision=COORD_PRECISION):
+    return (round(float(lat), precision), round(float(lon), precision))
+
+
+# Оценка размера значения в байтах
+def estimate_size(value):
+    return len(json.dumps(value, ensure_ascii=False, default=to_json).encode("utf-8"))
+
+
+# Общий для процесса кэш прогнозов с TTL и вытеснением по LRU
+class ForecastCache:
+    def __init__(self, current_ttl=CURRENT_TTL, daily_ttl=DAILY_TTL,
+                 max_bytes=MAX_BYTES, clock=time.time):
+        self.ttls = {CURRENT: current_ttl, DAILY: daily_ttl}
+        self.max_bytes = max_bytes
+        self.clock = clock
+        # (lat, lon, kind) -> (stored_at, size, value), порядок — от давних к свежим
+        self._entries = OrderedDict()
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Функции listener(lat, lon, kind, value, stored_at), вызываемые при сохранении
+        # нового значения (используются для репликации кэша между процессами)
+        self.listeners = []
+        # Снимок кэша на диске (ForecastSnapshot): записи, которых нет в памяти,
+        # подгружаются из него при первом обращении
+        self.snapshot = None
+
+    # Запись по ключу, при необходимости загруженная из снимка
+    def _entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None and self.snapshot is not None:
+            loaded = self.snapshot.take(key)
+            if loaded is not None:
+                stored_at, value = loaded
+                self.set(key[0], key[1], key[2], value, stored_at=stored_at, notify=False)
+                entry = self._entries.get(key)
+        return entry
+
+    # Получение свежего значения или None, если записи нет или она устарела
+    def get(self, lat, lon, kind):
+        key = normalize_coords(lat, lon) + (kind,)
+        entry = self._entry(key)
+        if entry is None or self.clock() - entry[0] > self.ttls[kind]:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    # Значение и его возраст в секундах без учета TTL и без изменения счетчиков
+    def peek(self, lat, lon, kind):
+        entry = self._entry(normalize_coords(lat, lon) + (kind,))
+        if entry is None:
+            return None, None
+        return entry[2], self.clock() - entry[0]
+
+    # Сохранение значения с вытеснением давно не используемых записей.
+    # stored_at — время получения значения, если оно получено раньше (например, другим процессом);
+    # notify=False не оповещает слушателей.
+    def set(self, lat, lon, kind, value, stored_at=None, notify=True):
+        key = normalize_coords(lat, lon) + (kind,)
+        stored_at = self.clock() if stored_at is None else stored_at
+        old = self._entries.pop(key, None)
+        if old is not None:
+            if old[0] > stored_at:
+                # Уже есть более свежее значение
+                self._entries[key] = old
+                return
+            self.bytes_used -= old[1]
+        size = estimate_size(value)
+        self._entries[key] = (stored_at, size, value)
+        self.bytes_used += size
+        while self.bytes_used > self.max_bytes and len(self._entries) > 1:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.bytes_used -= evicted_size
+            self.evictions += 1
+        if notify:
+            for listener in self.listeners:
+                listener(lat, lon, kind, value, stored_at)
+
+    # Удаление всех записей для локации
+    def invalidate(self, lat, lon):
+        for kind in self.ttls:
+            key = normalize_coords(lat, lon) + (kind,)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes_used -= old[1]
+            if self.snapshot is not None:
+                self.snapshot.take(key)
+
+    # Все записи: [(ключ, stored_at, value)]
+    def entries(self):
+        return [(key, stored_at, value) for key, (stored_at, _, value) in self._entries.items()]
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Счетчики для подбора размера кэша
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "evictions": self.evictions
+        }
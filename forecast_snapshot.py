@@ -0,0 +1,208 @@
+import os
+import mmap
+import math
+import time
+import bisect
+import struct
+import logging
+from array import array
+
+from forecast_cache import CURRENT, DAILY, STALE_MAX_AGE, COORD_PRECISION
+from records import Current, DailyForecast, HourlySeries, Forecast, HOURLY_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Файл снимка кэша прогнозов
+FORECAST_SNAPSHOT_FILE = os.environ.get("FORECAST_SNAPSHOT_FILE", "forecast_cache.snap")
+
+# Как часто (в секундах) снимок записывается на диск
+FORECAST_SNAPSHOT_INTERVAL = int(os.environ.get("FORECAST_SNAPSHOT_INTERVAL", "300"))
+
+# Формат файла: заголовок, отсортированный индекс записей фиксированной длины и данные.
+# Индекс ищется двоичным поиском прямо в отображенном в память файле, данные записи
+# декодируются только при первом обращении к ней.
+MAGIC = b"NBFS"
+VERSION = 1
+HEADER = struct.Struct("<4sHId")       # magic, версия, число записей, время создания
+INDEX = struct.Struct("<iiBdQI")       # lat, lon (сотые доли градуса), вид, stored_at, смещение, длина
+CURRENT_RECORD = struct.Struct("<B7d")  # маска целых полей и поля Current
+FORECAST_HEAD = struct.Struct("<idBH")  # часовой пояс, fetched_at, число дней, число интервалов
+DAY_RECORD = struct.Struct("<H10d")     # маска целых полей и поля DailyForecast
+
+KIND_CODES = {CURRENT: 0, DAILY: 1}
+KIND_NAMES = {code: kind for kind, code in KIND_CODES.items()}
+COORD_SCALE = 10 ** COORD_PRECISION
+
+
+# Поля записи числами double и битовая маска полей, которые были целыми:
+# после загрузки давление 1013 не должно превратиться в 1013.0
+def _pack_fields(record, fields):
+    mask = 0
+    values = []
+    for bit, name in enumerate(fields):
+        value = getattr(record, name)
+        if isinstance(value, int):
+            mask |= 1 << bit
+        values.append(value)
+    return mask, values
+
+
+def _unpack_fields(mask, values):
+    return [int(value) if mask & (1 << bit) else value for bit, value in enumerate(values)]
+
+
+def encode_value(kind, value):
+    if kind == CURRENT:
+        mask, values = _pack_fields(value, Current.__slots__)
+        return CURRENT_RECORD.pack(mask, *values)
+    parts = [FORECAST_HEAD.pack(
+        value.timezone, math.nan if value.fetched_at is None else value.fetched_at,
+        len(value.daily), len(value.hourly)
+    )]
+    for day in value.daily:
+        mask, values = _pack_fields(day, DailyForecast.__slots__)
+        parts.append(DAY_RECORD.pack(mask, *values))
+    for name in HOURLY_COLUMNS:
+        parts.append(getattr(value.hourly, name).tobytes())
+    return b"".join(parts)
+
+
+def decode_value(kind, data):
+    if kind == CURRENT:
+        mask, *values = CURRENT_RECORD.unpack(data)
+        return Current(*_unpack_fields(mask, values))
+    timezone, fetched_at, day_count, hourly_count = FORECAST_HEAD.unpack_from(data)
+    position = FORECAST_HEAD.size
+    days = []
+    for _ in range(day_count):
+        mask, *values = DAY_RECORD.unpack_from(data, position)
+        days.append(DailyForecast(*_unpack_fields(mask, values)))
+        position += DAY_RECORD.size
+    hourly = HourlySeries()
+    column_size = hourly_count * 8
+    for name in HOURLY_COLUMNS:
+        column = array('d')
+        column.frombytes(data[position:position + column_size])
+        setattr(hourly, name, column)
+        position += column_size
+    return Forecast(None, tuple(days), hourly, timezone,
+                    None if math.isnan(fetched_at) else fetched_at)
+
+
+def _index_key(key):
+    lat, lon, kind = key
+    return round(lat * COORD_SCALE), round(lon * COORD_SCALE), KIND_CODES[kind]
+
+
+# Запись снимка: entries — [(ключ кэша, stored_at, значение)]. Файл пишется во временный
+# и подменяется атомарно, поэтому читатели всегда видят целый снимок.
+def write_snapshot(path, entries, clock=time.time):
+    entries = sorted(((_index_key(key), stored_at, value) for key, stored_at, value in entries),
+                     key=lambda entry: entry[0])
+    payloads = [encode_value(KIND_NAMES[index_key[2]], value) for index_key, _, value in entries]
+    offset = HEADER.size + INDEX.size * len(entries)
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(entries), clock()))
+        for ((lat, lon, kind), stored_at, _), payload in zip(entries, payloads):
+            file.write(INDEX.pack(lat, lon, kind, stored_at, offset, len(payload)))
+            offset += len(payload)
+        for payload in payloads:
+            file.write(payload)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    return len(entries)
+
+
+# Снимок кэша прогнозов, отображенный в память. Записи загружаются по одной при обращении
+# (ForecastCache.snapshot), записи старше max_age не используются.
+class ForecastSnapshot:
+    def __init__(self, path=FORECAST_SNAPSHOT_FILE, max_age=STALE_MAX_AGE, clock=time.time):
+        self.path = path
+        self.max_age = max_age
+        self.clock = clock
+        self._file = None
+        self._mmap = None
+        self._count = 0
+        # Индексы записей, которые уже переданы в кэш
+        self._taken = set()
+        self.loaded = 0
+        self.open()
+
+    def open(self):
+        self.close()
+        self._taken = set()
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < HEADER.size:
+            return
+        self._file = open(self.path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, created_at = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            logger.warning(f"Ignoring forecast snapshot {self.path} with unknown format")
+            self.close()
+            return
+        self._count = count
+        logger.info(f"Opened forecast snapshot with {count} entries, {self.clock() - created_at:.0f}s old")
+
+    def __len__(self):
+        return self._count
+
+    def _index(self, position):
+        return INDEX.unpack_from(self._mmap, HEADER.size + INDEX.size * position)
+
+    # Двоичный поиск по индексу: номер записи или None
+    def _find(self, index_key):
+        position = bisect.bisect_left(range(self._count), index_key, key=lambda i: self._index(i)[:3])
+        if position < self._count and self._index(position)[:3] == index_key:
+            return position
+        return None
+
+    def _decode(self, position):
+        lat, lon, kind, stored_at, offset, length = self._index(position)
+        return stored_at, decode_value(KIND_NAMES[kind], self._mmap[offset:offset + length])
+
+    # (stored_at, значение) для ключа кэша или None, если записи нет, она уже загружена или устарела
+    def take(self, key):
+        if self._mmap is None:
+            return None
+        position = self._find(_index_key(key))
+        if position is None or position in self._taken:
+            return None
+        self._taken.add(position)
+        stored_at = self._index(position)[3]
+        if self.clock() - stored_at > self.max_age:
+            return None
+        self.loaded += 1
+        return self._decode(position)
+
+    # Записи, которые еще не загружены в кэш и не устарели: [(ключ кэша, stored_at, значение)]
+    def remaining(self):
+        result = []
+        now = self.clock()
+        for position in range(self._count):
+            if position in self._taken:
+                continue
+            lat, lon, kind, stored_at, _, _ = self._index(position)
+            if now - stored_at > self.max_age:
+                continue
+            _, value = self._decode(position)
+            result.append(((lat / COORD_SCALE, lon / COORD_SCALE, KIND_NAMES[kind]), stored_at, value))
+        return result
+
+    # Запись нового снимка из записей кэша (ForecastCache.entries) и еще не загруженных
+    # записей текущего; вызывается в отдельном потоке, после нее снимок нужно открыть заново
+    def save(self, entries):
+        now = self.clock()
+        entries = [entry for entry in entries if now - entry[1] <= self.max_age]
+        keys = {key for key, _, _ in entries}
+        entries.extend(entry for entry in self.remaining() if entry[0] not in keys)
+        return write_snapshot(self.path, entries, self.clock)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+        self._mmap = None
+        self._file = None
+        self._count = 0
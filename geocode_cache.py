@@ -0,0 +1,115 @@
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+
+from records import Location
+
+logger = logging.getLogger(__name__)
+
+# Файл постоянного кэша геокодирования
+GEOCODE_DB_FILE = os.environ.get("GEOCODE_DB_FILE", "geocode.db")
+
+# Сколько секунд помнить, что название не найдено
+NEGATIVE_TTL = int(os.environ.get("GEOCODE_NEGATIVE_TTL", "86400"))
+
+# Результат поиска для названий, которые API не нашел
+NOT_FOUND = object()
+
+
+# Нормализация названия: регистр, ё/е и лишние пробелы не важны
+def normalize_name(name):
+    name = name.casefold().replace("ё", "е")
+    return re.sub(r"\s+", " ", name).strip()
+
+
+# Постоянный кэш «название -> локация» с отрицательным кэшем для опечаток.
+# Записи читаются из SQLite по одной при первом запросе названия и дальше держатся в памяти,
+# поэтому запуск не зависит от размера кэша.
+class GeocodeCache:
+    def __init__(self, path=GEOCODE_DB_FILE, negative_ttl=NEGATIVE_TTL, clock=time.time):
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocode ("
+            "query TEXT PRIMARY KEY, name TEXT, country TEXT, lat REAL, lon REAL, "
+            "found INTEGER NOT NULL, updated_at REAL NOT NULL)"
+        )
+        # id населенного пункта добавлен позже, в старых файлах колонки нет
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(geocode)")]
+        if "city_id" not in columns:
+            self._conn.execute("ALTER TABLE geocode ADD COLUMN city_id INTEGER")
+        # normalized query -> (location или None, updated_at) для уже прочитанных записей
+        self._entries = {}
+
+    # Запись из памяти или из SQLite
+    def _entry(self, query):
+        entry = self._entries.get(query)
+        if entry is not None:
+            return entry
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT name, country, lat, lon, city_id, found, updated_at FROM geocode WHERE query = ?", (query,)
+            ).fetchone()
+        if row is None:
+            return None
+        name, country, lat, lon, city_id, found, updated_at = row
+        entry = (Location(name, country, lat, lon, city_id=city_id) if found else None, updated_at)
+        self._entries[query] = entry
+        return entry
+
+    # Локация из кэша (Location), NOT_FOUND для недавно не найденных названий или None, если запроса к API не было
+    def get(self, location_name):
+        entry = self._entry(normalize_name(location_name))
+        if entry is not None:
+            location, updated_at = entry
+            if location is not None:
+                self.hits += 1
+                return location
+            if self.clock() - updated_at <= self.negative_ttl:
+                self.hits += 1
+                return NOT_FOUND
+        self.misses += 1
+        return None
+
+    # Сохранение найденной локации под введенным и под официальным названием
+    def set(self, location_name, location):
+        location = Location(location.name, location.country, location.lat, location.lon,
+                            city_id=location.city_id)
+        queries = {normalize_name(location_name), normalize_name(location.name)}
+        for query in queries:
+            self._store(query, location)
+
+    # Запоминаем, что название не найдено
+    def set_not_found(self, location_name):
+        self._store(normalize_name(location_name), None)
+
+    def _store(self, query, location):
+        updated_at = self.clock()
+        self._entries[query] = (location, updated_at)
+        if location is None:
+            row = (query, None, None, None, None, None, 0, updated_at)
+        else:
+            row = (query, location.name, location.country, location.lat, location.lon,
+                   location.city_id, 1, updated_at)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode (query, name, country, lat, lon, city_id, found, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                row
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,129 @@
+import os
+import re
+import time
+import functools
+from prometheus_client import Counter, Histogram, Gauge, start_http_server
+from telegram.request import HTTPXRequest
+
+from profiling import current_trace, start_trace, finish_trace, span
+
+# Порт отдельного HTTP-сервера метрик для процесса worker (в режиме webhook метрики отдает app.py)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+
+# Размер пула соединений с Bot API: как у ApplicationBuilder по умолчанию, иначе
+# одновременные обработчики (BOT_CONCURRENCY) ждут одно соединение и получают TimedOut
+TELEGRAM_POOL_SIZE = int(os.environ.get("TELEGRAM_POOL_SIZE", "256"))
+
+# Границы корзин гистограмм в секундах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HANDLER_LATENCY = Histogram(
+    "nibble_handler_seconds", "Время обработки обновления", ["handler", "kind"],
+    buckets=LATENCY_BUCKETS
+)
+HANDLER_ERRORS = Counter(
+    "nibble_handler_errors_total", "Ошибки в обработчиках", ["handler", "kind"]
+)
+UPSTREAM_LATENCY = Histogram(
+    "nibble_upstream_seconds", "Время запросов к OpenWeatherMap", ["endpoint"],
+    buckets=LATENCY_BUCKETS
+)
+UPSTREAM_ERRORS = Counter(
+    "nibble_upstream_errors_total", "Ошибки запросов к OpenWeatherMap", ["endpoint", "reason"]
+)
+TELEGRAM_LATENCY = Histogram(
+    "nibble_telegram_seconds", "Время запросов к Telegram Bot API", ["method"],
+    buckets=LATENCY_BUCKETS
+)
+STORAGE_LATENCY = Histogram(
+    "nibble_storage_seconds", "Время операций с хранилищем пользователей", ["operation"],
+    buckets=LATENCY_BUCKETS
+)
+CACHE_HITS = Gauge("nibble_forecast_cache_hits", "Попадания в кэш прогнозов")
+CACHE_MISSES = Gauge("nibble_forecast_cache_misses", "Промахи кэша прогнозов")
+CACHE_BYTES = Gauge("nibble_forecast_cache_bytes", "Оценка памяти кэша прогнозов")
+QUOTA_REMAINING = Gauge("nibble_quota_remaining", "Остаток квоты OpenWeatherMap", ["period"])
+BREAKER_OPEN = Gauge("nibble_weather_breaker_open", "Выключатель OpenWeatherMap разомкнут")
+
+
+# Вид callback-кнопки без номера локации: forecast_3 -> forecast
+def callback_kind(data):
+    return re.sub(r"_\d+$", "", data or "")
+
+
+# Команды бота; любая другая команда попадает в метрики как «other», чтобы произвольный
+# текст после «/» не создавал новые ряды
+KNOWN_COMMANDS = frozenset(
+    ("start", "help", "forecast", "locations", "compare", "add_location", "digest", "profile")
+)
+
+
+# Вид обновления для разбивки метрик обработчика
+def update_kind(update):
+    if update.callback_query:
+        return callback_kind(update.callback_query.data)
+    if update.inline_query:
+        return "inline_query"
+    if update.message and update.message.text and update.message.text.startswith("/"):
+        # /start@FishNibble_bot -> start
+        command = update.message.text.split()[0][1:].split("@")[0].lower()
+        return command if command in KNOWN_COMMANDS else "other"
+    return "message"
+
+
+# Декоратор обработчика: гистограмма времени и счетчик ошибок по имени обработчика и виду обновления,
+# трасса обновления для логов и разбивка времени медленных обновлений по этапам.
+# Обработчик, вызванный из другого обработчика, продолжает его трассу.
+def observe_handler(handler):
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        labels = (handler.__name__, update_kind(update))
+        trace_token = start_trace(update) if current_trace.get() is None else None
+        started = time.perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception:
+            HANDLER_ERRORS.labels(*labels).inc()
+            raise
+        finally:
+            HANDLER_LATENCY.labels(*labels).observe(time.perf_counter() - started)
+            if trace_token is not None:
+                finish_trace(trace_token, "/".join(labels))
+    return wrapper
+
+
+# Декоратор операции хранилища
+def observe_storage(operation):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with STORAGE_LATENCY.labels(operation).time(), span("storage"):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Транспорт Bot API с замером времени каждого метода (sendMessage, editMessageText, ...)
+class ObservedRequest(HTTPXRequest):
+    def __init__(self, connection_pool_size=TELEGRAM_POOL_SIZE, **kwargs):
+        super().__init__(connection_pool_size=connection_pool_size, **kwargs)
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        with TELEGRAM_LATENCY.labels(url.rsplit("/", 1)[-1]).time(), span("telegram"):
+            return await super().do_request(url, method, request_data, *args, **kwargs)
+
+
+# Метрики, которые считываются из объектов бота в момент сбора
+def register_state_gauges(forecast_cache, quota, breaker):
+    CACHE_HITS.set_function(lambda: forecast_cache.hits)
+    CACHE_MISSES.set_function(lambda: forecast_cache.misses)
+    CACHE_BYTES.set_function(lambda: forecast_cache.bytes_used)
+    QUOTA_REMAINING.labels("minute").set_function(quota.remaining_minute)
+    QUOTA_REMAINING.labels("day").set_function(quota.remaining_day)
+    BREAKER_OPEN.set_function(lambda: 1 if breaker.is_open else 0)
+
+
+# Отдельный HTTP-сервер метрик, если задан METRICS_PORT
+def start_metrics_server(port=METRICS_PORT):
+    if port:
+        start_http_server(port)
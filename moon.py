@@ -0,0 +1,92 @@
+import math
+import time
+
+# Средняя продолжительность синодического месяца в сутках
+SYNODIC_MONTH = 29.530588853
+
+SECONDS_PER_DAY = 86400
+
+# Юлианская дата начала эпохи Unix
+UNIX_EPOCH_JD = 2440587.5
+
+# Фазы луны и их влияние на клёв (порядок совпадает с номером фазы)
+PHASES = (
+    {"phase": 0, "name": "Новолуние 🌑", "fishing_factor": 0.7},
+    {"phase": 1, "name": "Растущий серп 🌒", "fishing_factor": 0.8},
+    {"phase": 2, "name": "Первая четверть 🌓", "fishing_factor": 0.9},
+    {"phase": 3, "name": "Растущая луна 🌔", "fishing_factor": 0.85},
+    {"phase": 4, "name": "Полнолуние 🌕", "fishing_factor": 1.0},
+    {"phase": 5, "name": "Убывающая луна 🌖", "fishing_factor": 0.85},
+    {"phase": 6, "name": "Последняя четверть 🌗", "fishing_factor": 0.75},
+    {"phase": 7, "name": "Убывающий серп 🌘", "fishing_factor": 0.7},
+)
+
+# Верхние границы возраста луны (в сутках) для каждой фазы
+PHASE_BOUNDS = ((2, 0), (7, 1), (9, 2), (14, 3), (16, 4), (21, 5), (23, 6), (28, 7))
+
+# Таблица фаз по дням: с месяца назад и на несколько лет вперед
+TABLE_DAYS_BEFORE = 31
+TABLE_DAYS_AFTER = 3 * 366
+
+
+# Возраст луны в сутках (0 — новолуние, около 14.8 — полнолуние) для отметки времени Unix.
+# Элонгация Луны считается по средним элементам орбит с основными периодическими поправками
+# (Meeus, «Astronomical Algorithms», гл. 48), точность — порядка нескольких часов.
+def moon_age(timestamp):
+    jd = timestamp / SECONDS_PER_DAY + UNIX_EPOCH_JD
+    t = (jd - 2451545.0) / 36525
+    d = math.radians((297.8501921 + 445267.1114034 * t - 0.0018819 * t * t) % 360)
+    m = math.radians((357.5291092 + 35999.0502909 * t - 0.0001536 * t * t) % 360)
+    m_moon = math.radians((134.9633964 + 477198.8675055 * t + 0.0087414 * t * t) % 360)
+    # Фазовый угол: 180° — новолуние, 0° — полнолуние
+    phase_angle = (180 - math.degrees(d)
+                   - 6.289 * math.sin(m_moon)
+                   + 2.100 * math.sin(m)
+                   - 1.274 * math.sin(2 * d - m_moon)
+                   - 0.658 * math.sin(2 * d)
+                   - 0.214 * math.sin(2 * m_moon)
+                   - 0.110 * math.sin(d))
+    elongation = (180 - phase_angle) % 360
+    return elongation / 360 * SYNODIC_MONTH
+
+
+# Номер фазы по возрасту луны
+def phase_index(age):
+    for bound, index in PHASE_BOUNDS:
+        if age < bound:
+            return index
+    return 0
+
+
+# Фазы по дням (на полдень UTC) в виде массива байт: поиск по дню — одно обращение по индексу
+class MoonTable:
+    def __init__(self, start_day, days):
+        self.start_day = start_day
+        self.phases = bytes(
+            phase_index(moon_age((start_day + i) * SECONDS_PER_DAY + SECONDS_PER_DAY / 2))
+            for i in range(days)
+        )
+
+    def get(self, timestamp):
+        index = int(timestamp // SECONDS_PER_DAY) - self.start_day
+        if 0 <= index < len(self.phases):
+            return PHASES[self.phases[index]]
+        return PHASES[phase_index(moon_age(timestamp))]
+
+
+_table = None
+
+
+# Таблица строится один раз при первом обращении
+def get_table():
+    global _table
+    if _table is None:
+        today = int(time.time() // SECONDS_PER_DAY)
+        _table = MoonTable(today - TABLE_DAYS_BEFORE, TABLE_DAYS_BEFORE + TABLE_DAYS_AFTER)
+    return _table
+
+
+# Фаза луны для отметки времени Unix (по умолчанию — текущее время).
+# Возвращаемый словарь общий для всех вызовов, изменять его нельзя.
+def get_moon_phase(timestamp=None):
+    return get_table().get(time.time() if timestamp is None else timestamp)
@@ -0,0 +1,147 @@
+import os
+import time
+import asyncio
+import logging
+
+from forecast_cache import CURRENT, DAILY, normalize_coords
+from quota import request_priority, BACKGROUND
+from weather_client import GROUP_MAX_IDS
+
+logger = logging.getLogger(__name__)
+
+# Как часто (в секундах) запускается фоновое обновление прогнозов
+PREFETCH_INTERVAL = int(os.environ.get("PREFETCH_INTERVAL", "600"))
+
+# Сколько запросов к API можно потратить за один запуск
+PREFETCH_BUDGET = int(os.environ.get("PREFETCH_BUDGET", "60"))
+
+# Сколько локаций обновляются одновременно
+PREFETCH_CONCURRENCY = int(os.environ.get("PREFETCH_CONCURRENCY", "5"))
+
+# Локация считается недавно запрошенной, если о ней спрашивали за последние столько секунд
+PREFETCH_ACTIVE_WINDOW = int(os.environ.get("PREFETCH_ACTIVE_WINDOW", str(3 * 86400)))
+
+# Запись обновляется заранее, когда прожито столько от ее TTL
+PREFETCH_REFRESH_RATIO = float(os.environ.get("PREFETCH_REFRESH_RATIO", "0.8"))
+
+
+# Фоновое обновление прогнозов для всех локаций, сохраненных пользователями.
+# refresh(lat, lon, forecast) запрашивает данные у API: при forecast=None — текущую погоду
+# и прогноз (2 запроса), иначе только текущую погоду (1 запрос).
+# refresh_current(locations) обновляет текущую погоду сразу для многих локаций с city_id
+# групповыми запросами (до GROUP_MAX_IDS локаций в одном HTTP-запросе, но квота OpenWeatherMap
+# расходуется на каждую локацию) и возвращает число обновленных.
+class ForecastPrefetcher:
+    def __init__(self, refresh, cache, user_store, budget=PREFETCH_BUDGET,
+                 concurrency=PREFETCH_CONCURRENCY, active_window=PREFETCH_ACTIVE_WINDOW,
+                 refresh_ratio=PREFETCH_REFRESH_RATIO, clock=time.time, refresh_current=None):
+        self.refresh = refresh
+        self.refresh_current = refresh_current
+        self.cache = cache
+        self.user_store = user_store
+        self.budget = budget
+        self.concurrency = concurrency
+        self.active_window = active_window
+        self.refresh_ratio = refresh_ratio
+        self.clock = clock
+        # normalized coords -> время последнего запроса пользователем
+        self.last_requested = {}
+        self.runs = 0
+        self.refreshed = 0
+        self.failed = 0
+
+    # Отметка о том, что пользователь запросил прогноз для локации
+    def touch(self, lat, lon):
+        self.last_requested[normalize_coords(lat, lon)] = self.clock()
+
+    # Все различные локации пользователей: {normalized coords: Location}, предпочтительно с city_id
+    def collect_locations(self):
+        locations = {}
+        for _, user in self.user_store.all_users():
+            for location in user["locations"]:
+                key = normalize_coords(location.lat, location.lon)
+                if key not in locations or locations[key].city_id is None:
+                    locations[key] = location
+        return locations
+
+    # План обновления в порядке приоритета, в пределах бюджета: [(стоимость, lat, lon, forecast)]
+    # и локации, текущая погода которых обновляется групповыми запросами.
+    # Сначала недавно запрошенные локации, среди остальных — самые устаревшие.
+    def plan(self):
+        now = self.clock()
+        candidates = []
+        for key, location in self.collect_locations().items():
+            lat, lon = location.lat, location.lon
+            recent_at = self.last_requested.get(key, 0)
+            active = now - recent_at <= self.active_window
+            forecast, forecast_age = self.cache.peek(lat, lon, DAILY)
+            if forecast is None or forecast_age > self.cache.ttls[DAILY] * self.refresh_ratio:
+                candidates.append((active, recent_at, forecast_age or float("inf"), 2, location, None))
+                continue
+            # Текущую погоду держим свежей только для недавно запрошенных локаций
+            _, current_age = self.cache.peek(lat, lon, CURRENT)
+            if active and (current_age is None or current_age > self.cache.ttls[CURRENT] * self.refresh_ratio):
+                candidates.append((active, recent_at, current_age or float("inf"), 1, location, forecast))
+
+        candidates.sort(key=lambda item: item[:3], reverse=True)
+        planned = []
+        grouped = []
+        spent = 0
+        for _, _, _, cost, location, forecast in candidates:
+            if spent + cost > self.budget:
+                continue
+            spent += cost
+            if cost == 1 and location.city_id is not None and self.refresh_current is not None:
+                # Текущая погода локаций с city_id запрашивается группами: квоты столько же,
+                # а HTTP-запросов в GROUP_MAX_IDS раз меньше
+                grouped.append(location)
+                continue
+            planned.append((cost, location.lat, location.lon, forecast))
+        return planned, grouped
+
+    async def _refresh_one(self, semaphore, lat, lon, forecast):
+        # Фоновые запросы получают квоту после пользовательских
+        request_priority.set(BACKGROUND)
+        async with semaphore:
+            try:
+                await self.refresh(lat, lon, forecast)
+                self.refreshed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"Prefetch failed for {lat}, {lon}: {e}")
+
+    async def _refresh_group(self, locations):
+        request_priority.set(BACKGROUND)
+        try:
+            refreshed = await self.refresh_current(locations)
+        except Exception as e:
+            self.failed += len(locations)
+            logger.warning(f"Group prefetch failed for {len(locations)} locations: {e}")
+            return
+        self.refreshed += refreshed
+        self.failed += len(locations) - refreshed
+
+    # Один запуск обновления (колбэк для JobQueue)
+    async def run(self, context=None):
+        started = time.perf_counter()
+        planned, grouped = self.plan()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = [self._refresh_one(semaphore, lat, lon, forecast) for _, lat, lon, forecast in planned]
+        if grouped:
+            tasks.append(self._refresh_group(grouped))
+        await asyncio.gather(*tasks)
+        self.runs += 1
+        calls = sum(cost for cost, _, _, _ in planned) + len(grouped)
+        requests = len(planned) + -(-len(grouped) // GROUP_MAX_IDS)
+        logger.info(
+            f"Prefetched {len(planned) + len(grouped)} locations "
+            f"({calls} API calls in {requests} requests) in {time.perf_counter() - started:.2f}s"
+        )
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+            "tracked_locations": len(self.last_requested)
+        }
@@ -0,0 +1,142 @@
+import os
+import sys
+import time
+import uuid
+import logging
+import threading
+import contextlib
+import contextvars
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Обновления, обработка которых дольше стольких миллисекунд, попадают в лог с разбивкой
+# времени по этапам (0 — не логировать)
+SLOW_UPDATE_MS = int(os.environ.get("SLOW_UPDATE_MS", "1000"))
+
+# id пользователей Telegram через запятую, которым доступна команда /profile
+ADMIN_USER_IDS = frozenset(
+    int(user_id) for user_id in os.environ.get("ADMIN_USER_IDS", "").split(",") if user_id.strip()
+)
+
+# Интервал сэмплирования профилировщика в миллисекундах
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+
+# Длительность профилирования по умолчанию и наибольшая (в секундах)
+PROFILE_DEFAULT_SECONDS = 10
+PROFILE_MAX_SECONDS = 120
+
+# Трасса обновления, которое сейчас обрабатывается (своя у каждой задачи asyncio)
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+# Трасса одного обновления: id для логов и суммарное время по этапам
+# (fetch — OpenWeatherMap, storage — хранилище, render — тексты, telegram — Bot API).
+# Одновременные запросы одного обновления складываются, поэтому сумма этапов может
+# превышать общее время.
+class UpdateTrace:
+    __slots__ = ("trace_id", "started", "spans")
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.started = time.perf_counter()
+        self.spans = {}
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    # Например: «1.52s: fetch 1.20s, telegram 0.20s, render 0.05s, other 0.07s»
+    def breakdown(self):
+        total = self.elapsed()
+        parts = [f"{name} {seconds:.2f}s" for name, seconds in
+                 sorted(self.spans.items(), key=lambda item: -item[1])]
+        parts.append(f"other {max(0.0, total - sum(self.spans.values())):.2f}s")
+        return f"{total:.2f}s: " + ", ".join(parts)
+
+
+# Начало трассы обновления: id — номер обновления Telegram, по нему одно нажатие
+# находится в логах всех этапов (и в логах веб-процесса, и в логах обработчика)
+def start_trace(update):
+    update_id = getattr(update, "update_id", None)
+    trace_id = str(update_id) if update_id is not None else uuid.uuid4().hex[:8]
+    return current_trace.set(UpdateTrace(trace_id))
+
+
+# Завершение трассы; медленные обновления логируются с разбивкой времени
+def finish_trace(token, description, slow_ms=SLOW_UPDATE_MS):
+    trace = current_trace.get()
+    if slow_ms and trace is not None and trace.elapsed() * 1000 >= slow_ms:
+        logger.warning(f"Slow update {description}: {trace.breakdown()}")
+    current_trace.reset(token)
+
+
+# Учет времени этапа в трассе текущего обновления (вне обработки обновления ничего не делает)
+@contextlib.contextmanager
+def span(name):
+    trace = current_trace.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if trace is not None:
+            trace.add(name, time.perf_counter() - started)
+
+
+# Поле trace_id во всех записях лога: id трассы текущего обновления или «-»
+def install_trace_logging():
+    factory = logging.getLogRecordFactory()
+
+    def record_factory(*args, **kwargs):
+        record = factory(*args, **kwargs)
+        trace = current_trace.get()
+        record.trace_id = trace.trace_id if trace is not None else "-"
+        return record
+
+    logging.setLogRecordFactory(record_factory)
+
+
+# Сэмплирующий профилировщик: отдельный поток каждые interval секунд снимает стек потока
+# событийного цикла и считает одинаковые стеки. Результат — collapsed stacks
+# («функция;функция;... число»), из которого flamegraph.pl или speedscope строят flamegraph.
+class SamplingProfiler:
+    # Профилируется ли процесс сейчас (одновременно допускается один профиль)
+    running = False
+
+    def __init__(self, interval=PROFILE_INTERVAL_MS / 1000, thread_id=None):
+        self.interval = interval
+        # По умолчанию профилируется поток, создавший профилировщик
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        SamplingProfiler.running = True
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        SamplingProfiler.running = False
+        return self.collapsed()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
@@ -0,0 +1,183 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import contextvars
+
+# Лимиты тарифа OpenWeatherMap
+CALLS_PER_MINUTE = int(os.environ.get("OWM_CALLS_PER_MINUTE", "60"))
+CALLS_PER_DAY = int(os.environ.get("OWM_CALLS_PER_DAY", "30000"))
+
+# Приоритеты запросов: чем меньше число, тем раньше запрос получает квоту
+INTERACTIVE = 0
+GEOCODING = 1
+BACKGROUND = 2
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", GEOCODING: "geocoding", BACKGROUND: "background"}
+
+# Доля дневной квоты, которая не отдается запросам этого приоритета (резерв для более важных)
+DAILY_RESERVE = {INTERACTIVE: 0.0, GEOCODING: 0.05, BACKGROUND: 0.25}
+
+# Сколько секунд запрос может ждать квоту, прежде чем будет отклонен
+MAX_WAIT = {INTERACTIVE: 10.0, GEOCODING: 10.0, BACKGROUND: 30.0}
+
+# Приоритет текущих запросов к API. Фоновые задачи и геокодирование выставляют его сами,
+# по умолчанию запрос считается пользовательским.
+request_priority = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+
+# Общий приоритет запроса, который выполняется сразу для нескольких ожидающих (SingleFlight)
+shared_priority = contextvars.ContextVar("shared_priority", default=None)
+
+SECONDS_PER_DAY = 86400
+
+
+# Квота исчерпана, запрос отклонен
+class QuotaExceeded(Exception):
+    pass
+
+
+# Приоритет общего запроса: наивысший среди его ожидающих. Если к фоновому запросу,
+# который уже стоит в очереди за квотой, присоединяется пользовательский, запрос
+# переставляется в очереди с новым приоритетом.
+class SharedPriority:
+    def __init__(self, priority):
+        self.priority = priority
+        # Функции, переставляющие ожидания квоты этого запроса
+        self.listeners = set()
+
+    def raise_to(self, priority):
+        if priority >= self.priority:
+            return
+        self.priority = priority
+        for listener in list(self.listeners):
+            listener(priority)
+
+
+# Приоритет текущего запроса с учетом общего
+def current_priority():
+    priority = request_priority.get()
+    shared = shared_priority.get()
+    return priority if shared is None else min(priority, shared.priority)
+
+
+# Общий для всех запросов погоды учет квоты: ведро токенов на минуту и счетчик на сутки (UTC).
+# Ожидающие запросы получают квоту в порядке приоритета, фоновые запросы отклоняются,
+# когда дневной остаток подходит к резерву.
+class QuotaGovernor:
+    def __init__(self, per_minute=CALLS_PER_MINUTE, per_day=CALLS_PER_DAY,
+                 reserve=DAILY_RESERVE, max_wait=MAX_WAIT, clock=time.time):
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self.clock = clock
+        self._tokens = float(per_minute)
+        self._refilled_at = clock()
+        self._day = int(clock() // SECONDS_PER_DAY)
+        self._used_today = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._wakeup = None
+        self.granted = {priority: 0 for priority in PRIORITY_NAMES}
+        self.shed = {priority: 0 for priority in PRIORITY_NAMES}
+
+    def _refill(self):
+        now = self.clock()
+        day = int(now // SECONDS_PER_DAY)
+        if day != self._day:
+            self._day = day
+            self._used_today = 0
+        self._tokens = min(self.per_minute, self._tokens + (now - self._refilled_at) * self.per_minute / 60)
+        self._refilled_at = now
+
+    def remaining_minute(self):
+        self._refill()
+        return int(self._tokens)
+
+    def remaining_day(self):
+        self._refill()
+        return self.per_day - self._used_today
+
+    # Не дошел ли дневной остаток до резерва для этого приоритета
+    def _over_reserve(self, priority, cost):
+        return self.remaining_day() - cost < self.per_day * self.reserve[priority]
+
+    def _take(self, priority, cost):
+        self._tokens -= cost
+        self._used_today += cost
+        self.granted[priority] += 1
+
+    # Выдача квоты ожидающим в порядке приоритета
+    def _pump(self):
+        self._wakeup = None
+        self._refill()
+        while self._waiters:
+            priority, _, cost, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self._over_reserve(priority, cost):
+                heapq.heappop(self._waiters)
+                self.shed[priority] += 1
+                future.set_exception(QuotaExceeded("Daily OpenWeatherMap quota reserved for higher priority"))
+                continue
+            if self._tokens < cost:
+                # Ждем, пока в ведре появятся токены
+                delay = (cost - self._tokens) * 60 / self.per_minute
+                self._wakeup = asyncio.get_running_loop().call_later(delay, self._pump)
+                return
+            heapq.heappop(self._waiters)
+            self._take(priority, cost)
+            future.set_result(None)
+
+    # Повышение приоритета ожидающего запроса: в очередь добавляется еще одна запись
+    # с тем же future, которую _pump обработает раньше (старая будет пропущена)
+    def _promote(self, priority, cost, future):
+        if future.done():
+            return
+        heapq.heappush(self._waiters, (priority, next(self._sequence), cost, future))
+        if self._wakeup is None:
+            self._pump()
+
+    # Ожидание квоты на cost запросов; приоритет берется из request_priority
+    # (и общего приоритета SharedPriority), если не указан
+    async def acquire(self, priority=None, cost=1):
+        shared = shared_priority.get() if priority is None else None
+        priority = current_priority() if priority is None else priority
+        self._refill()
+        if self._over_reserve(priority, cost):
+            self.shed[priority] += 1
+            raise QuotaExceeded("Daily OpenWeatherMap quota reserved for higher priority")
+        if not self._waiters and self._tokens >= cost:
+            self._take(priority, cost)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), cost, future))
+        if self._wakeup is None:
+            self._pump()
+
+        def promote(raised):
+            self._promote(raised, cost, future)
+
+        if shared is not None:
+            shared.listeners.add(promote)
+        try:
+            await asyncio.wait_for(future, self.max_wait[priority])
+        except asyncio.TimeoutError:
+            self.shed[priority] += 1
+            raise QuotaExceeded("Timed out waiting for OpenWeatherMap quota")
+        finally:
+            if shared is not None:
+                shared.listeners.discard(promote)
+
+    # Метрики остатка квоты
+    def stats(self):
+        return {
+            "remaining_minute": self.remaining_minute(),
+            "remaining_day": self.remaining_day(),
+            "waiting": len({future for _, _, _, future in self._waiters if not future.done()}),
+            "granted": {PRIORITY_NAMES[p]: count for p, count in self.granted.items()},
+            "shed": {PRIORITY_NAMES[p]: count for p, count in self.shed.items()}
+        }
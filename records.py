@@ -0,0 +1,248 @@
+import math
+import time
+import bisect
+from array import array
+from datetime import datetime
+
+# Компактные записи для локаций и прогнозов вместо вложенных словарей.
+# Записи со __slots__ не хранят словарь атрибутов, 3-часовые интервалы лежат в массивах чисел.
+# В JSON (хранилище пользователей, снимки кэша) записи превращаются методами to_json/from_json.
+
+ADDED_AT_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+# Сохраненная пользователем локация. Записи не изменяются после создания,
+# поэтому копирование возвращает тот же объект.
+class Location:
+    __slots__ = ("name", "country", "lat", "lon", "added_at", "city_id")
+
+    def __init__(self, name, country, lat, lon, added_at=None, city_id=None):
+        self.name = name
+        self.country = country
+        self.lat = lat
+        self.lon = lon
+        # Время добавления (Unix time) или None для результатов поиска
+        self.added_at = added_at
+        # id населенного пункта в OpenWeatherMap (для группового запроса текущей погоды) или None
+        self.city_id = city_id
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __eq__(self, other):
+        return isinstance(other, Location) and all(
+            getattr(self, name) == getattr(other, name) for name in Location.__slots__
+        )
+
+    def __repr__(self):
+        return f"Location({self.name!r}, {self.country!r}, {self.lat}, {self.lon})"
+
+    # Та же локация с отметкой времени добавления
+    def added(self, timestamp=None):
+        return Location(self.name, self.country, self.lat, self.lon,
+                        int(time.time() if timestamp is None else timestamp), self.city_id)
+
+    def to_json(self):
+        data = {"name": self.name, "country": self.country, "lat": self.lat, "lon": self.lon}
+        if self.added_at is not None:
+            data["added_at"] = self.added_at
+        if self.city_id is not None:
+            data["id"] = self.city_id
+        return data
+
+    @classmethod
+    def from_json(cls, data):
+        added_at = data.get("added_at")
+        if isinstance(added_at, str):
+            # Старый формат: строка с датой в местном времени сервера
+            added_at = int(datetime.strptime(added_at, ADDED_AT_FORMAT).timestamp())
+        return cls(data["name"], data["country"], data["lat"], data["lon"], added_at, data.get("id"))
+
+
+# Текущая погода (ответ /weather)
+class Current:
+    __slots__ = ("temp", "feels_like", "pressure", "humidity", "wind_speed", "wind_deg", "clouds")
+
+    def __init__(self, temp, feels_like, pressure, humidity, wind_speed, wind_deg, clouds):
+        self.temp = temp
+        self.feels_like = feels_like
+        self.pressure = pressure
+        self.humidity = humidity
+        self.wind_speed = wind_speed
+        self.wind_deg = wind_deg
+        self.clouds = clouds
+
+    @classmethod
+    def from_api(cls, current_data):
+        return cls(
+            current_data["main"]["temp"],
+            current_data["main"]["feels_like"],
+            current_data["main"]["pressure"],
+            current_data["main"]["humidity"],
+            current_data["wind"]["speed"],
+            current_data["wind"]["deg"],
+            current_data["clouds"]["all"]
+        )
+
+    def to_json(self):
+        return {name: getattr(self, name) for name in Current.__slots__}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(*(data[name] for name in Current.__slots__))
+
+
+# Итоги одного дня прогноза. Тренд давления и прежнее направление ветра
+# известны не всегда, отсутствующие значения хранятся как NaN.
+class DailyForecast:
+    __slots__ = ("temp_day", "temp_night", "pressure", "humidity", "wind_speed", "wind_deg",
+                 "clouds", "rain", "pressure_trend", "prev_wind_dir")
+
+    def __init__(self, temp_day, temp_night, pressure, humidity, wind_speed, wind_deg, clouds,
+                 rain=0, pressure_trend=math.nan, prev_wind_dir=math.nan):
+        self.temp_day = temp_day
+        self.temp_night = temp_night
+        self.pressure = pressure
+        self.humidity = humidity
+        self.wind_speed = wind_speed
+        self.wind_deg = wind_deg
+        self.clouds = clouds
+        self.rain = rain
+        self.pressure_trend = pressure_trend
+        self.prev_wind_dir = prev_wind_dir
+
+    # JSON в прежнем формате дневного прогноза: {"temp": {"day", "night"}, ..., "rain"}
+    def to_json(self):
+        data = {
+            "temp": {"day": self.temp_day, "night": self.temp_night},
+            "pressure": self.pressure,
+            "humidity": self.humidity,
+            "wind_speed": self.wind_speed,
+            "wind_deg": self.wind_deg,
+            "clouds": self.clouds
+        }
+        if self.rain > 0:
+            data["rain"] = self.rain
+        if not math.isnan(self.pressure_trend):
+            data["pressure_trend"] = self.pressure_trend
+        if not math.isnan(self.prev_wind_dir):
+            data["prev_wind_dir"] = self.prev_wind_dir
+        return data
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            data["temp"]["day"], data["temp"]["night"], data["pressure"], data["humidity"],
+            data["wind_speed"], data["wind_deg"], data["clouds"], data.get("rain", 0),
+            data.get("pressure_trend", math.nan), data.get("prev_wind_dir", math.nan)
+        )
+
+
+# Колонки 3-часовых интервалов прогноза
+HOURLY_COLUMNS = ("dt", "temp", "pressure", "humidity", "wind_speed", "wind_deg", "clouds", "rain")
+
+
+# 3-часовые интервалы прогноза (ответ /forecast) в колоночном виде: по массиву на величину
+class HourlySeries:
+    __slots__ = HOURLY_COLUMNS
+
+    def __init__(self):
+        for name in HOURLY_COLUMNS:
+            setattr(self, name, array('d'))
+
+    def __len__(self):
+        return len(self.dt)
+
+    @classmethod
+    def from_api(cls, forecast_data):
+        series = cls()
+        for item in forecast_data["list"]:
+            series.dt.append(item["dt"])
+            series.temp.append(item["main"]["temp"])
+            series.pressure.append(item["main"]["pressure"])
+            series.humidity.append(item["main"]["humidity"])
+            series.wind_speed.append(item["wind"]["speed"])
+            series.wind_deg.append(item["wind"]["deg"])
+            series.clouds.append(item["clouds"]["all"])
+            series.rain.append(item.get("rain", {}).get("3h", 0))
+        return series
+
+    # Интервалы, начинающиеся раньше timestamp
+    def before(self, timestamp):
+        end = bisect.bisect_left(self.dt, timestamp)
+        series = HourlySeries()
+        for name in HOURLY_COLUMNS:
+            setattr(series, name, getattr(self, name)[:end])
+        return series
+
+    # Объем данных в байтах
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in (getattr(self, name) for name in HOURLY_COLUMNS))
+
+    def to_json(self):
+        return {name: getattr(self, name).tolist() for name in HOURLY_COLUMNS}
+
+    @classmethod
+    def from_json(cls, data):
+        series = cls()
+        for name in HOURLY_COLUMNS:
+            setattr(series, name, array('d', data[name]))
+        return series
+
+
+# Прогноз для локации: текущая погода (None в записи кэша DAILY), дни, 3-часовые интервалы,
+# смещение часового пояса локации от UTC в секундах, время получения (версия прогноза)
+# и возраст данных, если прогноз показан устаревшим.
+class Forecast:
+    __slots__ = ("current", "daily", "hourly", "timezone", "fetched_at", "stale_age")
+
+    def __init__(self, current, daily, hourly, timezone=0, fetched_at=None, stale_age=None):
+        self.current = current
+        self.daily = daily
+        self.hourly = hourly
+        self.timezone = timezone
+        self.fetched_at = fetched_at
+        self.stale_age = stale_age
+
+    # Тот же прогноз с другой текущей погодой; дни и интервалы общие, без копирования
+    def with_current(self, current, stale_age=None):
+        return Forecast(current, self.daily, self.hourly, self.timezone, self.fetched_at, stale_age)
+
+    def to_json(self):
+        data = {
+            "daily": [day.to_json() for day in self.daily],
+            "hourly": self.hourly.to_json(),
+            "timezone": self.timezone,
+            "fetched_at": self.fetched_at
+        }
+        if self.current is not None:
+            data["current"] = self.current.to_json()
+        return data
+
+    @classmethod
+    def from_json(cls, data):
+        current = data.get("current")
+        return cls(
+            Current.from_json(current) if current is not None else None,
+            tuple(DailyForecast.from_json(day) for day in data["daily"]),
+            HourlySeries.from_json(data["hourly"]),
+            data.get("timezone", 0),
+            data.get("fetched_at")
+        )
+
+
+# Функция для json.dumps(default=...): записи сериализуются своим методом to_json
+def to_json(record):
+    try:
+        return record.to_json()
+    except AttributeError:
+        raise TypeError(f"Object of type {type(record).__name__} is not JSON serializable") from None
+
+
+# Данные пользователя из JSON: локации превращаются в записи Location
+def user_from_json(data):
+    data["locations"] = [Location.from_json(location) for location in data.get("locations", [])]
+    return data
@@ -0,0 +1,248 @@
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from forecast_cache import normalize_coords
+from profiling import span
+from scoring import ScoreRows, score_batch, factor_texts, best_windows, get_bite_rating
+
+# Сколько готовых текстов прогноза хранится в памяти
+RENDER_CACHE_SIZE = int(os.environ.get("RENDER_CACHE_SIZE", "2048"))
+
+# Клавиатуры не зависят от пользователя, поэтому создаются один раз.
+# InlineKeyboardMarkup неизменяем, один объект можно отправлять в любых ответах.
+MAIN_MENU = InlineKeyboardMarkup((
+    (
+        InlineKeyboardButton("🎣 Прогноз клёва", callback_data="show_forecast"),
+        InlineKeyboardButton("📍 Мои локации", callback_data="show_locations")
+    ),
+    (
+        InlineKeyboardButton("➕ Добавить локацию", callback_data="add_location"),
+        InlineKeyboardButton("❓ Помощь", callback_data="help")
+    ),
+    (
+        InlineKeyboardButton("📊 Сравнить локации", callback_data="compare_locations"),
+        InlineKeyboardButton("🔄 Перезапуск", callback_data="restart")
+    )
+))
+BACK_TO_MENU = InlineKeyboardMarkup(((InlineKeyboardButton("🔄 Вернуться в главное меню", callback_data="restart"),),))
+CANCEL_MENU = InlineKeyboardMarkup(((InlineKeyboardButton("🔄 Отмена", callback_data="restart"),),))
+
+# Кнопки, которые добавляются к спискам локаций
+BACK_TO_MENU_ROW = BACK_TO_MENU.inline_keyboard[0]
+DELETE_LOCATION_ROW = (InlineKeyboardButton("❌ Удалить локацию", callback_data="delete_location"),)
+DIGEST_ON_ROW = (InlineKeyboardButton("🔔 Подписаться на утренний прогноз", callback_data="toggle_digest"),)
+DIGEST_OFF_ROW = (InlineKeyboardButton("🔕 Отписаться от утреннего прогноза", callback_data="toggle_digest"),)
+CANCEL_DELETE_ROW = (InlineKeyboardButton("Отмена", callback_data="cancel_delete"),)
+
+MENU_PROMPT = "Выберите действие из меню ниже:"
+
+
+# Кнопки под результатом inline-поиска: прогноз прямо в сообщении и добавление в мои локации
+def city_keyboard(city_id):
+    return InlineKeyboardMarkup((
+        (
+            InlineKeyboardButton("🎣 Прогноз клёва", callback_data=f"city_forecast_{city_id}"),
+            InlineKeyboardButton("➕ В мои локации", callback_data=f"city_add_{city_id}")
+        ),
+    ))
+
+# Приветствие: подставляется имя пользователя
+GREETING_TEXT = (
+    "Привет, {}! 👋\n\n"
+    "Я бот-предсказатель клёва рыбы. Я анализирую погодные условия и подскажу, когда лучше всего отправиться на рыбалку.\n\n"
+    + MENU_PROMPT
+)
+
+ADD_LOCATION_TEXT = (
+    "📍 Пожалуйста, отправь название города или населенного пункта, рядом с которым ты рыбачишь.\n\n"
+    "Например: Москва, Санкт-Петербург, Сочи"
+)
+
+NO_LOCATIONS_TEXT = "У тебя пока нет добавленных локаций. Нажми на '➕ Добавить локацию', чтобы добавить места для рыбалки."
+
+_HELP_FOOTER = (
+    "*Как это работает?*\n"
+    "1. Добавь свои любимые места для рыбалки\n"
+    "2. Запроси прогноз клёва\n"
+    "3. Бот проанализирует погодные условия и оценит вероятность хорошего клёва\n\n"
+    "*Факторы, влияющие на клёв:*\n"
+    "• Атмосферное давление и его изменения\n"
+    "• Температура воздуха и воды\n"
+    "• Ветер (направление и сила)\n"
+    "• Облачность\n"
+    "• Осадки\n"
+    "• Фазы луны"
+)
+
+# Справка по команде /help
+HELP_TEXT = (
+    "🤖 *Команды бота:*\n\n"
+    "🎣 */forecast* - получить прогноз клёва\n"
+    "📍 */locations* - список моих локаций\n"
+    "📊 */compare* - сравнить клёв во всех моих локациях\n"
+    "➕ */add_location* - добавить новую локацию\n"
+    "🔔 */digest* - подписаться на утренний прогноз или отписаться\n"
+    "❓ */help* - получить помощь\n"
+    "🔄 Перезапуск - перезапустить бота\n\n"
+    + _HELP_FOOTER
+)
+
+# Справка по кнопке «Помощь»
+HELP_MENU_TEXT = (
+    "🤖 *Команды бота:*\n\n"
+    "🎣 Прогноз клёва - получить прогноз клёва\n"
+    "📍 Мои локации - список моих локаций\n"
+    "📊 Сравнить локации - где клёв лучше в каждый из дней\n"
+    "➕ Добавить локацию - добавить новую локацию\n"
+    "❓ Помощь - получить помощь\n"
+    "🔄 Перезапуск - перезапустить бота\n\n"
+    + _HELP_FOOTER
+)
+
+WIND_DIRECTIONS = ("С", "СВ", "В", "ЮВ", "Ю", "ЮЗ", "З", "СЗ")
+
+# Рекомендации по рыбалке: (нижняя граница вероятности, строки)
+RECOMMENDATIONS = (
+    (75, "• Отличное время для рыбалки! Не упустите возможность.\n"
+         "• Хищная рыба будет активна, стоит использовать активные приманки.\n"),
+    (50, "• Хороший день для рыбалки, особенно в утренние и вечерние часы.\n"
+         "• Стоит комбинировать разные техники ловли.\n"),
+    (25, "• Умеренный клёв, лучше рыбачить в самое тихое время дня.\n"
+         "• Рекомендуется использовать пассивные приманки и насадки.\n"),
+    (None, "• Неблагоприятные условия для клёва, рыба малоактивна.\n"
+           "• Если всё же решите рыбачить, стоит сосредоточиться на глубоких местах.\n"),
+)
+
+
+# Получение направления ветра
+def get_wind_direction(degrees):
+    return WIND_DIRECTIONS[round(degrees / 45) % 8]
+
+
+# Предупреждение о том, что показаны сохраненные данные (age — их возраст в секундах или None)
+def stale_notice(age):
+    if age is None:
+        return ""
+    minutes = int(age // 60)
+    age_text = f"{minutes // 60} ч {minutes % 60} мин" if minutes >= 60 else f"{minutes} мин"
+    return f"⚠️ Сервис погоды временно недоступен, данные получены {age_text} назад\n\n"
+
+
+# Подпись окна для рыбалки, например «завтра 05:00–08:00»
+def format_window(window, today):
+    start = window['start']
+    days = (start.date() - today).days
+    if days == 0:
+        day = "сегодня"
+    elif days == 1:
+        day = "завтра"
+    else:
+        day = start.strftime("%d.%m")
+    return f"{day} {start.strftime('%H:%M')}–{window['end'].strftime('%H:%M')}"
+
+
+def _recommendation(probability):
+    for threshold, text in RECOMMENDATIONS:
+        if threshold is None or probability > threshold:
+            return text
+
+
+# Текст прогноза клёва на 3 дня. Одна и та же версия прогноза (fetched_at) в течение одного
+# часа дает один и тот же текст для всех, кто смотрит эту локацию, поэтому готовый текст
+# кэшируется по (координаты, название, версия прогноза, час). Предупреждение об устаревших
+# данных зависит от момента запроса и в кэш не попадает.
+class ForecastRenderer:
+    def __init__(self, moon_phase_at, max_entries=RENDER_CACHE_SIZE):
+        self.moon_phase_at = moon_phase_at
+        self.max_entries = max_entries
+        self._texts = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, location, weather_forecast, now=None):
+        with span("render"):
+            return self._render(location, weather_forecast, now)
+
+    def _render(self, location, weather_forecast, now=None):
+        now = now or datetime.now()
+        header = f"🎣 *Прогноз клёва для {location.name}*\n\n"
+        version = weather_forecast.fetched_at
+        if version is None:
+            return header + stale_notice(weather_forecast.stale_age) + self._render_body(weather_forecast, now)
+
+        key = normalize_coords(location.lat, location.lon) + (
+            location.name, version, now.strftime("%Y%m%d%H")
+        )
+        body = self._texts.get(key)
+        if body is None:
+            self.misses += 1
+            body = self._render_body(weather_forecast, now)
+            self._texts[key] = body
+            if len(self._texts) > self.max_entries:
+                self._texts.popitem(last=False)
+        else:
+            self.hits += 1
+            self._texts.move_to_end(key)
+        return header + stale_notice(weather_forecast.stale_age) + body
+
+    def _render_body(self, weather_forecast, now):
+        parts = []
+        moon_phase = self.moon_phase_at(now.timestamp())
+        parts.append(f"🌙 Фаза луны: {moon_phase['name']}\n\n")
+
+        # Вероятность клёва сразу для всех трех дней на один момент времени,
+        # фаза луны у каждого дня своя
+        rows = ScoreRows()
+        day_moon_phases = []
+        for i, daily_forecast in enumerate(weather_forecast.daily[:3]):
+            day_moon_phases.append(self.moon_phase_at((now + timedelta(days=i)).timestamp()))
+            rows.append(daily_forecast, day_moon_phases[i])
+        probabilities, day_factors = score_batch(rows, now)
+
+        for i in range(3):
+            daily_forecast = weather_forecast.daily[i]
+            positive, negative = day_factors[i]
+            day_temp = daily_forecast.temp_day
+            parts.append(
+                f"📅 *{(now + timedelta(days=i)).strftime('%d.%m.%Y')}*\n"
+                f"🌡 Температура: {day_temp}°C\n"
+                f"💨 Ветер: {daily_forecast.wind_speed} м/с, {get_wind_direction(daily_forecast.wind_deg)}\n"
+                f"☁️ Облачность: {daily_forecast.clouds}%\n"
+                f"💧 Влажность: {daily_forecast.humidity}%\n"
+                f"📊 Давление: {daily_forecast.pressure} гПа\n"
+                f"🌧 Осадки: {daily_forecast.rain} мм\n"
+                f"🌙 Луна: {day_moon_phases[i]['name']}\n"
+                f"🎣 Клёв: {get_bite_rating(probabilities[i])}\n"
+                "👍 Благоприятные факторы:\n"
+            )
+            parts.extend(f"  • {factor}\n" for factor in factor_texts(positive, day_temp))
+            parts.append("👎 Неблагоприятные факторы:\n")
+            parts.extend(f"  • {factor}\n" for factor in factor_texts(negative, day_temp))
+            parts.append("\n")
+
+        # Лучшие 3-часовые окна по местному времени локации
+        windows = best_windows(
+            weather_forecast.hourly, self.moon_phase_at,
+            weather_forecast.timezone, now.timestamp()
+        )
+        if windows:
+            local_today = datetime.fromtimestamp(
+                now.timestamp() + weather_forecast.timezone, tz=timezone.utc
+            ).date()
+            parts.append("⏰ *Лучшее время для рыбалки:*\n")
+            parts.extend(
+                f"• {format_window(window, local_today)} — {get_bite_rating(window['probability'])}\n"
+                for window in windows
+            )
+            parts.append("\n")
+
+        # Рекомендации по рыбалке
+        parts.append("*Рекомендации по рыбалке:*\n")
+        parts.append(_recommendation(probabilities[2]))
+        parts.append("\n\n" + MENU_PROMPT)
+        return "".join(parts)
+
+    def stats(self):
+        return {"entries": len(self._texts), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,262 @@
+import math
+import time
+import heapq
+import functools
+from array import array
+from datetime import datetime, timedelta, timezone
+
+from records import DailyForecast
+
+# Длительность одного интервала прогноза /forecast
+SLOT_SECONDS = 3 * 60 * 60
+
+# Коды факторов клёва и их описания для пользователя
+MORNING_DAWN = "morning_dawn"
+EVENING_DAWN = "evening_dawn"
+NIGHT = "night"
+PRESSURE_STABLE = "pressure_stable"
+PRESSURE_RISE = "pressure_rise"
+PRESSURE_DROP = "pressure_drop"
+TEMP_SUMMER = "temp_summer"
+TEMP_WINTER = "temp_winter"
+TEMP_SPRING_AUTUMN = "temp_spring_autumn"
+WIND_SHIFT = "wind_shift"
+RAIN_WIND = "rain_wind"
+MUGGY = "muggy"
+MOON_NIGHT = "moon_night"
+STORM = "storm"
+
+FACTOR_TEXTS = {
+    MORNING_DAWN: "Утренняя зорька - лучшее время для клёва",
+    EVENING_DAWN: "Вечерняя зорька - хорошее время для клёва",
+    NIGHT: "Ночное время - пониженная активность рыбы",
+    PRESSURE_STABLE: "Стабильное атмосферное давление",
+    PRESSURE_RISE: "Резкий рост атмосферного давления",
+    PRESSURE_DROP: "Резкое падение атмосферного давления",
+    TEMP_SUMMER: "Оптимальная летняя температура ({temp}°C)",
+    TEMP_WINTER: "Оптимальная зимняя температура ({temp}°C)",
+    TEMP_SPRING_AUTUMN: "Оптимальная весенне-осенняя температура ({temp}°C)",
+    WIND_SHIFT: "Резкая смена направления ветра",
+    RAIN_WIND: "Дождь с сильным ветром",
+    MUGGY: "Душная погода способствует клёву",
+    MOON_NIGHT: "Благоприятное время для ночной рыбалки",
+    STORM: "⚠️ Штормовое предупреждение - рыбалка не рекомендуется"
+}
+
+# Колонки, из которых состоит пакет для оценки
+ROW_COLUMNS = ("temp", "humidity", "wind_speed", "wind_deg", "rain",
+               "pressure_trend", "prev_wind_dir", "moon_phase", "moon_factor")
+
+
+# Определение сезона по месяцу
+def get_season(month):
+    if month in [12, 1, 2]:
+        return "winter"
+    elif month in [3, 4, 5]:
+        return "spring"
+    elif month in [6, 7, 8]:
+        return "summer"
+    else:
+        return "autumn"
+
+
+# Пакет строк (локация, день) для оценки в колоночном виде.
+# Отсутствующие тренд давления и прежнее направление ветра хранятся как NaN.
+class ScoreRows:
+    __slots__ = ROW_COLUMNS
+
+    def __init__(self):
+        for name in ROW_COLUMNS:
+            setattr(self, name, array('d'))
+
+    def __len__(self):
+        return len(self.temp)
+
+    # Добавление дневного прогноза (DailyForecast)
+    def append(self, daily, moon_phase):
+        self.temp.append(daily.temp_day)
+        self.humidity.append(daily.humidity)
+        self.wind_speed.append(daily.wind_speed)
+        self.wind_deg.append(daily.wind_deg)
+        self.rain.append(daily.rain)
+        self.pressure_trend.append(daily.pressure_trend)
+        self.prev_wind_dir.append(daily.prev_wind_dir)
+        self.moon_phase.append(moon_phase['phase'])
+        self.moon_factor.append(moon_phase['fishing_factor'])
+        return self
+
+
+# Факторы, зависящие только от местного часа и месяца.
+# Вариантов всего 24 * 12, поэтому они вычисляются один раз и кэшируются.
+@functools.lru_cache(maxsize=None)
+def time_context(hour, month):
+    season = get_season(month)
+
+    hour_bonus = 0
+    hour_positive = ()
+    hour_negative = ()
+    if 4 <= hour <= 8:  # Утренняя зорька
+        hour_bonus = 15
+        hour_positive = (MORNING_DAWN,)
+    elif 17 <= hour <= 21:  # Вечерняя зорька
+        hour_bonus = 10
+        hour_positive = (EVENING_DAWN,)
+    elif 23 <= hour or hour <= 3:  # Ночь
+        hour_bonus = -10
+        hour_negative = (NIGHT,)
+    evening = 19 <= hour <= 23
+
+    if season == "summer":
+        temp_low, temp_high, temp_code = 20, 25, TEMP_SUMMER
+    elif season == "winter":
+        temp_low, temp_high, temp_code = 0, 5, TEMP_WINTER
+    else:
+        temp_low, temp_high, temp_code = 10, 20, TEMP_SPRING_AUTUMN
+
+    return hour_bonus, hour_positive, hour_negative, evening, temp_low, temp_high, temp_code
+
+
+# Оценка одной строки. Отсутствующие тренд давления и прежнее направление ветра передаются как NaN.
+def score_values(context, temp, humidity, wind_speed, wind_deg, rain,
+                 pressure_trend, prev_wind_dir, moon_phase, moon_factor):
+    hour_bonus, hour_positive, hour_negative, evening, temp_low, temp_high, temp_code = context
+    probability = 50 + hour_bonus
+    positive = list(hour_positive)
+    negative = list(hour_negative)
+
+    if not math.isnan(pressure_trend):
+        if abs(pressure_trend) < 2:  # Стабильное
+            probability += 10
+            positive.append(PRESSURE_STABLE)
+        elif pressure_trend > 5:  # Резкий рост
+            probability -= 15
+            negative.append(PRESSURE_RISE)
+        elif pressure_trend < -5:  # Резкое падение
+            probability -= 15
+            negative.append(PRESSURE_DROP)
+
+    if temp_low <= temp <= temp_high:
+        probability += 15
+        positive.append(temp_code)
+
+    # Угол между направлениями ветра с учетом перехода через север (350° и 10° — 20°)
+    wind_shift = abs(wind_deg - prev_wind_dir) % 360
+    if not math.isnan(prev_wind_dir) and min(wind_shift, 360 - wind_shift) > 90:
+        probability -= 10
+        negative.append(WIND_SHIFT)
+
+    if rain > 0 and wind_speed > 5:
+        probability -= 20  # Дополнительный штраф за дождь с сильным ветром
+        negative.append(RAIN_WIND)
+
+    if humidity > 80 and temp > 20:
+        probability += 5  # Бонус за душную погоду
+        positive.append(MUGGY)
+
+    if moon_phase in (0, 4) and evening:  # Новолуние или полнолуние вечером
+        probability *= 1.2
+        positive.append(MOON_NIGHT)
+
+    probability *= moon_factor
+
+    if wind_speed > 10 or rain > 10:
+        probability = min(probability, 30)  # Ограничение максимальной вероятности
+        negative.append(STORM)
+
+    return max(0, min(100, probability)), positive, negative
+
+
+# Оценка вероятности клёва для пакета строк за один вызов.
+# Час и сезон берутся из общей отметки времени now (по умолчанию — текущее время),
+# возвращаются массив вероятностей и списки кодов факторов (положительные, отрицательные).
+def score_batch(rows, now=None):
+    now = now or datetime.now()
+    context = time_context(now.hour, now.month)
+
+    probabilities = array('d')
+    factors = []
+    for i in range(len(rows)):
+        probability, positive, negative = score_values(
+            context, rows.temp[i], rows.humidity[i], rows.wind_speed[i], rows.wind_deg[i],
+            rows.rain[i], rows.pressure_trend[i], rows.prev_wind_dir[i],
+            rows.moon_phase[i], rows.moon_factor[i]
+        )
+        probabilities.append(probability)
+        factors.append((positive, negative))
+
+    return probabilities, factors
+
+
+# Лучшие окна для рыбалки среди 3-часовых интервалов прогноза (HourlySeries).
+# Каждый интервал оценивается по своему местному времени (tz_offset — смещение от UTC в секундах),
+# тренд давления и смена ветра считаются относительно предыдущего интервала.
+# Один проход по интервалам, в памяти держится только top_n лучших. Прошедшие интервалы
+# (раньше now_ts) пропускаются. moon_phase_at(timestamp) возвращает фазу луны для интервала.
+def best_windows(series, moon_phase_at, tz_offset=0, now_ts=None, top_n=3):
+    now_ts = time.time() if now_ts is None else now_ts
+    dts, pressures, wind_degs = series.dt, series.pressure, series.wind_deg
+    heap = []
+    for index in range(len(series)):
+        dt = dts[index]
+        if dt + SLOT_SECONDS <= now_ts:
+            continue
+        local = datetime.fromtimestamp(dt + tz_offset, tz=timezone.utc).replace(tzinfo=None)
+        moon_phase = moon_phase_at(dt)
+        probability, positive, negative = score_values(
+            time_context(local.hour, local.month),
+            series.temp[index], series.humidity[index], series.wind_speed[index], wind_degs[index],
+            series.rain[index],
+            pressures[index] - pressures[index - 1] if index else math.nan,
+            wind_degs[index - 1] if index else math.nan,
+            moon_phase["phase"], moon_phase["fishing_factor"]
+        )
+        # При равной вероятности предпочитаем более раннее окно
+        item = (probability, -dt, index, local, positive, negative)
+        if len(heap) < top_n:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+
+    return [
+        {
+            "start": local,
+            "end": local + timedelta(seconds=SLOT_SECONDS),
+            "probability": probability,
+            "positive": positive,
+            "negative": negative
+        }
+        for probability, _, _, local, positive, negative in sorted(heap, reverse=True)
+    ]
+
+
+# Получение текстового рейтинга клёва на основе вероятности
+def get_bite_rating(probability):
+    if probability >= 80:
+        return "🔥🔥🔥🔥🔥 Отличный клёв"
+    elif probability >= 60:
+        return "🔥🔥🔥🔥 Хороший клёв"
+    elif probability >= 40:
+        return "🔥🔥🔥 Средний клёв"
+    elif probability >= 20:
+        return "🔥🔥 Слабый клёв"
+    else:
+        return "🔥 Очень слабый клёв"
+
+
+# Тексты факторов по их кодам
+def factor_texts(codes, temp):
+    return [FACTOR_TEXTS[code].format(temp=temp) for code in codes]
+
+
+# Расчет вероятности клёва для одного дня (обертка над пакетной оценкой).
+# weather_data — DailyForecast или дневной прогноз в формате JSON.
+def calculate_bite_probability(weather_data, moon_phase, now=None):
+    if isinstance(weather_data, dict):
+        weather_data = DailyForecast.from_json(weather_data)
+    probabilities, factors = score_batch(ScoreRows().append(weather_data, moon_phase), now)
+    positive, negative = factors[0]
+    temp = weather_data.temp_day
+    return probabilities[0], {
+        "positive": factor_texts(positive, temp),
+        "negative": factor_texts(negative, temp)
+    }
@@ -0,0 +1,254 @@
+import os
+import glob
+import atexit
+import bisect
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+
+from webhook import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, register_webhook, check_secret, require_secret,
+    shutdown_application
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько процессов-обработчиков запускает веб-процесс в режиме webhook (1 — без шардирования)
+BOT_WORKERS = int(os.environ.get("BOT_WORKERS", "1"))
+
+# Сколько точек на кольце у каждого обработчика: чем больше, тем ровнее распределение
+SHARD_RING_REPLICAS = int(os.environ.get("SHARD_RING_REPLICAS", "64"))
+
+# Лимиты, которые делятся между обработчиками поровну: общий ключ OpenWeatherMap
+# не должен получить больше запросов, а рассылка — больше сообщений в секунду
+# (лимит Telegram общий для бота), чем в однопроцессном режиме
+SPLIT_SETTINGS = {
+    "OWM_CALLS_PER_MINUTE": "60",
+    "OWM_CALLS_PER_DAY": "30000",
+    "PREFETCH_BUDGET": "60",
+    "FANOUT_RATE": "25",
+}
+
+# Поля обновления, из которых берется пользователь
+UPDATE_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+    "shipping_query", "pre_checkout_query", "poll_answer", "my_chat_member", "chat_member",
+    "chat_join_request", "channel_post", "edited_channel_post",
+)
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+
+
+# Консистентное хеширование: каждый обработчик занимает replicas точек на кольце,
+# ключ принадлежит первой точке по часовой стрелке. При добавлении обработчика
+# к нему переходит только около 1/N ключей, остальные пользователи остаются на месте.
+class HashRing:
+    def __init__(self, nodes=(), replicas=SHARD_RING_REPLICAS):
+        self.replicas = replicas
+        self._points = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        for replica in range(self.replicas):
+            point = _hash(f"{node}:{replica}")
+            position = bisect.bisect(self._points, point)
+            self._points.insert(position, point)
+            self._owners.insert(position, node)
+
+    def remove(self, node):
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def node_for(self, key):
+        position = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[position]
+
+
+# Ключ маршрутизации обновления: пользователь, а если его нет — чат
+def shard_key(data):
+    for field in UPDATE_FIELDS:
+        item = data.get(field)
+        if not item:
+            continue
+        user = item.get("from") or item.get("user") or {}
+        chat = item.get("chat") or (item.get("message") or {}).get("chat") or {}
+        return user.get("id") or chat.get("id") or 0
+    return 0
+
+
+# Номер текущего обработчика или None вне многопроцессного режима (задается в run_worker)
+def current_shard():
+    index = os.environ.get("SHARD_INDEX")
+    return None if index is None else int(index)
+
+
+# Хранилище обработчика: фоновые задачи (обновление прогнозов, рассылка) видят
+# только пользователей, которые направляются в этот процесс
+class ShardUserStore:
+    def __init__(self, store, index, workers=BOT_WORKERS):
+        self.store = store
+        self.index = index
+        self.ring = HashRing(range(workers))
+
+    def owns(self, user_id):
+        return self.ring.node_for(int(user_id)) == self.index
+
+    def all_users(self):
+        return [(user_id, user) for user_id, user in self.store.all_users() if self.owns(user_id)]
+
+    # Остальные операции выполняет исходное хранилище
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+
+# Хранилище пользователей с учетом шардирования
+def shard_user_store(store):
+    index = current_shard()
+    if index is None:
+        return store
+    return ShardUserStore(store, index)
+
+
+# Обработка обновлений параллельно для разных пользователей и строго по очереди
+# для одного пользователя: каждое обновление ждет завершения предыдущего с тем же ключом
+class KeyedLanes:
+    def __init__(self, concurrency):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tails = {}
+        self._tasks = set()
+
+    def submit(self, key, coroutine):
+        task = asyncio.create_task(self._run(key, self._tails.get(key), coroutine))
+        self._tails[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key, previous, coroutine):
+        if previous is not None:
+            await asyncio.wait((previous,))
+        try:
+            async with self._semaphore:
+                await coroutine
+        except Exception:
+            logger.exception(f"Update for {key} failed")
+        finally:
+            if self._tails.get(key) is asyncio.current_task():
+                del self._tails[key]
+
+    # Ожидание всех начатых обработок
+    async def drain(self):
+        if self._tasks:
+            await asyncio.wait(set(self._tasks))
+
+
+async def _serve(token, index, queues):
+    # Модули бота импортируются после настройки окружения обработчика
+    import bot
+    from telegram import Update
+    from metrics import start_metrics_server, METRICS_PORT
+
+    application = bot.build_application(token)
+    inbox = queues[index]
+    peers = [queue for position, queue in enumerate(queues) if position != index]
+
+    # Свежие прогнозы рассылаются остальным обработчикам, чтобы кэш был общим
+    def replicate(lat, lon, kind, value, stored_at):
+        for queue in peers:
+            queue.put(("cache", lat, lon, kind, value, stored_at))
+
+    bot.forecast_cache.listeners.append(replicate)
+
+    # Каждый обработчик отдает свои метрики на METRICS_PORT + номер
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT + index)
+
+    await application.initialize()
+    await application.start()
+    if index == 0:
+        await register_webhook(application.bot, WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH)
+
+    lanes = KeyedLanes(bot.BOT_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await loop.run_in_executor(None, inbox.get)
+        if message is None:
+            break
+        if message[0] == "cache":
+            _, lat, lon, kind, value, stored_at = message
+            bot.forecast_cache.set(lat, lon, kind, value, stored_at=stored_at, notify=False)
+        else:
+            _, key, data = message
+            lanes.submit(key, application.process_update(Update.de_json(data, application.bot)))
+
+    await lanes.drain()
+    await shutdown_application(application)
+
+
+# Точка входа процесса-обработчика: свой журнал пользователей и своя доля лимитов
+def run_worker(token, index, workers, queues):
+    os.environ["SHARD_INDEX"] = str(index)
+    os.environ["USER_JOURNAL_FILE"] = f"{os.environ.get('USER_JOURNAL_FILE', 'user_data.journal')}.{index}"
+    for name, default in SPLIT_SETTINGS.items():
+        os.environ[name] = str(max(1, int(float(os.environ.get(name, default))) // workers))
+    asyncio.run(_serve(token, index, queues))
+
+
+# Применение журналов обработчиков прошлого запуска (их число могло измениться),
+# чтобы пользователи, перешедшие к другому обработчику, не потеряли изменения
+def recover_shard_journals():
+    from storage import SqliteUserStore, recover_journal, USER_JOURNAL_FILE
+
+    base = SqliteUserStore()
+    try:
+        for path in [USER_JOURNAL_FILE] + sorted(glob.glob(glob.escape(USER_JOURNAL_FILE) + ".*")):
+            recover_journal(base, path)
+    finally:
+        base.close()
+
+
+# Маршрутизатор веб-процесса: запускает workers процессов-обработчиков и направляет
+# каждое обновление обработчику пользователя по консистентному хешу. Интерфейс тот же,
+# что у WebhookBot (start, stop, verify, submit).
+class ShardedBot:
+    def __init__(self, token, workers=BOT_WORKERS, secret=WEBHOOK_SECRET):
+        require_secret(secret)
+        self.token = token
+        self.workers = workers
+        self.secret = secret
+        self.ring = HashRing(range(workers))
+        # spawn: обработчики не наследуют потоки и открытые файлы веб-процесса
+        self._context = multiprocessing.get_context("spawn")
+        self.queues = [self._context.Queue() for _ in range(workers)]
+        self.processes = []
+
+    def start(self):
+        recover_shard_journals()
+        for index in range(self.workers):
+            process = self._context.Process(
+                target=run_worker, args=(self.token, index, self.workers, self.queues),
+                name=f"bot-shard-{index}", daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+        logger.info(f"Started {self.workers} bot workers")
+        atexit.register(self.stop)
+
+    def stop(self):
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            process.join(timeout=30)
+
+    def verify(self, token):
+        return check_secret(token, self.secret)
+
+    # Передача обновления обработчику его пользователя без ожидания обработки
+    def submit(self, data):
+        key = shard_key(data)
+        self.queues[self.ring.node_for(key)].put(("update", key, data))
@@ -0,0 +1,46 @@
+import asyncio
+import contextvars
+
+from quota import SharedPriority, shared_priority, current_priority
+
+
+# Объединение одновременных одинаковых запросов в один вызов.
+# Все ожидающие получают один и тот же результат или одну и ту же ошибку,
+# а после завершения ключ освобождается — ошибки не кэшируются.
+# Квоту общий вызов получает с наивысшим приоритетом среди ожидающих, а не с приоритетом
+# того, кто его начал: пользователь не ждет вместе с фоновым обновлением.
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, func, *args):
+        priority = current_priority()
+        call = self._calls.get(key)
+        if call is None:
+            self.calls += 1
+            shared = SharedPriority(priority)
+            context = contextvars.copy_context()
+            context.run(shared_priority.set, shared)
+            task = asyncio.get_running_loop().create_task(func(*args), context=context)
+            self._calls[key] = (task, shared)
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            task, shared = call
+            shared.raise_to(priority)
+            self.shared += 1
+        # shield: отмена одного ожидающего не должна отменять запрос для остальных
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        call = self._calls.get(key)
+        if call is not None and call[0] is task:
+            del self._calls[key]
+        # Помечаем исключение как полученное, даже если все ожидающие были отменены
+        if not task.cancelled():
+            task.exception()
+
+    # Количество запросов, выполняющихся прямо сейчас
+    def in_flight(self):
+        return len(self._calls)
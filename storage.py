@@ -0,0 +1,296 @@
+import os
+import copy
+import json
+import sqlite3
+import logging
+import threading
+
+from records import to_json, user_from_json
+
+logger = logging.getLogger(__name__)
+
+# Файлы для хранения данных пользователей
+USER_DATA_FILE = "user_data.json"
+USER_DB_FILE = os.environ.get("USER_DB_FILE", "user_data.db")
+USER_JOURNAL_FILE = os.environ.get("USER_JOURNAL_FILE", "user_data.journal")
+
+# Тип хранилища: journal (по умолчанию, кэш в памяти поверх SQLite), sqlite
+# или json (старый формат, весь файл целиком)
+USER_STORE = os.environ.get("USER_STORE", "journal")
+
+# Изменения копятся до JOURNAL_FLUSH_INTERVAL секунд и сбрасываются на диск одним fsync
+JOURNAL_FLUSH_INTERVAL = float(os.environ.get("USER_JOURNAL_FLUSH_INTERVAL", "0.05"))
+
+# После стольких записей журнал переносится в SQLite и очищается,
+# это же число ограничивает объем восстановления при перезапуске
+JOURNAL_COMPACT_RECORDS = int(os.environ.get("USER_JOURNAL_COMPACT_RECORDS", "10000"))
+
+
+# Данные нового пользователя. Локации хранятся записями records.Location,
+# в JSON они превращаются через records.to_json и records.user_from_json.
+def new_user():
+    return {"locations": []}
+
+
+# Хранилище в одном JSON-файле: каждое обращение читает и переписывает весь файл
+class JsonUserStore:
+    def __init__(self, path=USER_DATA_FILE):
+        self.path = path
+
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        return {}
+
+    def get_user(self, user_id):
+        user = self._load().get(str(user_id))
+        return user_from_json(user) if user else new_user()
+
+    def save_user(self, user_id, user):
+        data = self._load()
+        data[str(user_id)] = user
+        with open(self.path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False, indent=4, default=to_json)
+
+    def all_users(self):
+        return [(user_id, user_from_json(user)) for user_id, user in self._load().items()]
+
+    def close(self):
+        pass
+
+
+# Хранилище в SQLite (режим WAL): чтение и запись одного пользователя по первичному ключу
+class SqliteUserStore:
+    def __init__(self, path=USER_DB_FILE, json_path=USER_DATA_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Базу могут одновременно использовать несколько процессов-обработчиков (см. sharding.py)
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, data TEXT NOT NULL)"
+        )
+        if json_path and os.path.exists(json_path) and self.count() == 0:
+            self.migrate_from_json(json_path)
+
+    # Однократный перенос данных из старого user_data.json
+    def migrate_from_json(self, json_path):
+        with open(json_path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        rows = [(user_id, json.dumps(user, ensure_ascii=False)) for user_id, user in data.items()]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO users (user_id, data) VALUES (?, ?)", rows
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        logger.info(f"Migrated {len(rows)} users from {json_path} to {self.path}")
+        return len(rows)
+
+    def get_user(self, user_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM users WHERE user_id = ?", (str(user_id),)
+            ).fetchone()
+        return user_from_json(json.loads(row[0])) if row else new_user()
+
+    def save_user(self, user_id, user):
+        data = json.dumps(user, ensure_ascii=False, default=to_json)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO users (user_id, data) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data",
+                (str(user_id), data)
+            )
+
+    # Сохранение нескольких пользователей одной транзакцией.
+    # durable=True — коммит с fsync (synchronous=FULL): при synchronous=NORMAL последний коммит
+    # в режиме WAL может пропасть при отключении питания, а после durable-коммита можно
+    # удалять другую копию изменений (журнал JournaledUserStore).
+    def save_users(self, items, durable=False):
+        rows = [(str(user_id), json.dumps(user, ensure_ascii=False, default=to_json)) for user_id, user in items]
+        with self._lock:
+            if durable:
+                self._conn.execute("PRAGMA synchronous=FULL")
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._conn.executemany(
+                        "INSERT INTO users (user_id, data) VALUES (?, ?) "
+                        "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data",
+                        rows
+                    )
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            finally:
+                if durable:
+                    self._conn.execute("PRAGMA synchronous=NORMAL")
+
+    def all_users(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT user_id, data FROM users").fetchall()
+        return [(user_id, user_from_json(json.loads(data))) for user_id, data in rows]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Перенос изменений из журнала в базу и очистка журнала; возвращает число пользователей
+def recover_journal(base, journal_path):
+    if not os.path.exists(journal_path):
+        return 0
+    latest = {}
+    with open(journal_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Недописанная последняя строка после аварийной остановки
+                logger.warning(f"Skipping damaged record in {journal_path}")
+                continue
+            latest[record["id"]] = record["user"]
+    if latest:
+        # Журнал очищается только после коммита, записанного на диск
+        base.save_users(latest.items(), durable=True)
+        logger.info(f"Recovered {len(latest)} users from {journal_path}")
+    open(journal_path, 'w').close()
+    return len(latest)
+
+
+# Кэш пользователей в памяти с отложенной записью.
+# Чтение идет из памяти, каждое изменение дописывается в журнал, который фоновый поток
+# сбрасывает на диск пачками с fsync. Когда журнал разрастается, изменения одной транзакцией
+# переносятся в SQLite (снимок), а журнал очищается. При запуске оставшийся журнал
+# применяется к SQLite, поэтому восстановление ограничено JOURNAL_COMPACT_RECORDS записями.
+class JournaledUserStore:
+    def __init__(self, base, journal_path=USER_JOURNAL_FILE,
+                 flush_interval=JOURNAL_FLUSH_INTERVAL, compact_records=JOURNAL_COMPACT_RECORDS):
+        self.base = base
+        self.journal_path = journal_path
+        self.flush_interval = flush_interval
+        self.compact_records = compact_records
+        self._users = {}
+        self._dirty = set()
+        self._pending = []
+        self._queued = 0
+        self._written = 0
+        self._journal_records = 0
+        self._condition = threading.Condition()
+        self._flush_requested = False
+        self._closed = False
+
+        self.recover()
+        self._journal = open(journal_path, 'a', encoding='utf-8')
+        self._writer = threading.Thread(target=self._write_loop, name="user-journal", daemon=True)
+        self._writer.start()
+
+    # Применение журнала, оставшегося после прошлого запуска
+    def recover(self):
+        return recover_journal(self.base, self.journal_path)
+
+    def get_user(self, user_id):
+        user_id = str(user_id)
+        user = self._users.get(user_id)
+        if user is None:
+            user = self.base.get_user(user_id)
+            self._users[user_id] = user
+        return copy.deepcopy(user)
+
+    def save_user(self, user_id, user):
+        user_id = str(user_id)
+        user = copy.deepcopy(user)
+        record = json.dumps({"id": user_id, "user": user}, ensure_ascii=False, default=to_json)
+        with self._condition:
+            self._users[user_id] = user
+            self._dirty.add(user_id)
+            self._pending.append(record)
+            self._queued += 1
+            if len(self._pending) == 1:
+                self._condition.notify_all()
+
+    def all_users(self):
+        with self._condition:
+            users = dict(self.base.all_users())
+            users.update(self._users)
+        return list(users.items())
+
+    # Ожидание, пока все накопленные изменения будут записаны на диск
+    def flush(self):
+        with self._condition:
+            target = self._queued
+            self._flush_requested = True
+            self._condition.notify_all()
+            while self._written < target:
+                self._condition.wait()
+
+    # Фоновый поток: пачками пишет журнал, делает fsync и при необходимости снимок
+    def _write_loop(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                # Копим изменения в течение flush_interval, чтобы сделать один fsync на пачку
+                if not self._closed and not self._flush_requested:
+                    self._condition.wait(self.flush_interval)
+                batch = self._pending
+                self._pending = []
+                written = self._queued
+                closed = self._closed
+                self._flush_requested = False
+            if batch:
+                self._journal.write("\n".join(batch) + "\n")
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._journal_records += len(batch)
+            if self._journal_records >= self.compact_records:
+                self._compact()
+            with self._condition:
+                self._written = written
+                self._condition.notify_all()
+            if closed:
+                return
+
+    # Перенос изменений в SQLite и очистка журнала
+    def _compact(self):
+        with self._condition:
+            items = [(user_id, self._users[user_id]) for user_id in self._dirty]
+            self._dirty = set()
+        # Журнал очищается только после коммита, записанного на диск
+        self.base.save_users(items, durable=True)
+        self._journal.truncate(0)
+        self._journal.seek(0)
+        self._journal_records = 0
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._writer.join()
+        self._compact()
+        self._journal.close()
+        self.base.close()
+
+
+# Создание хранилища, выбранного в настройках
+def open_user_store(kind=USER_STORE):
+    if kind == "json":
+        return JsonUserStore()
+    if kind == "sqlite":
+        return SqliteUserStore()
+    if kind == "journal":
+        return JournaledUserStore(SqliteUserStore())
+    raise ValueError(f"Unknown user store: {kind}")
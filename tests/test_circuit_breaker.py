@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError, HALF_OPEN, OPEN
+from quota import QuotaExceeded
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def half_open_breaker():
+    clock = FakeClock()
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30, clock=clock)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    clock.now += 30
+    return breaker
+
+
+def test_only_one_trial_in_half_open():
+    breaker = half_open_breaker()
+    assert breaker.before_call() is True
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_released_trial_allows_next_trial():
+    breaker = half_open_breaker()
+    assert breaker.before_call() is True
+    breaker.release_trial()
+    assert breaker.before_call() is True
+
+
+def test_release_after_result_keeps_state():
+    breaker = half_open_breaker()
+    breaker.before_call()
+    breaker.record_failure()
+    breaker.release_trial()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+class RejectingQuota:
+    async def acquire(self, priority=None, cost=1):
+        raise QuotaExceeded("no quota")
+
+
+class BlockingQuota:
+    async def acquire(self, priority=None, cost=1):
+        await asyncio.sleep(3600)
+
+
+# Пробный запрос, не дошедший до API, не должен оставлять цепь полуоткрытой навсегда
+@pytest.mark.parametrize("quota", [RejectingQuota(), BlockingQuota()])
+def test_trial_released_when_request_never_sent(quota):
+    pytest.importorskip("httpx")
+    pytest.importorskip("prometheus_client")
+    from weather_client import WeatherClient
+
+    async def scenario():
+        client = WeatherClient("key", quota=quota)
+        client.breaker = half_open_breaker()
+        task = asyncio.ensure_future(client.get_current(55.75, 37.62))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises((QuotaExceeded, asyncio.CancelledError)):
+            await task
+        assert client.breaker.before_call() is True
+        await client.aclose()
+
+    asyncio.run(scenario())
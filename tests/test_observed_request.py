@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("telegram")
+pytest.importorskip("prometheus_client")
+
+from metrics import ObservedRequest, TELEGRAM_POOL_SIZE
+
+# Сколько обновлений обрабатывается одновременно (BOT_CONCURRENCY по умолчанию)
+CONCURRENCY = 8
+
+# Время ответа заглушки Bot API: одновременные запросы через одно соединение
+# не уложились бы в pool_timeout
+RESPONSE_DELAY = 0.3
+
+
+async def serve_slow_bot_api():
+    async def handle(reader, writer):
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        await asyncio.sleep(RESPONSE_DELAY)
+        body = b'{"ok": true, "result": true}'
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                     b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+        await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+def test_default_pool_matches_application_builder():
+    assert TELEGRAM_POOL_SIZE >= CONCURRENCY
+    request = ObservedRequest()
+    assert request._client_kwargs["limits"].max_connections == TELEGRAM_POOL_SIZE
+
+
+# Одновременные методы Bot API не ждут друг друга в пуле соединений
+def test_concurrent_requests_do_not_hit_pool_timeout():
+    async def scenario():
+        server = await serve_slow_bot_api()
+        port = server.sockets[0].getsockname()[1]
+        request = ObservedRequest()
+        await request.initialize()
+        try:
+            return await asyncio.gather(*(
+                request.do_request(f"http://127.0.0.1:{port}/bot123:abc/sendMessage", "POST")
+                for _ in range(CONCURRENCY)
+            ))
+        finally:
+            await request.shutdown()
+            server.close()
+            await server.wait_closed()
+
+    results = asyncio.run(scenario())
+    assert [code for code, _ in results] == [200] * CONCURRENCY
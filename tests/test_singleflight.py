@@ -0,0 +1,38 @@
+import asyncio
+
+from quota import QuotaGovernor, request_priority, INTERACTIVE, BACKGROUND
+from singleflight import SingleFlight
+
+
+# Пользовательский запрос, присоединившийся к фоновому, который ждет квоту,
+# получает ее раньше других фоновых запросов
+def test_shared_call_takes_priority_of_interactive_waiter():
+    async def scenario():
+        quota = QuotaGovernor(per_minute=600, per_day=100000)
+        flights = SingleFlight()
+        order = []
+
+        async def fetch(name):
+            await quota.acquire()
+            order.append(name)
+            return name
+
+        async def background(name):
+            request_priority.set(BACKGROUND)
+            return await flights.do(name, fetch, name)
+
+        # Квота на эту минуту израсходована, фоновые запросы встают в очередь
+        await quota.acquire(cost=600)
+        other = asyncio.ensure_future(background("other"))
+        await asyncio.sleep(0)
+        shared = asyncio.ensure_future(background("shared"))
+        await asyncio.sleep(0.01)
+        assert quota.stats()["waiting"] == 2
+        assert request_priority.get() == INTERACTIVE
+        joined = await flights.do("shared", fetch, "shared")
+        await asyncio.gather(other, shared)
+        return joined, order
+
+    joined, order = asyncio.run(scenario())
+    assert joined == "shared"
+    assert order == ["shared", "other"]
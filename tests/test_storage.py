@@ -0,0 +1,95 @@
+import json
+
+from storage import SqliteUserStore, JournaledUserStore, recover_journal
+
+
+def open_base(tmp_path):
+    return SqliteUserStore(str(tmp_path / "users.db"), json_path=None)
+
+
+def write_journal(path, records, tail=""):
+    with open(path, "w", encoding="utf-8") as file:
+        for user_id, user in records:
+            file.write(json.dumps({"id": user_id, "user": user}) + "\n")
+        file.write(tail)
+
+
+# Журнал после аварийной остановки: побеждает последняя запись пользователя,
+# недописанная строка пропускается, после переноса в базу журнал очищается
+def test_recover_journal_applies_latest_records(tmp_path):
+    journal = tmp_path / "users.journal"
+    write_journal(journal, [
+        ("1", {"locations": [], "digest": False}),
+        ("2", {"locations": []}),
+        ("1", {"locations": [], "digest": True}),
+    ], tail='{"id": "3", "us')
+    base = open_base(tmp_path)
+
+    assert recover_journal(base, str(journal)) == 2
+    assert base.get_user(1)["digest"] is True
+    assert base.count() == 2
+    assert journal.read_text() == ""
+    base.close()
+
+
+def test_recover_journal_without_file(tmp_path):
+    base = open_base(tmp_path)
+    assert recover_journal(base, str(tmp_path / "missing.journal")) == 0
+    base.close()
+
+
+# Перенос журнала в базу и его очистка идут durable-коммитом (synchronous=FULL)
+def test_durable_save_commits_with_full_sync(tmp_path):
+    base = open_base(tmp_path)
+    statements = []
+    base._conn.set_trace_callback(statements.append)
+
+    base.save_users([("1", {"locations": []})], durable=True)
+
+    commit = statements.index("COMMIT")
+    assert "PRAGMA synchronous=FULL" in statements[:commit]
+    assert statements[-1] == "PRAGMA synchronous=NORMAL"
+    assert base._conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+    base.close()
+
+
+# Когда журнал разрастается, изменения переносятся в SQLite, а журнал очищается
+def test_compaction_moves_journal_to_database(tmp_path):
+    journal = tmp_path / "users.journal"
+    store = JournaledUserStore(open_base(tmp_path), str(journal), flush_interval=0, compact_records=3)
+    for user_id in range(3):
+        store.save_user(user_id, {"locations": [], "digest": True})
+    store.flush()
+
+    assert journal.read_text() == ""
+    assert store.base.count() == 3
+    store.save_user(5, {"locations": []})
+    store.flush()
+    assert journal.read_text().count("\n") == 1
+    store.close()
+
+    reopened = JournaledUserStore(open_base(tmp_path), str(journal))
+    assert reopened.get_user(0)["digest"] is True
+    assert dict(reopened.all_users()).keys() == {"0", "1", "2", "5"}
+    reopened.close()
+
+
+# Изменения, которые остались только в журнале, применяются при следующем запуске
+def test_journal_replayed_on_restart(tmp_path):
+    journal = tmp_path / "users.journal"
+    store = JournaledUserStore(open_base(tmp_path), str(journal), flush_interval=0)
+    store.save_user(7, {"locations": [], "digest": True})
+    store.flush()
+    store._closed = True  # аварийная остановка: close() и перенос в базу не выполняются
+    with store._condition:
+        store._condition.notify_all()
+    store._writer.join()
+    store._journal.close()
+    store.base.close()
+
+    base = open_base(tmp_path)
+    assert base.count() == 0
+    reopened = JournaledUserStore(base, str(journal))
+    assert reopened.get_user(7)["digest"] is True
+    assert reopened.base.count() == 1
+    reopened.close()
@@ -0,0 +1,24 @@
+import pytest
+
+pytest.importorskip("telegram")
+
+from webhook import check_secret, require_secret
+
+
+def test_check_secret():
+    assert check_secret("s3cret", "s3cret")
+    assert not check_secret("wrong", "s3cret")
+    assert not check_secret(None, "s3cret")
+    assert not check_secret("", "")
+
+
+# Werkzeug декодирует заголовки как latin-1: не-ASCII значение — отказ, а не исключение
+def test_check_secret_with_non_ascii_header():
+    assert not check_secret("sécret", "s3cret")
+    assert not check_secret("ключ", "s3cret")
+
+
+def test_require_secret():
+    with pytest.raises(RuntimeError):
+        require_secret("")
+    require_secret("s3cret")
@@ -0,0 +1,148 @@
+import os
+import time
+import asyncio
+import logging
+import httpx
+from circuit_breaker import CircuitBreaker
+from metrics import UPSTREAM_LATENCY, UPSTREAM_ERRORS
+from profiling import span
+
+logger = logging.getLogger(__name__)
+
+# Базовый адрес OpenWeatherMap API
+API_BASE_URL = os.environ.get("WEATHER_API_BASE_URL", "https://api.openweathermap.org/data/2.5")
+
+# Таймауты (в секундах) и размер пула соединений, настраиваются через переменные окружения
+CONNECT_TIMEOUT = float(os.environ.get("WEATHER_CONNECT_TIMEOUT", "3"))
+READ_TIMEOUT = float(os.environ.get("WEATHER_READ_TIMEOUT", "5"))
+MAX_CONNECTIONS = int(os.environ.get("WEATHER_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("WEATHER_MAX_KEEPALIVE_CONNECTIONS", "10"))
+
+# Сколько населенных пунктов OpenWeatherMap принимает в одном групповом запросе
+GROUP_MAX_IDS = 20
+
+
+# Ошибка ответа OpenWeatherMap
+class WeatherAPIError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# Асинхронный клиент OpenWeatherMap с общим пулом keep-alive соединений.
+# Если передан quota (QuotaGovernor), каждый запрос сначала получает квоту.
+# Сетевые ошибки, 429 и 5xx считаются выключателем breaker: пока он разомкнут,
+# запросы сразу завершаются CircuitOpenError, не дожидаясь таймаутов.
+class WeatherClient:
+    def __init__(self, api_key, base_url=API_BASE_URL,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 max_connections=MAX_CONNECTIONS,
+                 max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS, quota=None):
+        self.api_key = api_key
+        self.quota = quota
+        self.breaker = CircuitBreaker("OpenWeatherMap")
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections
+            )
+        )
+
+    # Выполнение GET-запроса к API с общими параметрами (вместе с ожиданием квоты —
+    # этап fetch в трассе обновления). cost — сколько запросов квоты он расходует.
+    async def _get(self, path, params, cost=1):
+        with span("fetch"):
+            return await self._request(path, params, cost)
+
+    async def _request(self, path, params, cost=1):
+        try:
+            trial = self.breaker.before_call()
+        except Exception as e:
+            UPSTREAM_ERRORS.labels(path, type(e).__name__).inc()
+            raise
+        try:
+            return await self._send(path, params, cost)
+        finally:
+            # Ответ записан в выключатель через record_success/record_failure; если его не было,
+            # пробный запрос освобождается, иначе цепь навсегда останется полуоткрытой
+            if trial:
+                self.breaker.release_trial()
+
+    async def _send(self, path, params, cost=1):
+        if self.quota is not None:
+            try:
+                await self.quota.acquire(cost=cost)
+            except Exception as e:
+                UPSTREAM_ERRORS.labels(path, type(e).__name__).inc()
+                raise
+        params = dict(params, appid=self.api_key, units="metric", lang="ru")
+        started = time.perf_counter()
+        try:
+            response = await self._client.get(path, params=params)
+        except httpx.HTTPError as e:
+            self.breaker.record_failure()
+            UPSTREAM_ERRORS.labels(path, type(e).__name__).inc()
+            raise
+        finally:
+            UPSTREAM_LATENCY.labels(path).observe(time.perf_counter() - started)
+        if response.status_code == 429 or response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        if response.status_code != 200:
+            UPSTREAM_ERRORS.labels(path, f"http_{response.status_code}").inc()
+            raise WeatherAPIError(f"Failed to get {path}: {response.status_code}", response.status_code)
+        return response.json()
+
+    # Текущая погода по названию населенного пункта
+    async def get_weather_by_name(self, location_name):
+        return await self._get("/weather", {"q": location_name})
+
+    # Текущая погода по координатам
+    async def get_current(self, lat, lon):
+        return await self._get("/weather", {"lat": lat, "lon": lon})
+
+    # Текущая погода сразу для нескольких населенных пунктов (не больше GROUP_MAX_IDS) по их id
+    async def get_current_group(self, city_ids):
+        # OpenWeatherMap считает каждый id группового запроса отдельным запросом
+        data = await self._get("/group", {"id": ",".join(str(city_id) for city_id in city_ids)},
+                               cost=len(city_ids))
+        return data.get("list", [])
+
+    # Текущая погода для любого числа населенных пунктов: id делятся на группы по GROUP_MAX_IDS,
+    # группы запрашиваются одновременно. Результат: {city_id: ответ /weather}; группы,
+    # запрос которых не удался, пропускаются.
+    async def get_current_many(self, city_ids):
+        city_ids = list(dict.fromkeys(city_ids))
+        # Группа не больше минутной квоты, иначе она никогда не получит столько запросов сразу
+        size = GROUP_MAX_IDS if self.quota is None else max(1, min(GROUP_MAX_IDS, self.quota.per_minute))
+        batches = [city_ids[start:start + size] for start in range(0, len(city_ids), size)]
+        responses = await asyncio.gather(
+            *(self.get_current_group(batch) for batch in batches), return_exceptions=True
+        )
+        results = {}
+        for batch, response in zip(batches, responses):
+            if isinstance(response, Exception):
+                logger.warning(f"Group weather request for {len(batch)} cities failed: {response}")
+                continue
+            for current_data in response:
+                results[current_data["id"]] = current_data
+        return results
+
+    # 5-дневный прогноз с шагом 3 часа по координатам
+    async def get_forecast(self, lat, lon):
+        return await self._get("/forecast", {"lat": lat, "lon": lon})
+
+    # Текущая погода и прогноз, запрошенные одновременно
+    async def get_current_and_forecast(self, lat, lon):
+        current_data, forecast_data = await asyncio.gather(
+            self.get_current(lat, lon),
+            self.get_forecast(lat, lon)
+        )
+        return current_data, forecast_data
+
+    # Закрытие пула соединений
+    async def aclose(self):
+        await self._client.aclose()
@@ -0,0 +1,95 @@
+import os
+import hmac
+import atexit
+import asyncio
+import logging
+import threading
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Публичный адрес веб-процесса (например, https://fishnibble.herokuapp.com)
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+
+# Путь, по которому Telegram присылает обновления
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+
+# Секрет, который Telegram передает в заголовке X-Telegram-Bot-Api-Secret-Token
+# (обязателен: без него кто угодно может присылать боту поддельные обновления)
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+
+# Сколько одновременных соединений Telegram может открыть к webhook
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+
+# Регистрация webhook в Telegram
+async def register_webhook(bot, url, secret=WEBHOOK_SECRET, max_connections=WEBHOOK_MAX_CONNECTIONS):
+    await bot.set_webhook(
+        url=url,
+        secret_token=secret,
+        max_connections=max_connections,
+        allowed_updates=Update.ALL_TYPES
+    )
+    logger.info(f"Webhook set to {url}")
+
+
+# Проверка, что секрет задан: без него режим webhook не запускается
+def require_secret(secret=WEBHOOK_SECRET):
+    if not secret:
+        raise RuntimeError("WEBHOOK_SECRET must be set in webhook mode")
+
+
+# Проверка секрета из заголовка запроса. Сравниваются байты: compare_digest не принимает
+# строки с не-ASCII символами, а заголовок присылает кто угодно
+def check_secret(token, secret=WEBHOOK_SECRET):
+    return bool(secret) and hmac.compare_digest((token or "").encode(), secret.encode())
+
+
+# Остановка приложения вместе с post_shutdown: PTB вызывает его только из run_polling
+# и run_webhook, а без него не сохраняются снимок кэша и не закрываются соединения и базы
+async def shutdown_application(application):
+    await application.stop()
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+# Приложение бота, работающее в отдельном потоке со своим циклом событий внутри веб-процесса.
+# Веб-обработчик только проверяет секрет и кладет обновление в очередь приложения,
+# а обработка идет асинхронно в цикле бота.
+class WebhookBot:
+    def __init__(self, application, url=WEBHOOK_URL, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET,
+                 max_connections=WEBHOOK_MAX_CONNECTIONS):
+        require_secret(secret)
+        self.application = application
+        self.url = url.rstrip("/") + path
+        self.secret = secret
+        self.max_connections = max_connections
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="bot-loop", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._startup(), self.loop).result()
+        atexit.register(self.stop)
+
+    async def _startup(self):
+        await self.application.initialize()
+        await self.application.start()
+        await register_webhook(self.application.bot, self.url, self.secret, self.max_connections)
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def _shutdown(self):
+        await shutdown_application(self.application)
+
+    # Проверка секрета из заголовка запроса
+    def verify(self, token):
+        return check_secret(token, self.secret)
+
+    # Передача обновления в очередь приложения без ожидания обработки
+    def submit(self, data):
+        update = Update.de_json(data, self.application.bot)
+        asyncio.run_coroutine_threadsafe(self.application.update_queue.put(update), self.loop)